@@ -0,0 +1,258 @@
+__author__ = 'rafael'
+
+import ipaddress
+import socket
+
+import numpy
+
+from stratus import cirrus
+
+# Evaluates flows against network ACLs in bulk.
+
+# The entries of each ACL from describe_network_acls are compiled into
+# array-backed rule tables, one per direction, sorted by rule number: protocol,
+# port (or ICMP type) range and CIDR as a 128-bit integer range. A batch of
+# (src, dst, protocol, port, direction) flows is then matched against every
+# rule at once with NumPy comparisons and the first matching rule gives the
+# verdict, as EC2 does. IPv4 addresses are mapped into the IPv6 space
+# (::ffff:a.b.c.d) so both families share one table; every rule and flow also
+# carries its address family, and a rule only matches flows of its own family
+# (an IPv6 rule such as ::/0 never matches IPv4 traffic).
+#
+# Usage:
+#     from stratus import aclengine
+#
+#     engine = aclengine.load(vpc_ids=['vpc-?'])
+#     allowed, rules = engine.evaluate('acl-?', [
+#         ('203.0.113.7', '10.0.1.5', 'tcp', 443, 'ingress'),
+#         ('10.0.1.5', '198.51.100.1', 'udp', 53, 'egress'),
+#     ])
+
+PROTOCOLS = {'-1': -1, 'all': -1, 'icmp': 1, 'tcp': 6, 'udp': 17, 'icmpv6': 58}
+
+# Protocols whose rules use PortRange, and whose rules use IcmpTypeCode.
+_PORT_PROTOCOLS = (6, 17)
+_ICMP_PROTOCOLS = (1, 58)
+
+_ANY_PORT = (-(2 ** 31), 2 ** 31 - 1)
+_MASK64 = (1 << 64) - 1
+_V4_MAPPED = 0xffff << 32
+
+# Flows evaluated per NumPy pass; bounds the flows x rules match matrix.
+_CHUNK = 65536
+
+
+def protocol_number(protocol):
+    '''
+    Returns the IP protocol number for a name ('tcp'), a number string ('6')
+    or a number; -1 means all protocols.
+    :param protocol: (str|int)
+    :return: (int)
+    '''
+    if isinstance(protocol, int):
+        return protocol
+    protocol = str(protocol).lower()
+    if protocol in PROTOCOLS:
+        return PROTOCOLS[protocol]
+    return int(protocol)
+
+
+def _address(address):
+    '''
+    Returns the address family (4 or 6) of an IPv4 or IPv6 address and the
+    address as a 128-bit integer, IPv4 mapped into ::ffff:0:0/96.
+    '''
+    try:
+        return 4, _V4_MAPPED | int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+    except OSError:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+
+
+def _network(cidr):
+    '''
+    Returns the address family of a CIDR and its first and last address as
+    128-bit integers.
+    '''
+    network = ipaddress.ip_network(cidr, strict=False)
+    low, high = int(network.network_address), int(network.broadcast_address)
+    if network.version == 4:
+        low, high = low | _V4_MAPPED, high | _V4_MAPPED
+    return network.version, low, high
+
+
+class _RuleTable:
+    '''
+    Rules of one direction of one ACL as parallel arrays sorted by rule number.
+    '''
+
+    def __init__(self, entries):
+        entries = sorted(entries, key=lambda entry: entry['RuleNumber'])
+        rows = []
+        for entry in entries:
+            cidr = entry.get('CidrBlock') or entry.get('Ipv6CidrBlock')
+            if not cidr:
+                continue
+            protocol = protocol_number(entry['Protocol'])
+            port_from, port_to = _ANY_PORT
+            if protocol in _PORT_PROTOCOLS and 'PortRange' in entry:
+                port_from, port_to = entry['PortRange']['From'], entry['PortRange']['To']
+            elif protocol in _ICMP_PROTOCOLS and 'IcmpTypeCode' in entry:
+                icmp_type = entry['IcmpTypeCode'].get('Type', -1)
+                if icmp_type != -1:
+                    port_from = port_to = icmp_type
+            family, low, high = _network(cidr)
+            rows.append((entry['RuleNumber'], entry['RuleAction'] == 'allow', protocol,
+                         port_from, port_to, low, high, family))
+        self.rule_number = numpy.array([row[0] for row in rows], dtype=numpy.int32)
+        self.allow = numpy.array([row[1] for row in rows], dtype=bool)
+        self.protocol = numpy.array([row[2] for row in rows], dtype=numpy.int16)
+        self.port_from = numpy.array([row[3] for row in rows], dtype=numpy.int64)
+        self.port_to = numpy.array([row[4] for row in rows], dtype=numpy.int64)
+        self.low_hi = numpy.array([row[5] >> 64 for row in rows], dtype=numpy.uint64)
+        self.low_lo = numpy.array([row[5] & _MASK64 for row in rows], dtype=numpy.uint64)
+        self.high_hi = numpy.array([row[6] >> 64 for row in rows], dtype=numpy.uint64)
+        self.high_lo = numpy.array([row[6] & _MASK64 for row in rows], dtype=numpy.uint64)
+        self.family = numpy.array([row[7] for row in rows], dtype=numpy.uint8)
+
+    def match(self, family, address_hi, address_lo, protocol, port):
+        '''
+        Returns the index of the first matching rule per flow, -1 for none.
+        '''
+        result = numpy.full(len(protocol), -1, dtype=numpy.int64)
+        if not len(self.rule_number):
+            return result
+        for start in range(0, len(protocol), _CHUNK):
+            end = start + _CHUNK
+            f = family[start:end, None]
+            a_hi = address_hi[start:end, None]
+            a_lo = address_lo[start:end, None]
+            p = protocol[start:end, None]
+            n = port[start:end, None]
+            matches = self.family == f
+            matches &= (self.protocol == -1) | (self.protocol == p)
+            matches &= (self.port_from <= n) & (n <= self.port_to)
+            matches &= (a_hi > self.low_hi) | ((a_hi == self.low_hi) & (a_lo >= self.low_lo))
+            matches &= (a_hi < self.high_hi) | ((a_hi == self.high_hi) & (a_lo <= self.high_lo))
+            first = matches.argmax(axis=1)
+            result[start:end] = numpy.where(matches.any(axis=1), first, -1)
+        return result
+
+
+class CompiledAcl:
+    '''
+    Ingress and egress rule tables of one network ACL.
+
+    Args:
+        network_acl (dict): Network ACL from describe_network_acls.
+    '''
+
+    def __init__(self, network_acl):
+        self.network_acl_id = network_acl['NetworkAclId']
+        entries = network_acl.get('Entries', [])
+        self.ingress = _RuleTable(entry for entry in entries if not entry['Egress'])
+        self.egress = _RuleTable(entry for entry in entries if entry['Egress'])
+
+    def evaluate(self, flows):
+        '''
+        Evaluates a batch of flows.
+        :param flows: Sequence of (src, dst, protocol, port, direction);
+            direction is 'ingress' or 'egress', port is the ICMP type for
+            ICMP flows. Ingress rules match the source address and egress
+            rules the destination, as in EC2.
+        :return: (allowed, rule_numbers) NumPy arrays; rule_numbers is -1
+            where no rule matched, which EC2 denies.
+        '''
+        count = len(flows)
+        family = numpy.empty(count, dtype=numpy.uint8)
+        address = numpy.empty(count, dtype=object)
+        protocol = numpy.empty(count, dtype=numpy.int16)
+        port = numpy.empty(count, dtype=numpy.int64)
+        egress = numpy.empty(count, dtype=bool)
+        for i, (source, destination, flow_protocol, flow_port, direction) in enumerate(flows):
+            is_egress = direction == 'egress' or direction is True
+            egress[i] = is_egress
+            family[i], address[i] = _address(destination if is_egress else source)
+            protocol[i] = protocol_number(flow_protocol)
+            port[i] = -1 if flow_port is None else flow_port
+        address_hi = numpy.array([value >> 64 for value in address], dtype=numpy.uint64)
+        address_lo = numpy.array([value & _MASK64 for value in address], dtype=numpy.uint64)
+
+        allowed = numpy.zeros(count, dtype=bool)
+        rule_numbers = numpy.full(count, -1, dtype=numpy.int32)
+        for table, selected in ((self.ingress, ~egress), (self.egress, egress)):
+            indexes = numpy.nonzero(selected)[0]
+            if not len(indexes):
+                continue
+            first = table.match(family[indexes], address_hi[indexes], address_lo[indexes],
+                                protocol[indexes], port[indexes])
+            matched = first >= 0
+            allowed[indexes[matched]] = table.allow[first[matched]]
+            rule_numbers[indexes[matched]] = table.rule_number[first[matched]]
+        return allowed, rule_numbers
+
+
+class AclEngine:
+    '''
+    Compiled network ACLs and the subnets associated with them.
+    '''
+
+    def __init__(self, network_acls=()):
+        self.acls = {}
+        self.subnet_acls = {}
+        for network_acl in network_acls:
+            self.add(network_acl)
+
+    def add(self, network_acl):
+        '''
+        Compiles one network ACL from describe_network_acls output.
+        :param network_acl: Network ACL dictionary.
+        :return: (CompiledAcl)
+        '''
+        compiled = CompiledAcl(network_acl)
+        self.acls[compiled.network_acl_id] = compiled
+        for association in network_acl.get('Associations', []):
+            self.subnet_acls[association['SubnetId']] = compiled.network_acl_id
+        return compiled
+
+    def evaluate(self, network_acl_id, flows):
+        '''
+        Evaluates a batch of flows against one ACL, see CompiledAcl.evaluate.
+        :param network_acl_id: Id of the network ACL.
+        :param flows: Sequence of (src, dst, protocol, port, direction).
+        :return: (allowed, rule_numbers) NumPy arrays.
+        '''
+        return self.acls[network_acl_id].evaluate(flows)
+
+    def evaluate_subnet(self, subnet_id, flows):
+        '''
+        Evaluates a batch of flows against the ACL associated with a subnet.
+        :param subnet_id: Id of the subnet.
+        :param flows: Sequence of (src, dst, protocol, port, direction).
+        :return: (allowed, rule_numbers) NumPy arrays.
+        '''
+        return self.evaluate(self.subnet_acls[subnet_id], flows)
+
+
+def compile_acls(response):
+    '''
+    Compiles the network ACLs of a describe_network_acls response.
+    :param response: describe_network_acls response, or an iterable of
+        network ACL dictionaries such as iter_network_acls().
+    :return: (AclEngine)
+    '''
+    if isinstance(response, dict):
+        response = response.get('NetworkAcls', [])
+    return AclEngine(response)
+
+
+def load(client=None, vpc_ids=None):
+    '''
+    Compiles the network ACLs of some or all VPCs.
+    :param client: EC2 client; default client if None.
+    :param vpc_ids: VPCs to load; all VPCs visible to the client if None.
+    :return: (AclEngine)
+    '''
+    kwargs = {}
+    if vpc_ids is not None:
+        kwargs['Filters'] = [{'Name': 'vpc-id', 'Values': list(vpc_ids)}]
+    return AclEngine(cirrus.iter_network_acls(client=client, **kwargs))
@@ -0,0 +1,178 @@
+__author__ = 'rafael'
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from stratus import cirrus
+from stratus import tracing
+
+# Brings network ACLs to a desired set of entries with the fewest calls.
+
+# The current entries of every ACL come from one describe_network_acls call.
+# An entry is identified by its direction and rule number, so a desired entry
+# whose rule number is already taken replaces that entry in place instead of
+# colliding with it. Per ACL the changes are applied in this order:
+#
+#     replace changed entries -> create new entries -> delete leftover entries
+#
+# so a rule number is never briefly missing while it changes, and every new
+# rule is in place before the old ones go. Old and new rules side by side can
+# exceed the quota of entries per direction (MAX_ENTRIES); in a direction where
+# they would, the leftover entries are deleted before the new ones are created
+# instead. ACLs are reconciled concurrently.
+# The default entries (rule 32767, and 32768 for IPv6 in ACLs of IPv6-enabled
+# VPCs) cannot be changed and are ignored.
+#
+# Entries use the keys of cirrus.create_network_acl_entry.
+#
+# Usage:
+#     from stratus import aclsync
+#
+#     result = aclsync.sync_acls({
+#         'acl-?': [
+#             {'RuleNumber': 100, 'Egress': False, 'Protocol': '6', 'RuleAction': 'allow',
+#              'CidrBlock': '0.0.0.0/0', 'PortRange': {'From': 443, 'To': 443}},
+#             {'RuleNumber': 100, 'Egress': True, 'Protocol': '-1', 'RuleAction': 'allow',
+#              'CidrBlock': '0.0.0.0/0'},
+#         ],
+#     }, DryRun=False)
+
+# Lowest rule number of the default entries EC2 adds to every ACL: 32767 for
+# IPv4 and 32768 for IPv6. Rule numbers from here up are reserved.
+DEFAULT_RULE_NUMBER = 32767
+
+# Entries allowed per direction of an ACL, not counting the default entries.
+# The quota can be raised per account, up to 40.
+MAX_ENTRIES = 20
+
+_PROTOCOLS = {'all': '-1', 'icmp': '1', 'tcp': '6', 'udp': '17', 'icmpv6': '58'}
+
+
+def _key(entry):
+    return bool(entry['Egress']), int(entry['RuleNumber'])
+
+
+def _normalize(entry):
+    '''
+    Returns the parts of an entry EC2 compares, in describe_network_acls
+    form. Port ranges only apply to TCP and UDP and ICMP types only to ICMP.
+    '''
+    protocol = str(entry['Protocol']).lower()
+    protocol = _PROTOCOLS.get(protocol, protocol)
+    normalized = {
+        'Protocol': protocol,
+        'RuleAction': entry['RuleAction'],
+        'CidrBlock': entry.get('CidrBlock'),
+        'Ipv6CidrBlock': entry.get('Ipv6CidrBlock'),
+    }
+    if protocol in ('6', '17'):
+        port_range = entry.get('PortRange', {})
+        normalized['PortRange'] = (port_range.get('From'), port_range.get('To'))
+    elif protocol in ('1', '58'):
+        icmp = entry.get('IcmpTypeCode', {})
+        normalized['IcmpTypeCode'] = (icmp.get('Type'), icmp.get('Code'))
+    return normalized
+
+
+def plan_entries(desired, network_acls, prune=True, max_entries=MAX_ENTRIES):
+    '''
+    Diffs desired entries against the current network ACLs.
+    :param desired: {network ACL id: [entry,]}, entries as
+        create_network_acl_entry keyword arguments without NetworkAclId.
+    :param network_acls: Network ACL dictionaries from describe_network_acls.
+    :param prune: Delete current entries that are not desired.
+    :param max_entries: Entry quota per direction; deletes go before the
+        creates of a direction that would exceed it.
+    :return: {network ACL id: [(action, kwargs),]} with action 'replace',
+        'create' or 'delete', in the order they have to be applied.
+    '''
+    acls = {network_acl['NetworkAclId']: network_acl for network_acl in network_acls}
+    plan = {}
+    for network_acl_id, entries in desired.items():
+        if network_acl_id not in acls:
+            raise ValueError('network ACL not found: {}'.format(network_acl_id))
+        current = {_key(entry): entry for entry in acls[network_acl_id].get('Entries', [])
+                   if entry['RuleNumber'] < DEFAULT_RULE_NUMBER}
+        replaces, creates, deletes = [], [], []
+        wanted = set()
+        for entry in entries:
+            key = _key(entry)
+            if key[1] >= DEFAULT_RULE_NUMBER:
+                continue
+            if key in wanted:
+                raise ValueError('duplicate {} rule {} for {}'.format(
+                    'egress' if key[0] else 'ingress', key[1], network_acl_id))
+            wanted.add(key)
+            kwargs = dict(entry, NetworkAclId=network_acl_id)
+            existing = current.get(key)
+            if existing is None:
+                creates.append(('create', kwargs))
+            elif _normalize(existing) != _normalize(entry):
+                replaces.append(('replace', kwargs))
+        if prune:
+            for key in sorted(set(current) - wanted):
+                deletes.append(('delete', {'NetworkAclId': network_acl_id,
+                                           'Egress': key[0], 'RuleNumber': key[1]}))
+        crowded = {egress for egress in (False, True)
+                   if sum(1 for key in current if key[0] == egress)
+                   + sum(1 for _, kwargs in creates if bool(kwargs['Egress']) == egress) > max_entries}
+        early = [change for change in deletes if change[1]['Egress'] in crowded]
+        late = [change for change in deletes if change[1]['Egress'] not in crowded]
+        changes = replaces + early + creates + late
+        if changes:
+            plan[network_acl_id] = changes
+    return plan
+
+
+_ACTIONS = {
+    'replace': cirrus.replace_network_acl_entry,
+    'create': cirrus.create_network_acl_entry,
+    'delete': cirrus.delete_network_acl_entry,
+}
+
+
+def apply_plan(plan, client=None, DryRun=False, max_workers=16):
+    '''
+    Applies the changes of every ACL in order, ACLs concurrently.
+    :param plan: Value returned by plan_entries.
+    :param client: EC2 client; default client if None.
+    :param DryRun: Passed to every cirrus call.
+    :param max_workers: ACLs reconciled at once.
+    :return: Dictionary with a Counter of applied changes per action under
+        'applied' and the (action, kwargs) that failed under 'failed'.
+    '''
+    def apply(changes):
+        return [_ACTIONS[action](client=client, DryRun=DryRun, **kwargs)
+                for action, kwargs in changes]
+
+    result = {'applied': Counter(), 'failed': []}
+    if not plan:
+        return result
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for changes, responses in zip(plan.values(), executor.map(tracing.propagate(apply), plan.values())):
+            for change, response in zip(changes, responses):
+                if response is None:
+                    result['failed'].append(change)
+                else:
+                    result['applied'][change[0]] += 1
+    return result
+
+
+@tracing.traced('aclsync.sync_acls')
+def sync_acls(desired, client=None, DryRun=False, prune=True, max_workers=16,
+              max_entries=MAX_ENTRIES):
+    '''
+    Makes the entries of many network ACLs match the desired ones.
+    :param desired: {network ACL id: [entry,]}, see plan_entries.
+    :param client: EC2 client; default client if None.
+    :param DryRun: Passed to every mutating cirrus call.
+    :param prune: Delete current entries that are not desired.
+    :param max_workers: ACLs reconciled at once.
+    :param max_entries: Entry quota per direction, see plan_entries.
+    :return: Value of apply_plan, plus the plan under 'plan'.
+    '''
+    network_acls = list(cirrus.iter_network_acls(client=client, NetworkAclIds=list(desired)))
+    plan = plan_entries(desired, network_acls, prune=prune, max_entries=max_entries)
+    result = apply_plan(plan, client=client, DryRun=DryRun, max_workers=max_workers)
+    result['plan'] = plan
+    return result
@@ -0,0 +1,204 @@
+__author__ = 'rafael'
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import itertools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from stratus import cirrus
+
+# asyncio counterparts of the cirrus functions.
+
+# Every public cirrus function has a coroutine of the same name and arguments
+# here; the iter_* functions are async generators. boto3 clients are
+# blocking, so the calls run on one shared, fixed-size thread pool; a
+# semaphore per event loop admits at most max_concurrency calls into it at a
+# time. Any number of operations can be awaited at once: the ones not
+# admitted yet wait on the semaphore without holding a thread. The calls go
+# through cirrus itself, so they share the client registry, the rate limiter,
+# the describe cache, plan mode, metrics and tracing context with the
+# synchronous API.
+#
+# Cancelling a task that is still waiting for admission means its call never
+# runs. A call already running on a thread cannot be interrupted; its result
+# is discarded and its slot is freed when it returns. An iter_* async
+# generator closed early, by aclose() or cancellation, closes the cirrus
+# generator behind it.
+#
+# Usage:
+#     import asyncio
+#     from stratus import aio
+#
+#     async def build(cidrs):
+#         vpc = await aio.create_vpc('main', DryRun=False, CidrBlock='10.0.0.0/16',
+#                                    InstanceTenancy='default',
+#                                    AmazonProvidedIpv6CidrBlock=False)
+#         vpc_id = vpc['Vpc']['VpcId']
+#         await asyncio.gather(*(aio.create_subnet('subnet-{}'.format(index), DryRun=False,
+#                                                  VpcId=vpc_id, CidrBlock=cidr)
+#                                for index, cidr in enumerate(cidrs)))
+#         async for subnet in aio.iter_subnets(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}]):
+#             print(subnet['SubnetId'])
+#
+#     aio.configure(max_concurrency=64)
+#     asyncio.run(build(['10.0.0.0/24', '10.0.1.0/24']))
+
+# Resources an iter_* async generator fetches per thread hand-off.
+ITER_BATCH = 100
+
+
+class Runner:
+    '''
+    Runs blocking functions on a shared thread pool with bounded concurrency.
+
+    Args:
+        max_concurrency (int): Calls running at once, which is also the
+            number of threads.
+    '''
+
+    def __init__(self, max_concurrency=32):
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                           thread_name_prefix='stratus-aio')
+        self._semaphores = weakref.WeakKeyDictionary()
+        # Calls waiting for or holding a slot, so close() can let them finish.
+        self._calls = 0
+        self._closing = False
+        self._lock = threading.Lock()
+
+    def _semaphore(self, loop):
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def run(self, func, *args, **kwargs):
+        '''
+        Calls func(*args, **kwargs) on the pool once a slot is free, in a copy
+        of the caller's context.
+        :return: Return value of func.
+        '''
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphore(loop)
+        with self._lock:
+            self._calls += 1
+        try:
+            await semaphore.acquire()
+            try:
+                context = contextvars.copy_context()
+                future = self.executor.submit(context.run, func, *args, **kwargs)
+            except BaseException:
+                semaphore.release()
+                raise
+
+            def release(_):
+                # Runs when the call returns, or at once if it was cancelled
+                # before it started.
+                try:
+                    loop.call_soon_threadsafe(semaphore.release)
+                except RuntimeError:
+                    pass
+
+            future.add_done_callback(release)
+            return await asyncio.wrap_future(future)
+        finally:
+            with self._lock:
+                self._calls -= 1
+                idle = self._closing and not self._calls
+            if idle:
+                self.executor.shutdown(wait=False)
+
+    def close(self):
+        '''
+        Stops the thread pool once every call waiting for or holding a slot
+        has finished; new calls should go to another runner.
+        :return:
+        '''
+        with self._lock:
+            self._closing = True
+            idle = not self._calls
+        if idle:
+            self.executor.shutdown(wait=False)
+
+    def shutdown(self, wait=True):
+        '''
+        Stops the thread pool.
+        :param wait: Wait for running calls to return.
+        :return:
+        '''
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# Runner used by every function of this module.
+runner = Runner()
+
+
+def configure(max_concurrency=32):
+    '''
+    Replaces the shared runner; calls already waiting for or holding a slot
+    finish on the old one.
+    :param max_concurrency: Calls running at once.
+    :return: (Runner)
+    '''
+    global runner
+    previous, runner = runner, Runner(max_concurrency)
+    previous.close()
+    return runner
+
+
+def _coroutine(func):
+    @functools.wraps(func)
+    async def call(*args, **kwargs):
+        return await runner.run(func, *args, **kwargs)
+    return call
+
+
+def _async_generator(func):
+    @functools.wraps(func)
+    async def call(*args, **kwargs):
+        # A batch may still be running on a thread when the generator is
+        # closed, so the iterator is closed under the same lock.
+        lock = threading.Lock()
+
+        def batch():
+            with lock:
+                return list(itertools.islice(iterator, ITER_BATCH))
+
+        def close():
+            with lock:
+                iterator.close()
+
+        iterator = await runner.run(lambda: iter(func(*args, **kwargs)))
+        exhausted = False
+        try:
+            while not exhausted:
+                items = await runner.run(batch)
+                exhausted = len(items) < ITER_BATCH
+                for item in items:
+                    yield item
+        finally:
+            if not exhausted and hasattr(iterator, 'close'):
+                await runner.run(close)
+    return call
+
+
+# Public cirrus functions that are not API calls.
+_HELPERS = {'main', 'capture_errors', 'raising'}
+
+
+def _public_functions():
+    return [(name, func) for name, func in inspect.getmembers(cirrus, inspect.isfunction)
+            if not name.startswith('_') and name not in _HELPERS
+            and func.__module__ == cirrus.__name__]
+
+
+__all__ = ['Runner', 'runner', 'configure', 'ITER_BATCH']
+
+for _name, _func in _public_functions():
+    globals()[_name] = (_async_generator if _name.startswith('iter_') else _coroutine)(_func)
+    __all__.append(_name)
+del _name, _func
@@ -0,0 +1,308 @@
+__author__ = 'rafael'
+
+import argparse
+import ipaddress
+import json
+import sys
+import time
+import tracemalloc
+
+from stratus import aclsync
+from stratus import cirrus
+from stratus import memory
+from stratus import mesh
+from stratus import tagging
+from stratus import teardown
+from stratus import throttle
+from stratus import topology
+
+# Benchmarks the stratus workflows against the in-memory EC2 backend.
+
+# Each scenario runs the real code path end to end, through the shared client
+# registry and rate limiter, against memory.MemoryEC2, so it needs no AWS
+# account and its results are repeatable. A per-call latency and throttling
+# rate stand in for the network and for EC2's request limits. Scenarios:
+#
+#     build     topology.apply of one VPC with N subnets, route tables, a NAT
+#               gateway and a network ACL
+#     mesh      mesh.build_mesh of M new VPCs
+#     tag       TagBatcher tagging every subnet and route table of the build
+#     acl       aclsync.sync_acls changing and pruning the entries of the
+#               build's network ACL
+#     teardown  teardown.teardown of the built and meshed VPCs
+#
+# For each one the wall time, the API calls made (and how many of them were
+# throttled) and the peak memory allocated (tracemalloc) are reported.
+#
+# A run saved with --save-baseline can be compared against later: with
+# --baseline the run fails (exit status 1) when a scenario needs more calls,
+# time or memory than the baseline allows, see compare().
+#
+# Usage:
+#     python -m stratus.benchmark --subnets 200 --vpcs 8 --latency 0.02
+#     python -m stratus.benchmark --save-baseline benchmark.json
+#     python -m stratus.benchmark --baseline benchmark.json
+#
+#     from stratus import benchmark
+#
+#     results = benchmark.run(subnets=50, vpcs=4)
+
+SCENARIOS = ('build', 'mesh', 'tag', 'acl', 'teardown')
+
+# Growth over the baseline that compare() tolerates per measurement, as a
+# fraction, and the absolute growth always tolerated; wall time and memory
+# vary between runs and machines, API calls hardly at all.
+TOLERANCES = {
+    'calls': (0.05, 2),
+    'seconds': (0.5, 0.05),
+    'peak_bytes': (0.25, 2 ** 20),
+}
+
+_BUILD_CIDR = '10.0.0.0/16'
+
+
+def topology_spec(subnets):
+    '''
+    Returns a topology spec of an IPv6-enabled VPC with the given number of
+    subnets, alternately public and private, all behind one network ACL.
+    :param subnets: Number of subnets, up to 4096.
+    :return: (dict)
+    '''
+    network = ipaddress.ip_network(_BUILD_CIDR)
+    prefix_length = max(24, network.prefixlen + max(subnets - 1, 1).bit_length())
+    if prefix_length > 28:
+        raise ValueError('{} subnets do not fit in {}'.format(subnets, _BUILD_CIDR))
+    cidrs = network.subnets(new_prefix=prefix_length)
+    spec = {
+        'DryRun': False,
+        'vpc': {'name': 'benchmark', 'CidrBlock': _BUILD_CIDR,
+                'AmazonProvidedIpv6CidrBlock': True},
+        'internet_gateways': [{'name': 'igw'}],
+        'subnets': [],
+        'nat_gateways': [{'name': 'nat', 'subnet': 'subnet-0', 'AllocationId': 'eipalloc-benchmark'}],
+        'route_tables': [
+            {'name': 'public', 'routes': [
+                {'DestinationCidrBlock': '0.0.0.0/0', 'internet_gateway': 'igw'}]},
+            {'name': 'private', 'routes': [
+                {'DestinationCidrBlock': '0.0.0.0/0', 'nat_gateway': 'nat'}]},
+        ],
+        'network_acls': [
+            {'name': 'acl', 'entries': [
+                {'RuleNumber': 100, 'Protocol': '6', 'RuleAction': 'allow', 'Egress': False,
+                 'CidrBlock': '0.0.0.0/0', 'PortRange': {'From': 443, 'To': 443}},
+                {'RuleNumber': 100, 'Protocol': '-1', 'RuleAction': 'allow', 'Egress': True,
+                 'CidrBlock': '0.0.0.0/0'}]},
+        ],
+    }
+    for index in range(subnets):
+        spec['subnets'].append({
+            'name': 'subnet-{}'.format(index),
+            'CidrBlock': str(next(cidrs)),
+            'route_table': 'public' if index % 2 == 0 else 'private',
+            'network_acl': 'acl',
+        })
+    return spec
+
+
+def _measure(backend, name, func):
+    '''
+    Runs func once and returns its result with the scenario measurements.
+    '''
+    calls = sum(backend.calls.values())
+    throttled = backend.throttled
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    return result, {
+        'scenario': name,
+        'seconds': seconds,
+        'calls': sum(backend.calls.values()) - calls,
+        'throttled': backend.throttled - throttled,
+        'peak_bytes': peak,
+    }
+
+
+def _build(subnets, max_workers):
+    results = topology.apply(topology_spec(subnets), max_workers=max_workers)
+    failed = [key for key, response in results.items() if response is None]
+    if failed:
+        raise RuntimeError('build failed: {}'.format(', '.join(sorted(failed)[:5])))
+    return results
+
+
+def _mesh(vpcs, max_workers):
+    vpc_ids = []
+    for index in range(vpcs):
+        response = cirrus.create_vpc('mesh-{}'.format(index), DryRun=False,
+                                     CidrBlock='10.{}.0.0/16'.format(100 + index),
+                                     InstanceTenancy='default',
+                                     AmazonProvidedIpv6CidrBlock=False)
+        vpc_ids.append(response['Vpc']['VpcId'])
+    result = mesh.build_mesh(vpc_ids, max_workers=max_workers)
+    if result['failed']:
+        raise RuntimeError('mesh failed: {}'.format(result['failed'][:5]))
+    return vpc_ids
+
+
+def _tag(vpc_id):
+    vpc_filter = [{'Name': 'vpc-id', 'Values': [vpc_id]}]
+    resource_ids = [subnet['SubnetId'] for subnet in cirrus.iter_subnets(Filters=vpc_filter)]
+    resource_ids += [route_table['RouteTableId']
+                     for route_table in cirrus.iter_route_tables(Filters=vpc_filter)]
+    with tagging.TagBatcher(flush_interval=None) as batcher:
+        for resource_id in resource_ids:
+            batcher.add(resource_id, [{'Key': 'CostCenter', 'Value': 'benchmark'}])
+    if batcher.failed:
+        raise RuntimeError('tagging failed for {} calls'.format(len(batcher.failed)))
+    return len(resource_ids)
+
+
+def _acl(build, max_workers):
+    network_acl_id = build['acl:acl']['NetworkAcl']['NetworkAclId']
+    entries = [
+        {'RuleNumber': 100, 'Protocol': '6', 'RuleAction': 'allow', 'Egress': False,
+         'CidrBlock': '10.0.0.0/8', 'PortRange': {'From': 443, 'To': 443}},
+        {'RuleNumber': 110, 'Protocol': '6', 'RuleAction': 'allow', 'Egress': False,
+         'Ipv6CidrBlock': '::/0', 'PortRange': {'From': 443, 'To': 443}},
+    ]
+    result = aclsync.sync_acls({network_acl_id: entries}, prune=True, max_workers=max_workers)
+    if result['failed']:
+        raise RuntimeError('ACL sync failed: {}'.format(result['failed'][:5]))
+    return result['applied']
+
+
+def _teardown(vpc_ids, max_workers):
+    for vpc_id in vpc_ids:
+        results = teardown.teardown(vpc_id, max_workers=max_workers)
+        if results.get('vpc-delete') is None:
+            raise RuntimeError('teardown of {} failed'.format(vpc_id))
+
+
+def run(subnets=100, vpcs=4, latency=0.0, throttle_rate=0.0, max_workers=16, seed=0,
+        describe_rate=1000, mutate_rate=1000):
+    '''
+    Runs every scenario in order against a fresh in-memory backend.
+    :param subnets: Subnets of the built VPC.
+    :param vpcs: VPCs in the mesh; the mesh is skipped below 2.
+    :param latency: Seconds every API call takes.
+    :param throttle_rate: Fraction of API calls throttled, 0 to 1.
+    :param max_workers: Calls in flight at once.
+    :param seed: Seed of the backend's latency and throttling.
+    :param describe_rate: Describe calls per second allowed by the limiter.
+    :param mutate_rate: Mutating calls per second allowed by the limiter.
+    :return: List of measurement dictionaries, one per scenario, with the
+        call count per operation of the whole run under 'operations' of the
+        last one.
+    '''
+    previous = throttle.active
+    throttle.enable(describe_rate=describe_rate, describe_capacity=describe_rate,
+                    mutate_rate=mutate_rate, mutate_capacity=mutate_rate,
+                    base_delay=0.01, max_delay=0.5)
+    backend = memory.install(latency=latency, throttle_rate=throttle_rate, seed=seed)
+    tracemalloc.start()
+    try:
+        measurements = []
+        build, measurement = _measure(backend, 'build', lambda: _build(subnets, max_workers))
+        measurements.append(measurement)
+        vpc_id = build['vpc']['Vpc']['VpcId']
+        mesh_ids = []
+        if vpcs >= 2:
+            mesh_ids, measurement = _measure(backend, 'mesh', lambda: _mesh(vpcs, max_workers))
+            measurements.append(measurement)
+        _, measurement = _measure(backend, 'tag', lambda: _tag(vpc_id))
+        measurements.append(measurement)
+        _, measurement = _measure(backend, 'acl', lambda: _acl(build, max_workers))
+        measurements.append(measurement)
+        _, measurement = _measure(backend, 'teardown',
+                                  lambda: _teardown([vpc_id] + mesh_ids, max_workers))
+        measurements.append(measurement)
+        measurements[-1]['operations'] = dict(backend.calls)
+        return measurements
+    finally:
+        tracemalloc.stop()
+        memory.uninstall()
+        throttle.active = previous
+
+
+def report(measurements):
+    '''
+    Formats measurements as a table.
+    :param measurements: Value returned by run().
+    :return: (str)
+    '''
+    lines = ['{:<10} {:>10} {:>8} {:>10} {:>10}'.format(
+        'scenario', 'seconds', 'calls', 'throttled', 'peak MiB')]
+    for measurement in measurements:
+        lines.append('{:<10} {:>10.3f} {:>8} {:>10} {:>10.2f}'.format(
+            measurement['scenario'], measurement['seconds'], measurement['calls'],
+            measurement['throttled'], measurement['peak_bytes'] / 2 ** 20))
+    return '\n'.join(lines)
+
+
+def compare(measurements, baseline, tolerances=None):
+    '''
+    Compares a run with a baseline run of the same parameters.
+    :param measurements: Value returned by run().
+    :param baseline: Value returned by an earlier run(), e.g. loaded from
+        the JSON written by --save-baseline.
+    :param tolerances: {measurement: (fraction, absolute)} overriding
+        TOLERANCES; a value regresses when it exceeds both the baseline
+        times 1 + fraction and the baseline plus absolute.
+    :return: List of regression messages, empty when the run is within the
+        tolerances.
+    '''
+    tolerances = dict(TOLERANCES, **(tolerances or {}))
+    previous = {measurement['scenario']: measurement for measurement in baseline}
+    regressions = []
+    for measurement in measurements:
+        base = previous.get(measurement['scenario'])
+        if base is None:
+            continue
+        for key, (fraction, absolute) in sorted(tolerances.items()):
+            value, limit = measurement[key], base[key]
+            if value > limit * (1 + fraction) and value > limit + absolute:
+                regressions.append('{} {}: {:g} > baseline {:g}'.format(
+                    measurement['scenario'], key, value, limit))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark stratus against in-memory EC2.')
+    parser.add_argument('--subnets', type=int, default=100)
+    parser.add_argument('--vpcs', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds every API call takes')
+    parser.add_argument('--throttle', type=float, default=0.0,
+                        help='fraction of API calls throttled')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--describe-rate', type=float, default=1000)
+    parser.add_argument('--mutate-rate', type=float, default=1000)
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    parser.add_argument('--baseline', help='JSON file of an earlier run; exit 1 on regression')
+    parser.add_argument('--save-baseline', help='write the measurements to this JSON file')
+    args = parser.parse_args()
+
+    measurements = run(subnets=args.subnets, vpcs=args.vpcs, latency=args.latency,
+                       throttle_rate=args.throttle, max_workers=args.workers, seed=args.seed,
+                       describe_rate=args.describe_rate, mutate_rate=args.mutate_rate)
+    if args.json:
+        print(json.dumps(measurements, indent=2, sort_keys=True))
+    else:
+        print(report(measurements))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(measurements, baseline_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(measurements, json.load(baseline_file))
+        for regression in regressions:
+            print('Regression: {}'.format(regression), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
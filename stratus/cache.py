@@ -0,0 +1,211 @@
+__author__ = 'rafael'
+
+import contextvars
+import copy
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+# Optional in-process cache in front of the cirrus describe calls.
+
+# Responses are keyed by client, operation and arguments, expire after a TTL
+# and are evicted least-recently-used beyond maxsize. Every mutating call made
+# through cirrus drops the cached describes it can affect, so reads stay
+# correct while repeated describes of an unchanged resource cost nothing.
+#
+# Usage:
+#     from stratus import cache, cirrus
+#
+#     cache.enable(ttl=30, maxsize=1024)
+#     cirrus.describe_route_tables(DryRun=False, Filters=[...])  # API call
+#     cirrus.describe_route_tables(DryRun=False, Filters=[...])  # cached
+#     cirrus.create_route(DryRun=False, RouteTableId='rtb-?', ...)
+#     cirrus.describe_route_tables(DryRun=False, Filters=[...])  # API call
+#     cache.disable()
+#
+# Only whole describe_* calls are cached; the iter_* generators always read
+# through to the API, and so does code that polls for a state change (waiters)
+# inside a bypass() block.
+#
+# A describe that was already in flight when a mutating call invalidated its
+# operation may have read the old state, so its response is returned but not
+# stored.
+
+# Describe operations whose results a mutating operation can change. Mutating
+# operations missing from this table clear the whole cache.
+INVALIDATES = {
+    # EC2 creates the main route table and the default network ACL with the
+    # VPC and deletes them with it.
+    'create_vpc': ('describe_vpcs', 'describe_route_tables', 'describe_network_acls'),
+    'delete_vpc': ('describe_vpcs', 'describe_route_tables', 'describe_network_acls'),
+    'modify_vpc_attribute': ('describe_vpc_attribute',),
+    'create_subnet': ('describe_subnets', 'describe_network_acls'),
+    'delete_subnet': ('describe_subnets', 'describe_network_acls', 'describe_route_tables'),
+    'modify_subnet_attribute': ('describe_subnets',),
+    'create_dhcp_options': ('describe_dhcp_options',),
+    'associate_dhcp_options': ('describe_dhcp_options', 'describe_vpcs'),
+    'delete_dhcp_options': ('describe_dhcp_options',),
+    'create_internet_gateway': ('describe_internet_gateways',),
+    'attach_internet_gateway': ('describe_internet_gateways',),
+    'detach_internet_gateway': ('describe_internet_gateways',),
+    'delete_internet_gateway': ('describe_internet_gateways',),
+    'create_nat_gateway': ('describe_nat_gateways',),
+    'delete_nat_gateway': ('describe_nat_gateways',),
+    'create_customer_gateway': ('describe_customer_gateways',),
+    'delete_customer_gateway': ('describe_customer_gateways',),
+    'create_vpn_gateway': ('describe_vpn_gateways',),
+    'attach_vpn_gateway': ('describe_vpn_gateways',),
+    'detach_vpn_gateway': ('describe_vpn_gateways',),
+    'delete_vpn_gateway': ('describe_vpn_gateways',),
+    'enable_vgw_route_propagation': ('describe_route_tables',),
+    'disable_vgw_route_propagation': ('describe_route_tables',),
+    'create_vpn_connection': ('describe_vpn_connections',),
+    'delete_vpn_connection': ('describe_vpn_connections',),
+    'create_vpn_connection_route': ('describe_vpn_connections',),
+    'delete_vpn_connection_route': ('describe_vpn_connections',),
+    'create_route_table': ('describe_route_tables',),
+    'delete_route_table': ('describe_route_tables',),
+    'associate_route_table': ('describe_route_tables',),
+    'disassociate_route_table': ('describe_route_tables',),
+    'replace_route_table_association': ('describe_route_tables',),
+    'create_route': ('describe_route_tables',),
+    'replace_route': ('describe_route_tables',),
+    'delete_route': ('describe_route_tables',),
+    'create_network_acl': ('describe_network_acls',),
+    'delete_network_acl': ('describe_network_acls',),
+    'create_network_acl_entry': ('describe_network_acls',),
+    'replace_network_acl_entry': ('describe_network_acls',),
+    'delete_network_acl_entry': ('describe_network_acls',),
+    'replace_network_acl_association': ('describe_network_acls',),
+    'create_vpc_peering_connection': ('describe_vpc_peering_connections',),
+    'accept_vpc_peering_connection': ('describe_vpc_peering_connections',),
+    'reject_vpc_peering_connection': ('describe_vpc_peering_connections',),
+    'modify_vpc_peering_connection_options': ('describe_vpc_peering_connections',),
+    'delete_vpc_peering_connection': ('describe_vpc_peering_connections', 'describe_route_tables'),
+}
+
+
+class DescribeCache:
+    '''
+    Thread-safe TTL and LRU cache of describe responses.
+
+    Args:
+        ttl (float): Seconds an entry stays valid.
+        maxsize (int): Maximum number of entries.
+    '''
+
+    def __init__(self, ttl=30, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Invalidations per describe operation, and of the whole cache.
+        self._generations = Counter()
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(client, operation, kwargs):
+        return client, operation, json.dumps(kwargs, sort_keys=True, default=str)
+
+    def get_or_call(self, client, operation, kwargs, call):
+        '''
+        Returns a cached response, or calls call() and caches its response.
+        :param client: EC2 client the call is made with.
+        :param operation: Describe operation name.
+        :param kwargs: Arguments of the call.
+        :param call: Callable making the API call.
+        :return: Response dictionary.
+        '''
+        if _bypass.get():
+            return call()
+        key = self._key(client, operation, kwargs)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+            generation = (self._generations[operation], self._cleared)
+        response = call()
+        with self._lock:
+            if generation != (self._generations[operation], self._cleared):
+                # Invalidated while the call was in flight.
+                return response
+            self._entries[key] = (now + self.ttl, copy.deepcopy(response))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return response
+
+    def invalidate(self, operation):
+        '''
+        Drops the entries a mutating operation can affect.
+        :param operation: Mutating operation name, e.g. 'create_route'.
+        :return:
+        '''
+        describes = INVALIDATES.get(operation)
+        with self._lock:
+            if describes is None:
+                self._cleared += 1
+                self._entries.clear()
+                return
+            self._generations.update(describes)
+            for key in [key for key in self._entries if key[1] in describes]:
+                del self._entries[key]
+
+    def clear(self):
+        '''
+        Drops every entry.
+        :return:
+        '''
+        with self._lock:
+            self._cleared += 1
+            self._entries.clear()
+
+
+_bypass = contextvars.ContextVar('stratus_cache_bypass', default=False)
+
+
+@contextmanager
+def bypass():
+    '''
+    Sends the describe calls made inside a with block to the API, for code
+    that polls for a state change.
+    :return:
+    '''
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+# Cache consulted by cirrus._call; None disables caching.
+active = None
+
+
+def enable(ttl=30, maxsize=1024):
+    '''
+    Puts a new cache in front of the cirrus describe calls.
+    :param ttl: Seconds an entry stays valid.
+    :param maxsize: Maximum number of entries.
+    :return: (DescribeCache)
+    '''
+    global active
+    active = DescribeCache(ttl=ttl, maxsize=maxsize)
+    return active
+
+
+def disable():
+    '''
+    Stops caching describe calls.
+    :return:
+    '''
+    global active
+    active = None
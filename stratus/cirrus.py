@@ -1,18 +1,387 @@
 __author__ = 'rafael'
 
-import boto3
 from botocore.exceptions import ClientError
+from contextlib import contextmanager
+import contextvars
+import functools
 import json
+import uuid
+
+from stratus import cache
+from stratus import clients
+from stratus import ipam
+from stratus import metrics
+from stratus import plan
+from stratus import throttle
+from stratus import tracing
 
 # Producer module
 
 # Automation for the life cycle of AWS network functions.
 
-# Create connection
-client = boto3.client('ec2')
+# Every function accepts client=<EC2 client>, e.g. one returned by
+# clients.get_client(region=..., profile=...). Without it the default client
+# is built on first use.
+
+
+def __getattr__(name):
+    '''
+    Keeps cirrus.client working as the default client without building it at
+    import time.
+    '''
+    if name == 'client':
+        return clients.get_client()
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+
+def _call(client, operation, **kwargs):
+    '''
+    Invokes an EC2 API operation through the shared rate limiter, which also
+    retries throttled calls. Describe calls are served from the describe
+    cache when one is enabled, and every other call invalidates it. In plan
+    mode the call is only recorded. When metrics are enabled every attempt
+    that reaches EC2 is timed, and traced as a span while tracing is
+    enabled; time spent waiting for a token or backing off is not part of
+    any attempt, and a throttled attempt counts as an error.
+    :param client: EC2 client, or None for the default client.
+    :param operation: Client method name, e.g. 'create_vpc'.
+    :param kwargs: Arguments of the API call.
+    :return: Response dictionary.
+    '''
+    recorder = plan.active
+    if recorder is not None:
+        return recorder.record(operation, kwargs)
+    if client is None:
+        client = clients.get_client()
+
+    def attempt():
+        return getattr(client, operation)(**kwargs)
+
+    recorder = metrics.active
+    if recorder is not None:
+        attempt = recorder.timed(operation, metrics.region(client), attempt)
+    tracer = tracing.active
+    if tracer is not None:
+        attempt = tracer.timed(operation, 'ec2', attempt, region=metrics.region(client))
+
+    def invoke():
+        limiter = throttle.active
+        if limiter is None:
+            return attempt()
+        return limiter.call(client, operation, attempt)
+
+    try:
+        describe_cache = cache.active
+        if describe_cache is None:
+            return invoke()
+        if operation.startswith('describe_'):
+            return describe_cache.get_or_call(client, operation, kwargs, invoke)
+        try:
+            return invoke()
+        finally:
+            describe_cache.invalidate(operation)
+    except ClientError as e:
+        errors = _errors.get()
+        if errors is not None:
+            errors.append(e)
+        raise
+
+
+_errors = contextvars.ContextVar('stratus_errors', default=None)
+
+
+@contextmanager
+def capture_errors():
+    '''
+    Collects the ClientErrors of the API calls made inside a with block,
+    including those the cirrus functions print and turn into a None return.
+    :return: (list) ClientErrors, appended as calls fail.
+    '''
+    errors = []
+    token = _errors.set(errors)
+    try:
+        yield errors
+    finally:
+        _errors.reset(token)
+
+
+def raising(func):
+    '''
+    Returns a variant of a cirrus function that raises the ClientError it
+    printed instead of returning None, for callers that must tell a failure
+    from an empty result.
+    :param func: A cirrus function, e.g. describe_subnets.
+    :return: Callable.
+    '''
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        with capture_errors() as errors:
+            response = func(*args, **kwargs)
+        if response is None and errors:
+            raise errors[-1]
+        return response
+    return call
+
+
+# Send the Name tag and any extra tags in the create request itself
+# (TagSpecifications) instead of a follow-up create_tags call. Can be overridden
+# per call with TagOnCreate=True|False.
+TAG_ON_CREATE = True
+
+# Resource types that accept TagSpecifications on their create call. Types
+# missing from this set fall back to a single create_tags call after creation.
+TAG_ON_CREATE_TYPES = {
+    'vpc',
+    'subnet',
+    'dhcp-options',
+    'internet-gateway',
+    'natgateway',
+    'customer-gateway',
+    'vpn-gateway',
+    'vpn-connection',
+    'route-table',
+    'network-acl',
+    'vpc-peering-connection',
+}
+
+
+def _name_tags(name, kwargs):
+    '''
+    Builds the tag list for a new resource: the Name tag followed by any extra
+    tags passed as Tags=[{'Key': 'string', 'Value': 'string'},].
+    :param name: Value of the Name tag.
+    :param kwargs: Keyword arguments of the create_* function.
+    :return: List of tags.
+    '''
+    return [{'Key': 'Name', 'Value': name}] + list(kwargs.get('Tags', []))
+
+
+def _tag_specifications(resource_type, tags, kwargs):
+    '''
+    Returns the TagSpecifications argument for a create call, or an empty dict
+    when the resource has to be tagged after creation.
+    :param resource_type: EC2 resource type, e.g. 'vpc' or 'route-table'.
+    :param tags: List of tags.
+    :param kwargs: Keyword arguments of the create_* function.
+    :return: {'TagSpecifications': [...]} or {}
+    '''
+    if kwargs.get('TagOnCreate', TAG_ON_CREATE) and resource_type in TAG_ON_CREATE_TYPES:
+        return {'TagSpecifications': [{'ResourceType': resource_type, 'Tags': tags}]}
+    return {}
+
+
+def _tag_after_create(client, resource_id, tags, tag_specifications):
+    '''
+    Tags a new resource with one create_tags call unless it was already tagged
+    by its create call.
+    :param client: EC2 client, or None for the default client.
+    :param resource_id: Id of the new resource.
+    :param tags: List of tags.
+    :param tag_specifications: Value returned by _tag_specifications.
+    :return:
+    '''
+    if not tag_specifications:
+        create_tags(client=client, DryRun=False, Resources=[resource_id], Tags=tags)
+
+
+# Make create_* calls safe to retry: a create repeated with the same name and
+# parent resource returns the resource the first call created instead of a
+# duplicate. Can be overridden per call with Idempotent=True|False.
+#
+# Creates that take a ClientToken are idempotent in EC2 itself. The others
+# look for an existing resource by tag and create one when none is found;
+# that check-then-create is not atomic, so two concurrent retries, or a retry
+# made before a describe shows the first resource (EC2 is eventually
+# consistent), can still both create it. It guards against a retry after a
+# timeout or a crash, not against running the same create in parallel.
+IDEMPOTENT = False
+
+# Creates that take a ClientToken; EC2 itself returns the existing resource
+# when a token is reused. A ClientToken passed explicitly is always sent.
+CLIENT_TOKEN_OPERATIONS = {
+    'create_nat_gateway',
+    'create_route_table',
+    'create_network_acl',
+}
+
+# NAT gateway states after which a ClientToken cannot bring the gateway back;
+# EC2 keeps returning a deleted gateway for its token for a while.
+_NAT_GATEWAY_GONE = ('deleting', 'deleted', 'failed')
+
+# Tag holding the idempotency key of resources whose create call takes no
+# ClientToken, and the filtered describe used to find them again: describe
+# operation, result key, response key of the create call and filters that
+# leave out deleted resources.
+IDEMPOTENCY_TAG = 'stratus:idempotency-key'
+IDEMPOTENCY_LOOKUPS = {
+    'create_vpc': ('describe_vpcs', 'Vpcs', 'Vpc', [
+        {'Name': 'state', 'Values': ['pending', 'available']}]),
+    'create_subnet': ('describe_subnets', 'Subnets', 'Subnet', [
+        {'Name': 'state', 'Values': ['pending', 'available']}]),
+    'create_dhcp_options': ('describe_dhcp_options', 'DhcpOptions', 'DhcpOptions', []),
+    'create_internet_gateway': ('describe_internet_gateways', 'InternetGateways',
+                                'InternetGateway', []),
+    'create_customer_gateway': ('describe_customer_gateways', 'CustomerGateways', 'CustomerGateway', [
+        {'Name': 'state', 'Values': ['pending', 'available']}]),
+    'create_vpn_gateway': ('describe_vpn_gateways', 'VpnGateways', 'VpnGateway', [
+        {'Name': 'state', 'Values': ['pending', 'available']}]),
+    'create_vpn_connection': ('describe_vpn_connections', 'VpnConnections', 'VpnConnection', [
+        {'Name': 'state', 'Values': ['pending', 'available']}]),
+    'create_vpc_peering_connection': ('describe_vpc_peering_connections',
+                                      'VpcPeeringConnections', 'VpcPeeringConnection', [
+        {'Name': 'status-code', 'Values': ['initiating-request', 'pending-acceptance',
+                                           'provisioning', 'active']}]),
+}
+
+# Arguments naming the resource a new one is created in; they are part of the
+# idempotency key, so equal names under different parents do not collide.
+_IDEMPOTENCY_SCOPE = ('VpcId', 'SubnetId', 'PeerVpcId', 'CustomerGatewayId', 'VpnGatewayId')
+
+_IDEMPOTENCY_NAMESPACE = uuid.UUID('6c1f5f0e-3f2a-5d8e-9b57-5e1a2f7c9d40')
+
+
+def _idempotency_key(operation, name, kwargs):
+    '''
+    Derives the idempotency key of a create call from the operation, the
+    logical resource name and the parent resources.
+    :param operation: Client method name, e.g. 'create_subnet'.
+    :param name: Name of the new resource.
+    :param kwargs: Keyword arguments of the create_* function.
+    :return: (str) UUID.
+    '''
+    scope = [operation, name] + ['{}={}'.format(key, kwargs[key])
+                                 for key in _IDEMPOTENCY_SCOPE if kwargs.get(key)]
+    return str(uuid.uuid5(_IDEMPOTENCY_NAMESPACE, '/'.join(scope)))
+
+
+def _idempotency(operation, name, tags, client, kwargs):
+    '''
+    Prepares a create call for idempotency mode. Creates with a ClientToken
+    get a token derived from the name; the others get an idempotency tag,
+    appended to tags, and one filtered describe looks for a resource an
+    earlier attempt already created.
+    :param operation: Client method name, e.g. 'create_subnet'.
+    :param name: Name of the new resource.
+    :param tags: Tags of the new resource, updated in place.
+    :param client: EC2 client, or None for the default client.
+    :param kwargs: Keyword arguments of the create_* function.
+    :return: (existing, arguments): the create response for the resource
+        found, or None, and the extra arguments of the create call.
+    '''
+    if operation in CLIENT_TOKEN_OPERATIONS and kwargs.get('ClientToken'):
+        return None, {'ClientToken': kwargs['ClientToken']}
+    if not kwargs.get('Idempotent', IDEMPOTENT):
+        return None, {}
+    key = _idempotency_key(operation, name, kwargs)
+    if operation in CLIENT_TOKEN_OPERATIONS:
+        return None, {'ClientToken': key}
+    tags.append({'Key': IDEMPOTENCY_TAG, 'Value': key})
+    if kwargs.get('DryRun'):
+        return None, {}
+    describe, result_key, response_key, live = IDEMPOTENCY_LOOKUPS[operation]
+    response = _call(client, describe, DryRun=False,
+                     Filters=[{'Name': 'tag:' + IDEMPOTENCY_TAG, 'Values': [key]}] + live)
+    found = response.get(result_key, [])
+    if found:
+        return {response_key: found[0]}, {}
+    return None, {}
+
+
+def _allocate_cidr(kwargs):
+    '''
+    Replaces Pool=<name, ipam.Pool or ipam.PoolGroup> and
+    PrefixLength=<int> in the keyword arguments of create_vpc or
+    create_subnet with a CidrBlock allocated from the pool, or from the
+    plan's copy of the pool in plan mode.
+    :param kwargs: Keyword arguments of the create_* function, updated in
+        place.
+    :return: (pool, cidr) of the allocation, or None when no pool was given.
+    '''
+    if 'Pool' not in kwargs:
+        return None
+    pool = ipam.get_pool(kwargs.pop('Pool'))
+    recorder = plan.active
+    if recorder is not None:
+        # Planning must not use up blocks of the real pool.
+        pool = recorder.pool(pool)
+    cidr = pool.allocate(kwargs.pop('PrefixLength'))
+    kwargs['CidrBlock'] = cidr
+    return pool, cidr
+
+
+# Errors of _allocate_cidr: an exhausted pool, an unknown pool name or a
+# prefix length that does not fit the pool.
+_ALLOCATION_ERRORS = (ipam.PoolExhausted, KeyError, ValueError)
+
+
+def _adopt_cidr(allocation, cidr):
+    '''
+    Swaps a CidrBlock allocated by _allocate_cidr for the block of a resource
+    an earlier attempt already created, so the pool keeps that block in use
+    rather than the one this attempt did not need.
+    :param allocation: Value returned by _allocate_cidr.
+    :param cidr: CidrBlock of the existing resource.
+    :return:
+    '''
+    if allocation is None:
+        return
+    pool, allocated = allocation
+    if cidr == allocated:
+        return
+    pool.release(allocated)
+    if cidr and pool.contains(cidr):
+        pool.reserve(cidr)
+
+
+def _release_cidr(allocation):
+    '''
+    Returns a CidrBlock allocated by _allocate_cidr to its pool after the
+    create call failed.
+    :param allocation: Value returned by _allocate_cidr.
+    :return:
+    '''
+    if allocation is not None:
+        pool, cidr = allocation
+        pool.release(cidr)
+
+
+def _paginate(client, operation, result_key, page_size, kwargs):
+    '''
+    Yields resources one at a time from every page of a describe call, so large
+    result sets are processed in constant memory. Operations without an EC2
+    paginator are fetched with a single call. Every page is its own _call, so
+    it takes a limiter token, is retried while throttled, and is timed and
+    traced like any other call; pages are never served from the describe
+    cache.
+    A page that still fails after the retries raises ClientError, since a
+    listing cut short cannot be told apart from a complete one.
+    :param client: EC2 client, or None for the default client.
+    :param operation: Client method name, e.g. 'describe_subnets'.
+    :param result_key: Response key holding the resources, e.g. 'Subnets'.
+    :param page_size: Number of resources requested per page. Ignored when
+        explicit resource ids are given, since EC2 rejects MaxResults with ids.
+    :param kwargs: Arguments passed to the describe call.
+    :return: Generator of resource dictionaries.
+    '''
+    if plan.active is None and client is None:
+        client = clients.get_client()
+    kwargs = dict(kwargs)
+    paginated = plan.active is None and client.can_paginate(operation)
+    if paginated and page_size and not any(key.endswith('Ids') for key in kwargs):
+        kwargs['MaxResults'] = page_size
+    while True:
+        with cache.bypass():
+            response = _call(client, operation, **kwargs)
+        for resource in response.get(result_key, []):
+            yield resource
+        next_token = response.get('NextToken') if paginated else None
+        if not next_token:
+            return
+        kwargs['NextToken'] = next_token
+
 
 ########## VPC ##########
-def describe_vpcs(**kwargs):
+def describe_vpcs(client=None, **kwargs):
     '''
     Describe one or more VPCs.
     :param kwargs:
@@ -22,9 +391,10 @@ def describe_vpcs(**kwargs):
     '''
     try:
         if kwargs['VpcIds'] == ['all']:
-            response = client.describe_vpcs()
+            response = _call(client, 'describe_vpcs')
         else:
-            response = client.describe_vpcs(
+            response = _call(
+                client, 'describe_vpcs',
                 DryRun=kwargs['DryRun'],
                 VpcIds=kwargs['VpcIds']
             )
@@ -33,7 +403,20 @@ def describe_vpcs(**kwargs):
         print(e)
 
 
-def create_vpc(vpc_name, **kwargs):
+def iter_vpcs(PageSize=100, client=None, **kwargs):
+    '''
+    Yields VPCs one at a time across all result pages.
+    :param PageSize: Number of VPCs fetched per call.
+    :param kwargs:
+        DryRun=True|False,
+        VpcIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_vpcs', 'Vpcs', PageSize, kwargs)
+
+
+def create_vpc(vpc_name, client=None, **kwargs):
     '''
     Creates a VPC with the specified IPv4 CIDR block and creates a name tag for
     the vpc object.
@@ -43,35 +426,51 @@ def create_vpc(vpc_name, **kwargs):
         CidrBlock='string',
         InstanceTenancy='default'|'dedicated'|'host',
         AmazonProvidedIpv6CidrBlock=True|False
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
+        Pool='string'|ipam.Pool|ipam.PoolGroup, PrefixLength=123 optional,
+            allocate the CidrBlock from an IPAM pool instead; a VPC or subnet
+            found by idempotency mode keeps its own CidrBlock reserved.
     :return:
     '''
     try:
-        response = client.create_vpc(
+        allocation = _allocate_cidr(kwargs)
+    except _ALLOCATION_ERRORS as e:
+        print(e)
+        return None
+    response = None
+    try:
+        tags = _name_tags(vpc_name, kwargs)
+        existing, idempotency = _idempotency('create_vpc', vpc_name, tags, client, kwargs)
+        if existing is not None:
+            response = existing
+            _adopt_cidr(allocation, existing['Vpc'].get('CidrBlock'))
+            return existing
+        tag_specifications = _tag_specifications('vpc', tags, kwargs)
+        response = _call(
+            client, 'create_vpc',
             DryRun=kwargs['DryRun'],
             CidrBlock=kwargs['CidrBlock'],
             InstanceTenancy=kwargs['InstanceTenancy'],
-            AmazonProvidedIpv6CidrBlock=kwargs['AmazonProvidedIpv6CidrBlock']
+            AmazonProvidedIpv6CidrBlock=kwargs['AmazonProvidedIpv6CidrBlock'],
+            **tag_specifications,
+            **idempotency
         )
         vpc = response.get('Vpc', 'Key not found')
         vpc_id = vpc.get('VpcId', 'Key not Found')
-        # Create name tag for vpc object.
-        create_tags(DryRun=False,
-                    Resources=[
-                        vpc_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': vpc_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, vpc_id, tags, tag_specifications)
         return response
     except ClientError as e:
         print(e)
+    finally:
+        # Give the block back if the VPC was not created.
+        if response is None:
+            _release_cidr(allocation)
 
 
-def describe_vpc_attribute(**kwargs):
+def describe_vpc_attribute(client=None, **kwargs):
     '''
     #Describes the specified attribute of the specified VPC.
     :param kwargs:
@@ -81,7 +480,8 @@ def describe_vpc_attribute(**kwargs):
     :return:
     '''
     try:
-        response = client.describe_vpc_attribute(
+        response = _call(
+            client, 'describe_vpc_attribute',
             DryRun=kwargs['DryRun'],
             VpcId=kwargs['VpcId'],
             Attribute=kwargs['Attribute']
@@ -91,7 +491,7 @@ def describe_vpc_attribute(**kwargs):
         print(e)
 
 
-def modify_vpc_attribute(**kwargs):
+def modify_vpc_attribute(client=None, **kwargs):
     '''
     Modifies the specified attribute of the specified VPC.
     :param kwargs:
@@ -105,7 +505,8 @@ def modify_vpc_attribute(**kwargs):
     :return:
     '''
     try:
-        response = client.modify_vpc_attribute(
+        response = _call(
+            client, 'modify_vpc_attribute',
             VpcId=kwargs['VpcId'],
             EnableDnsSupport=kwargs['EnableDnsSupport'],
             EnableDnsHostnames=kwargs['EnableDnsHostnames']
@@ -115,7 +516,7 @@ def modify_vpc_attribute(**kwargs):
         print(e)
 
 
-def delete_vpc(**kwargs):
+def delete_vpc(client=None, **kwargs):
     '''
     :param kwargs:
         DryRun=True|False,
@@ -123,7 +524,8 @@ def delete_vpc(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_vpc(
+        response = _call(
+                client, 'delete_vpc',
                 DryRun=kwargs['DryRun'],
                 VpcId=kwargs['VpcId']
             )
@@ -133,7 +535,7 @@ def delete_vpc(**kwargs):
 
 
 ########## SUBNET ##########
-def describe_subnets(**kwargs):
+def describe_subnets(client=None, **kwargs):
     '''
     Describes one or more of your subnets.
     :param kwargs:
@@ -141,12 +543,14 @@ def describe_subnets(**kwargs):
     '''
     try:
         if 'Filters' in kwargs:
-            response = client.describe_subnets(
+            response = _call(
+                client, 'describe_subnets',
                 DryRun=kwargs['DryRun'],
                 Filters=kwargs['Filters']
             )
         elif 'SubnetIds' in kwargs:
-            response = client.describe_subnets(
+            response = _call(
+                client, 'describe_subnets',
                 DryRun=kwargs['DryRun'],
                 SubnetIds=kwargs['SubnetIds']
             )
@@ -157,7 +561,20 @@ def describe_subnets(**kwargs):
         print(e)
 
 
-def create_subnet(subnet_name, **kwargs):
+def iter_subnets(PageSize=100, client=None, **kwargs):
+    '''
+    Yields subnets one at a time across all result pages.
+    :param PageSize: Number of subnets fetched per call.
+    :param kwargs:
+        DryRun=True|False,
+        SubnetIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_subnets', 'Subnets', PageSize, kwargs)
+
+
+def create_subnet(subnet_name, client=None, **kwargs):
     '''
 
     :param subnet_name:
@@ -168,43 +585,63 @@ def create_subnet(subnet_name, **kwargs):
         CidrBlock='string',
         Ipv6CidrBlock='string',
         AvailabilityZone='string'
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
+        Pool='string'|ipam.Pool|ipam.PoolGroup, PrefixLength=123 optional,
+            allocate the CidrBlock from an IPAM pool instead; a VPC or subnet
+            found by idempotency mode keeps its own CidrBlock reserved.
     '''
     try:
+        allocation = _allocate_cidr(kwargs)
+    except _ALLOCATION_ERRORS as e:
+        print(e)
+        return None
+    response = None
+    try:
+        tags = _name_tags(subnet_name, kwargs)
+        existing, idempotency = _idempotency('create_subnet', subnet_name, tags, client, kwargs)
+        if existing is not None:
+            response = existing
+            _adopt_cidr(allocation, existing['Subnet'].get('CidrBlock'))
+            return existing
+        tag_specifications = _tag_specifications('subnet', tags, kwargs)
         if 'AvailabilityZone' in kwargs:
-            response = client.create_subnet(
+            response = _call(
+                client, 'create_subnet',
                 DryRun=kwargs['DryRun'],
                 VpcId=kwargs['VpcId'],
                 CidrBlock=kwargs['CidrBlock'],
-                AvailabilityZone=kwargs['AvailabilityZone']
+                AvailabilityZone=kwargs['AvailabilityZone'],
+                **tag_specifications,
+                **idempotency
             )
         else:
-            response = client.create_subnet(
+            response = _call(
+                client, 'create_subnet',
                 DryRun=kwargs['DryRun'],
                 VpcId=kwargs['VpcId'],
-                CidrBlock=kwargs['CidrBlock']
+                CidrBlock=kwargs['CidrBlock'],
+                **tag_specifications,
+                **idempotency
             )
 
         subnet = response.get('Subnet', 'Key not found')
         vpc_id = subnet.get('VpcId', 'Key not found')
         cidr_block = subnet.get('CidrBlock', 'Key not found')
         subnet_id = subnet.get('SubnetId', 'Key not found')
-        create_tags(DryRun=False,
-                    Resources=[
-                        subnet_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': subnet_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, subnet_id, tags, tag_specifications)
         return response
     except ClientError as e:
         print(e)
+    finally:
+        # Give the block back if the subnet was not created.
+        if response is None:
+            _release_cidr(allocation)
 
 
-def modify_subnet_attribute(**kwargs):
+def modify_subnet_attribute(client=None, **kwargs):
     '''
     Modifies a subnet attribute:
         MapPublicIpOnLaunch (dict) Specify true to indicate that network
@@ -223,13 +660,15 @@ def modify_subnet_attribute(**kwargs):
     '''
     try:
         if 'AssignIpv6AddressOnCreation' in kwargs:
-            response = client.modify_subnet_attribute(
+            response = _call(
+                client, 'modify_subnet_attribute',
                 SubnetId=kwargs['SubnetId'],
                 MapPublicIpOnLaunch=kwargs['MapPublicOnLaunch'],
                 AssignIpv6AddressOnCreation=kwargs['AssignIpv6AddressOnCreation']
             )
         else:
-            response = client.modify_subnet_attribute(
+            response = _call(
+                client, 'modify_subnet_attribute',
                 SubnetId=kwargs['SubnetId'],
                 MapPublicIpOnLaunch=kwargs['MapPublicOnLaunch']
             )
@@ -238,7 +677,7 @@ def modify_subnet_attribute(**kwargs):
         print(e)
 
 
-def delete_subnet(**kwargs):
+def delete_subnet(client=None, **kwargs):
     '''
     Deletes the specified subnet.
     :param kwargs:
@@ -247,7 +686,8 @@ def delete_subnet(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_subnet(
+        response = _call(
+            client, 'delete_subnet',
             DryRun=kwargs['DryRun'],
             SubnetId=kwargs['SubnetId']
         )
@@ -257,7 +697,7 @@ def delete_subnet(**kwargs):
 
 
 ########## DHCP ##########
-def describe_dhcp_options(**kwargs):
+def describe_dhcp_options(client=None, **kwargs):
     '''
     Describes one or more of your DHCP options sets.
     :param kwargs:
@@ -268,12 +708,14 @@ def describe_dhcp_options(**kwargs):
     '''
     try:
         if 'DhcpOptionsIds' in kwargs:
-            response = client.describe_dhcp_options(
+            response = _call(
+                client, 'describe_dhcp_options',
                 DhcpOptionsIds=kwargs['DhcpOptionsIds'],
                 DryRun=kwargs['DryRun']
             )
         elif 'Filters' in kwargs:
-            response = client.describe_dhcp_options(
+            response = _call(
+                client, 'describe_dhcp_options',
                 Filters=kwargs['Filters'],
                 DryRun=kwargs['DryRun']
             )
@@ -282,39 +724,54 @@ def describe_dhcp_options(**kwargs):
         print(e)
 
 
-def create_dhcp_options(dhcp_option_name, **kwargs):
+def iter_dhcp_options(PageSize=100, client=None, **kwargs):
+    '''
+    Yields DHCP options sets one at a time across all result pages.
+    :param PageSize: Number of DHCP options sets fetched per call.
+    :param kwargs:
+        DryRun=True|False,
+        DhcpOptionsIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_dhcp_options', 'DhcpOptions', PageSize, kwargs)
+
+
+def create_dhcp_options(dhcp_option_name, client=None, **kwargs):
     '''
     :param dhcp_option_name:
     :param kwargs:
         'Key': 'domain-name-servers',
         'Values': ['10.2.5.1', '10.2.5.2']
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
     :return:
     '''
     try:
-        response = client.create_dhcp_options(
+        tags = _name_tags(dhcp_option_name, kwargs)
+        existing, idempotency = _idempotency('create_dhcp_options', dhcp_option_name, tags, client, kwargs)
+        if existing is not None:
+            return existing
+        tag_specifications = _tag_specifications('dhcp-options', tags, kwargs)
+        response = _call(
+            client, 'create_dhcp_options',
             DryRun=kwargs['DryRun'],
-            DhcpConfigurations=kwargs['DhcpConfigurations']
+            DhcpConfigurations=kwargs['DhcpConfigurations'],
+            **tag_specifications,
+            **idempotency
         )
         dhcp_options = response.get('DhcpOptions', 'Key not found')
         dhcp_options_id = dhcp_options.get('DhcpOptionsId', 'Key not found')
-        create_tags(DryRun=False,
-                    Resources=[
-                        dhcp_options_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': dhcp_option_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, dhcp_options_id, tags, tag_specifications)
 
         return response
     except ClientError as e:
         print(e)
 
 
-def associate_dhcp_options(**kwargs):
+def associate_dhcp_options(client=None, **kwargs):
     '''
     Associates a set of previously created DHCP options with the specified VCP
     :param kwargs:
@@ -324,7 +781,8 @@ def associate_dhcp_options(**kwargs):
     :return: DhcpOptionsId
     '''
     try:
-        response = client.associate_dhcp_options(
+        response = _call(
+            client, 'associate_dhcp_options',
             DryRun=kwargs['DryRun'],
             DhcpOptionsId=kwargs['DhcpOptionsId'],
             VpcId=kwargs['VpcId']
@@ -334,14 +792,15 @@ def associate_dhcp_options(**kwargs):
         print(e)
 
 
-def delete_dhcp_options(**kwargs):
+def delete_dhcp_options(client=None, **kwargs):
     '''
     Deletes the specified set of DHCP options.
     :param kwargs:
     :return:
     '''
     try:
-        response = client.delete_dhcp_options(
+        response = _call(
+            client, 'delete_dhcp_options',
             DryRun=kwargs['DryRun'],
             DhcpOptionsId=kwargs['DhcpOptionsId']
         )
@@ -351,7 +810,7 @@ def delete_dhcp_options(**kwargs):
 
 
 ########## INTERNET GATEWAY ##########
-def describe_internet_gateways(**kwargs):
+def describe_internet_gateways(client=None, **kwargs):
     '''
     Describes one or more of your Internet gateways using Filters or
     InternetGatewayIds.
@@ -363,12 +822,14 @@ def describe_internet_gateways(**kwargs):
     '''
     try:
         if 'InternetGatewayIds' in kwargs:
-            response = client.describe_internet_gateways(
+            response = _call(
+                client, 'describe_internet_gateways',
                 DryRun=kwargs['DryRun'],
                 InternetGatewayIds=kwargs['InternetGatewayIds']
             )
         elif 'Filters' in kwargs:
-            response = client.describe_internet_gateways(
+            response = _call(
+                client, 'describe_internet_gateways',
                 DryRun=kwargs['DryRun'],
                 Filters=kwargs['Filters']
             )
@@ -379,37 +840,52 @@ def describe_internet_gateways(**kwargs):
         print(e)
 
 
-def create_internet_gateway(internet_gateway_name, **kwargs):
+def iter_internet_gateways(PageSize=100, client=None, **kwargs):
+    '''
+    Yields Internet gateways one at a time across all result pages.
+    :param PageSize: Number of Internet gateways fetched per call.
+    :param kwargs:
+        DryRun=True|False,
+        InternetGatewayIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_internet_gateways', 'InternetGateways', PageSize, kwargs)
+
+
+def create_internet_gateway(internet_gateway_name, client=None, **kwargs):
     '''
     Creates an Internet gateway for use with a VPC.
     :param name:
     :param kwargs:
         DryRun=True|False
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
     :return:
     '''
     try:
-        response = client.create_internet_gateway(
-            DryRun=kwargs['DryRun']
+        tags = _name_tags(internet_gateway_name, kwargs)
+        existing, idempotency = _idempotency('create_internet_gateway', internet_gateway_name, tags, client, kwargs)
+        if existing is not None:
+            return existing
+        tag_specifications = _tag_specifications('internet-gateway', tags, kwargs)
+        response = _call(
+            client, 'create_internet_gateway',
+            DryRun=kwargs['DryRun'],
+            **tag_specifications,
+            **idempotency
         )
         internet_gateway = response.get('InternetGateway', 'Key not found')
         internet_gateway_id = internet_gateway.get('InternetGatewayId')
-        create_tags(DryRun=False,
-                    Resources=[
-                        internet_gateway_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': internet_gateway_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, internet_gateway_id, tags, tag_specifications)
         return response
     except ClientError as e:
         print(e)
 
 
-def attach_internet_gateway(**kwargs):
+def attach_internet_gateway(client=None, **kwargs):
     '''
     Attaches an Internet gateway to a VPC.
     :param kwargs:
@@ -419,7 +895,8 @@ def attach_internet_gateway(**kwargs):
     :return:
     '''
     try:
-        response = client.attach_internet_gateway(
+        response = _call(
+            client, 'attach_internet_gateway',
             DryRun=kwargs['DryRun'],
             InternetGatewayId=kwargs['InternetGatewayId'],
             VpcId=kwargs['VpcId']
@@ -429,7 +906,7 @@ def attach_internet_gateway(**kwargs):
         print(e)
 
 
-def detach_internet_gateway(**kwargs):
+def detach_internet_gateway(client=None, **kwargs):
     '''
     Detaches an Internet gateway from a VPC.
     :param kwargs:
@@ -439,7 +916,8 @@ def detach_internet_gateway(**kwargs):
     :return:
     '''
     try:
-        response = client.detach_internet_gateway(
+        response = _call(
+            client, 'detach_internet_gateway',
             DryRun=kwargs['DryRun'],
             InternetGatewayId=kwargs['InternetGatewayId'],
             VpcId=kwargs['VpcId']
@@ -449,7 +927,7 @@ def detach_internet_gateway(**kwargs):
         print(e)
 
 
-def delete_internet_gateway(**kwargs):
+def delete_internet_gateway(client=None, **kwargs):
     '''
     Deletes the specified Internet gateway.
     :param kwargs:
@@ -458,7 +936,8 @@ def delete_internet_gateway(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_internet_gateway(
+        response = _call(
+            client, 'delete_internet_gateway',
             DryRun=kwargs['DryRun'],
             InternetGatewayId=kwargs['InternetGatewayId']
         )
@@ -468,7 +947,7 @@ def delete_internet_gateway(**kwargs):
 
 
 ########## NAT GATEWAY ##########
-def describe_nat_gateways(**kwargs):
+def describe_nat_gateways(client=None, **kwargs):
     '''
     Describes one or more of the your NAT gateways.
     :param kwargs:
@@ -478,12 +957,15 @@ def describe_nat_gateways(**kwargs):
     '''
     try:
         if 'NatGatewayIds' in kwargs:
-            response = client.describe_nat_gateways(
+            response = _call(
+                client, 'describe_nat_gateways',
                 NatGatewayIds=kwargs['NatGatewayIds']
             )
         elif 'Filters' in kwargs:
-            response = client.describe_nat_gateways(
-                Filters=kwargs['Filters']
+            # DescribeNatGateways names its filter argument Filter.
+            response = _call(
+                client, 'describe_nat_gateways',
+                Filter=kwargs['Filters']
             )
         else:
             print('Something went wrong.')
@@ -493,39 +975,75 @@ def describe_nat_gateways(**kwargs):
         print(e)
 
 
-def create_nat_gateway(nat_gateway_name, **kwargs):
+def iter_nat_gateways(PageSize=100, client=None, **kwargs):
+    '''
+    Yields NAT gateways one at a time across all result pages.
+    :param PageSize: Number of NAT gateways fetched per call.
+    :param kwargs:
+        DryRun=True|False,
+        NatGatewayIds=['string',]
+        Filter=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_nat_gateways', 'NatGateways', PageSize, kwargs)
+
+
+# Optional NAT gateway arguments; create_nat_gateway sends whichever of them
+# are given. A private gateway takes no AllocationId.
+NAT_GATEWAY_OPTIONS = (
+    'AllocationId',
+    'ConnectivityType',
+)
+
+
+def create_nat_gateway(nat_gateway_name, client=None, **kwargs):
     '''
     Creates a NAT gateway in the specified subnet.
     :param kwargs:
         SubnetId='string'
-        AllocationId='string'
+        AllocationId='string' required for a public gateway.
+        ConnectivityType='public'|'private' optional, defaults to 'public'.
         ClientToken='string'
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT. A token
+            derived from the name that returns a deleted or failed gateway is
+            replaced by one derived from that gateway's id.
     :return:
     '''
     try:
-        response = client.create_nat_gateway(
-            SubnetId=kwargs['SubnetId'],
-            AllocationId=kwargs['AllocationId']
-        )
+        tags = _name_tags(nat_gateway_name, kwargs)
+        existing, idempotency = _idempotency('create_nat_gateway', nat_gateway_name, tags, client, kwargs)
+        if existing is not None:
+            return existing
+        tag_specifications = _tag_specifications('natgateway', tags, kwargs)
+        while True:
+            response = _call(
+                client, 'create_nat_gateway',
+                SubnetId=kwargs['SubnetId'],
+                **{key: kwargs[key] for key in NAT_GATEWAY_OPTIONS if key in kwargs},
+                **tag_specifications,
+                **idempotency
+            )
+            returned = response.get('NatGateway', {})
+            if kwargs.get('ClientToken') or returned.get('State') not in _NAT_GATEWAY_GONE:
+                break
+            # The derived token belongs to a gateway an earlier build created
+            # and a teardown deleted; derive the next token from that
+            # gateway's id, so retries of this rebuild agree on it too.
+            idempotency = {'ClientToken': _idempotency_key(
+                'create_nat_gateway', '{}/{}'.format(nat_gateway_name, returned['NatGatewayId']),
+                kwargs)}
         nat_gateway = response.get('NatGateway', 'Key not found')
         nat_gateway_id = nat_gateway.get('NatGatewayId', 'Key not found')
-        create_tags(DryRun=False,
-                    Resources=[
-                        nat_gateway_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': nat_gateway_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, nat_gateway_id, tags, tag_specifications)
         return response
     except ClientError as e:
         print(e)
 
 
-def delete_nat_gateway(**kwargs):
+def delete_nat_gateway(client=None, **kwargs):
     '''
     Deletes the specified NAT gateway.
     :param kwargs:
@@ -533,7 +1051,8 @@ def delete_nat_gateway(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_nat_gateway(
+        response = _call(
+            client, 'delete_nat_gateway',
             NatGatewayId=kwargs['NatGatewayId']
         )
         return response
@@ -542,7 +1061,7 @@ def delete_nat_gateway(**kwargs):
 
 
 ########## CUSTOMER GATEWAY ##########
-def describe_customer_gateways(**kwargs):
+def describe_customer_gateways(client=None, **kwargs):
     '''
     Provides information to AWS about your VPN customer gateway device.
     Describes one or more of your VPN customer gateways.
@@ -554,12 +1073,14 @@ def describe_customer_gateways(**kwargs):
     '''
     try:
         if 'CustomerGatewayIds' in kwargs:
-            response = client.describe_customer_gateways(
+            response = _call(
+                client, 'describe_customer_gateways',
                 DryRun=kwargs['DryRun'],
                 CustomerGatewayIds=kwargs['CustomerGatewayIds']
             )
         elif 'Filters' in kwargs:
-            response = client.describe_customer_gateways(
+            response = _call(
+                client, 'describe_customer_gateways',
                 DryRun=kwargs['DryRun'],
                 Filters=kwargs['Filters']
             )
@@ -570,7 +1091,21 @@ def describe_customer_gateways(**kwargs):
         print(e)
 
 
-def create_customer_gateway(customer_gateway_name, **kwargs):
+def iter_customer_gateways(PageSize=100, client=None, **kwargs):
+    '''
+    Yields customer gateways one at a time. EC2 returns them in a single response,
+    so PageSize is accepted for symmetry and ignored.
+    :param PageSize: Unused.
+    :param kwargs:
+        DryRun=True|False,
+        CustomerGatewayIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_customer_gateways', 'CustomerGateways', PageSize, kwargs)
+
+
+def create_customer_gateway(customer_gateway_name, client=None, **kwargs):
     '''
     Provides information to AWS about your VPN customer gateway device.
     :param kwargs:
@@ -578,32 +1113,33 @@ def create_customer_gateway(customer_gateway_name, **kwargs):
         Type='ipsec.1',
         PublicIp='string',
         BgpAsn=123
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
     :return:
     '''
-    response = client.create_customer_gateway(
+    tags = _name_tags(customer_gateway_name, kwargs)
+    existing, idempotency = _idempotency('create_customer_gateway', customer_gateway_name, tags, client, kwargs)
+    if existing is not None:
+        return existing
+    tag_specifications = _tag_specifications('customer-gateway', tags, kwargs)
+    response = _call(
+        client, 'create_customer_gateway',
         DryRun=kwargs['DryRun'],
         Type=kwargs['Type'],
         PublicIp=kwargs['PublicIp'],
-        BgpAsn=kwargs['BgpAsn']
+        BgpAsn=kwargs['BgpAsn'],
+        **tag_specifications,
+        **idempotency
     )
     customer_gateway = response.get('CustomerGateway', 'Key not found')
     customer_gateway_id = customer_gateway.get('CustomerGatewayId', 'Key not Found')
-    # Create name tag for vpc object.
-    create_tags(DryRun=False,
-                Resources=[
-                    customer_gateway_id,
-                ],
-                Tags=[
-                    {
-                        'Key': 'Name',
-                        'Value': customer_gateway_name,
-                    },
-                ],
-                )
+    # Tag the object unless it was tagged on creation.
+    _tag_after_create(client, customer_gateway_id, tags, tag_specifications)
     return response
 
 
-def delete_customer_gateway(**kwargs):
+def delete_customer_gateway(client=None, **kwargs):
     '''
     Deletes the specified customer gateway.
     :param kwargs:
@@ -612,7 +1148,8 @@ def delete_customer_gateway(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_customer_gateway(
+        response = _call(
+            client, 'delete_customer_gateway',
             DryRun=kwargs['DryRun'],
             CustomerGatewayId=kwargs['CustomerGatewayId']
         )
@@ -622,7 +1159,7 @@ def delete_customer_gateway(**kwargs):
 
 
 ########## VPN GATEWAY ##########
-def describe_vpn_gateways(**kwargs):
+def describe_vpn_gateways(client=None, **kwargs):
     '''
     Describes one or more of your virtual private gateways.
     :param kwargs:
@@ -632,12 +1169,14 @@ def describe_vpn_gateways(**kwargs):
     :return:
     '''
     if 'VpnGatewayIds' in kwargs:
-        response = client.describe_vpn_gateways(
+        response = _call(
+            client, 'describe_vpn_gateways',
             DryRun=kwargs['DryRun'],
             VpnGatewayIds=kwargs['VpnGatewayIds']
         )
     elif 'Filters' in kwargs:
-        response = client.describe_vpn_gateways(
+        response = _call(
+            client, 'describe_vpn_gateways',
             DryRun=kwargs['DryRun'],
             Filters=kwargs['Filters']
         )
@@ -646,47 +1185,66 @@ def describe_vpn_gateways(**kwargs):
     return response
 
 
-def create_vpn_gateway(vpn_gateway_name, **kwargs):
+def iter_vpn_gateways(PageSize=100, client=None, **kwargs):
+    '''
+    Yields virtual private gateways one at a time. EC2 returns them in a single response,
+    so PageSize is accepted for symmetry and ignored.
+    :param PageSize: Unused.
+    :param kwargs:
+        DryRun=True|False,
+        VpnGatewayIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_vpn_gateways', 'VpnGateways', PageSize, kwargs)
+
+
+def create_vpn_gateway(vpn_gateway_name, client=None, **kwargs):
     '''
     Creates a virtual private gateway.
     :param kwargs:
         DryRun=True|False,
         Type='ipsec.1',
         AvailabilityZone='string'
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
     :return:
     '''
     try:
+        tags = _name_tags(vpn_gateway_name, kwargs)
+        existing, idempotency = _idempotency('create_vpn_gateway', vpn_gateway_name, tags, client, kwargs)
+        if existing is not None:
+            return existing
+        tag_specifications = _tag_specifications('vpn-gateway', tags, kwargs)
         if 'AvailabilityZone' in kwargs:
-            response = client.create_vpn_gateway(
+            response = _call(
+                client, 'create_vpn_gateway',
                 DryRun=kwargs['DryRun'],
                 Type=kwargs['Type'],
-                AvailabilityZone=kwargs['AvailabilityZone']
+                AvailabilityZone=kwargs['AvailabilityZone'],
+                **tag_specifications,
+                **idempotency
             )
         else:
-            response = client.create_vpn_gateway(
+            response = _call(
+                client, 'create_vpn_gateway',
                 DryRun=kwargs['DryRun'],
-                Type=kwargs['Type']
+                Type=kwargs['Type'],
+                **tag_specifications,
+                **idempotency
             )
 
         vpn_gateway = response.get('VpnGateway', 'Key not found')
         vpn_gateway_id = vpn_gateway.get('VpnGatewayId', 'Key not found')
-        create_tags(DryRun=False,
-                    Resources=[
-                        vpn_gateway_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': vpn_gateway_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, vpn_gateway_id, tags, tag_specifications)
         return response
     except ClientError as e:
         print(e)
 
 
-def attach_vpn_gateway(**kwargs):
+def attach_vpn_gateway(client=None, **kwargs):
     '''
     Attaches a virtual private gateway to a VPC.
     :param kwargs:
@@ -696,7 +1254,8 @@ def attach_vpn_gateway(**kwargs):
     :return:
     '''
     try:
-        response = client.attach_vpn_gateway(
+        response = _call(
+            client, 'attach_vpn_gateway',
             DryRun=kwargs['DryRun'],
             VpnGatewayId=kwargs['VpnGatewayId'],
             VpcId=kwargs['VpcId']
@@ -706,7 +1265,7 @@ def attach_vpn_gateway(**kwargs):
         print(e)
 
 
-def detach_vpn_gateway(**kwargs):
+def detach_vpn_gateway(client=None, **kwargs):
     '''
     Detaches a virtual private gateway from a VPC.
     :param kwargs:
@@ -716,7 +1275,8 @@ def detach_vpn_gateway(**kwargs):
     :return:
     '''
     try:
-        response = client.detach_vpn_gateway(
+        response = _call(
+            client, 'detach_vpn_gateway',
             DryRun=kwargs['DryRun'],
             VpnGatewayId=kwargs['VpnGatewayId'],
             VpcId=kwargs['VpcId']
@@ -726,7 +1286,7 @@ def detach_vpn_gateway(**kwargs):
         print(e)
 
 
-def enable_vgw_route_propagation(**kwargs):
+def enable_vgw_route_propagation(client=None, **kwargs):
     '''
     Enables a virtual private gateway (VGW) to propagate routes to the
     specified route table of a VPC.
@@ -735,14 +1295,15 @@ def enable_vgw_route_propagation(**kwargs):
         GatewayId='string'
     :return:
     '''
-    response = client.enable_vgw_route_propagation(
+    response = _call(
+        client, 'enable_vgw_route_propagation',
         RouteTableId=kwargs['RouteTableId'],
         GatewayId=kwargs['GatewayId']
     )
     return response
 
 
-def disable_vgw_route_propagation(**kwargs):
+def disable_vgw_route_propagation(client=None, **kwargs):
     '''
     Disables a virtual private gateway (VGW) from propagating routes to a
     specified route table of a VPC.
@@ -752,7 +1313,8 @@ def disable_vgw_route_propagation(**kwargs):
     :return:
     '''
     try:
-        response = client.disable_vgw_route_propagation(
+        response = _call(
+            client, 'disable_vgw_route_propagation',
             RouteTableId=kwargs['RouteTableId'],
             GatewayId=kwargs['GatewayId']
         )
@@ -761,7 +1323,7 @@ def disable_vgw_route_propagation(**kwargs):
         print(e)
 
 
-def delete_vpn_gateway(**kwargs):
+def delete_vpn_gateway(client=None, **kwargs):
     '''
     Deletes the specified virtual private gateway.
     :param kwargs:
@@ -770,7 +1332,8 @@ def delete_vpn_gateway(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_vpn_gateway(
+        response = _call(
+            client, 'delete_vpn_gateway',
             DryRun=kwargs['DryRun'],
             VpnGatewayId=kwargs['VpnGatewayId']
         )
@@ -780,7 +1343,7 @@ def delete_vpn_gateway(**kwargs):
 
 
 ########## VPN CONNECTION ##########
-def describe_vpn_connections(**kwargs):
+def describe_vpn_connections(client=None, **kwargs):
     '''
     Describes one or more of your VPN connections.
     :param kwargs:
@@ -791,11 +1354,13 @@ def describe_vpn_connections(**kwargs):
     '''
     try:
         if 'VpnConnectionIds' in kwargs:
-            response = client.describe_vpn_connections(
+            response = _call(
+                client, 'describe_vpn_connections',
                 DryRun=kwargs['DryRun'],
                 VpnConnectionIds=kwargs['VpnConnectionIds'])
         elif 'Filters' in kwargs:
-            response = client.describe_vpn_connections(
+            response = _call(
+                client, 'describe_vpn_connections',
                 DryRun=kwargs['DryRun'],
                 Filters=kwargs['Filters'])
         else:
@@ -805,7 +1370,21 @@ def describe_vpn_connections(**kwargs):
         print(e)
 
 
-def create_vpn_connection(vpn_connection_name, **kwargs):
+def iter_vpn_connections(PageSize=100, client=None, **kwargs):
+    '''
+    Yields VPN connections one at a time. EC2 returns them in a single response,
+    so PageSize is accepted for symmetry and ignored.
+    :param PageSize: Unused.
+    :param kwargs:
+        DryRun=True|False,
+        VpnConnectionIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_vpn_connections', 'VpnConnections', PageSize, kwargs)
+
+
+def create_vpn_connection(vpn_connection_name, client=None, **kwargs):
     '''
     Creates a VPN connection between an existing virtual private gateway and a VPN customer gateway.
     :param kwargs:
@@ -815,35 +1394,37 @@ def create_vpn_connection(vpn_connection_name, **kwargs):
         CustomerGatewayId='string',
         VpnGatewayId='string',
         Options={'StaticRoutesOnly': True|False}
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
     '''
     try:
-        response = client.create_vpn_connection(
+        tags = _name_tags(vpn_connection_name, kwargs)
+        existing, idempotency = _idempotency('create_vpn_connection', vpn_connection_name, tags, client, kwargs)
+        if existing is not None:
+            return existing
+        tag_specifications = _tag_specifications('vpn-connection', tags, kwargs)
+        response = _call(
+            client, 'create_vpn_connection',
             DryRun=kwargs['DryRun'],
             Type=kwargs['Type'],
             CustomerGatewayId=kwargs['CustomerGatewayId'],
             VpnGatewayId=kwargs['VpnGatewayId'],
-            Options=kwargs['Options']
+            Options=kwargs['Options'],
+            **tag_specifications,
+            **idempotency
         )
         vpn_connection = response.get('VpnConnection', 'Key not found')
         vpn_connection_id = vpn_connection.get('VpnConnectionId', 'Key not found')
-        create_tags(DryRun=False,
-                    Resources=[
-                        vpn_connection_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': vpn_connection_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, vpn_connection_id, tags, tag_specifications)
 
         return response
     except ClientError as e:
         print(e)
 
 
-def delete_vpn_connection(**kwargs):
+def delete_vpn_connection(client=None, **kwargs):
     '''
     Deletes the specified VPN connection.
     :param kwargs:
@@ -852,7 +1433,8 @@ def delete_vpn_connection(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_vpn_connection(
+        response = _call(
+            client, 'delete_vpn_connection',
             DryRun=kwargs['DryRun'],
             VpnConnectionId=kwargs['VpnConnectionId']
         )
@@ -861,7 +1443,7 @@ def delete_vpn_connection(**kwargs):
         print(e)
 
 
-def create_vpn_connection_route(**kwargs):
+def create_vpn_connection_route(client=None, **kwargs):
     '''
     Creates a static route associated with a VPN connection between an existing
     virtual private gateway and a VPN customer gateway.
@@ -871,7 +1453,8 @@ def create_vpn_connection_route(**kwargs):
     :return:
     '''
     try:
-        response = client.create_vpn_connection_route(
+        response = _call(
+            client, 'create_vpn_connection_route',
             VpnConnectionId=kwargs['VpnConnectionId'],
             DestinationCidrBlock=kwargs['DestinationCidrBlock']
         )
@@ -880,7 +1463,7 @@ def create_vpn_connection_route(**kwargs):
         print(e)
 
 
-def delete_vpn_connection_route(**kwargs):
+def delete_vpn_connection_route(client=None, **kwargs):
     '''
     Deletes the specified static route associated with a VPN connection between
     an existing virtual private gateway and a VPN customer gateway.
@@ -890,7 +1473,8 @@ def delete_vpn_connection_route(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_vpn_connection_route(
+        response = _call(
+            client, 'delete_vpn_connection_route',
             VpnConnectionId=kwargs['VpnConnectionId'],
             DestinationCidrBlock=kwargs['DestinationCidrBlock']
         )
@@ -900,7 +1484,7 @@ def delete_vpn_connection_route(**kwargs):
 
 
 ########## ROUTE ##########
-def describe_route_tables(**kwargs):
+def describe_route_tables(client=None, **kwargs):
     '''
     Describes one or more of your route tables.
     :param kwargs:
@@ -911,12 +1495,14 @@ def describe_route_tables(**kwargs):
     '''
     try:
         if 'RouteTableIds' in kwargs:
-            response = client.describe_route_tables(
+            response = _call(
+                client, 'describe_route_tables',
                 DryRun=kwargs['DryRun'],
                 RouteTableIds=kwargs['RouteTableIds']
             )
         elif 'Filters' in kwargs:
-            response = client.describe_route_tables(
+            response = _call(
+                client, 'describe_route_tables',
                 DryRun=kwargs['DryRun'],
                 Filters=kwargs['Filters']
             )
@@ -927,40 +1513,55 @@ def describe_route_tables(**kwargs):
         print(e)
 
 
-def create_route_table(route_table_name, **kwargs):
+def iter_route_tables(PageSize=100, client=None, **kwargs):
+    '''
+    Yields route tables one at a time across all result pages.
+    :param PageSize: Number of route tables fetched per call.
+    :param kwargs:
+        DryRun=True|False,
+        RouteTableIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_route_tables', 'RouteTables', PageSize, kwargs)
+
+
+def create_route_table(route_table_name, client=None, **kwargs):
     '''
     Creates a route table for the specified VPC.
     :param kwargs:
         DryRun=True|False,
         VpcId='string'
+        ClientToken='string' optional
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
 
     :return:
     '''
     try:
-        response = client.create_route_table(
+        tags = _name_tags(route_table_name, kwargs)
+        existing, idempotency = _idempotency('create_route_table', route_table_name, tags, client, kwargs)
+        if existing is not None:
+            return existing
+        tag_specifications = _tag_specifications('route-table', tags, kwargs)
+        response = _call(
+            client, 'create_route_table',
             DryRun=kwargs['DryRun'],
-            VpcId=kwargs['VpcId']
+            VpcId=kwargs['VpcId'],
+            **tag_specifications,
+            **idempotency
         )
         route_tabe = response.get('RouteTable', 'Key not found')
         route_table_id = route_tabe.get('RouteTableId', 'Key not Found')
-        # Create name tag for object.
-        create_tags(DryRun=False,
-                    Resources=[
-                        route_table_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': route_table_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, route_table_id, tags, tag_specifications)
         return response
     except ClientError as e:
         print(e)
 
 
-def disassociate_route_table(**kwargs):
+def disassociate_route_table(client=None, **kwargs):
     '''
     Disassociates a subnet from a route table.
     :param kwargs:
@@ -969,7 +1570,8 @@ def disassociate_route_table(**kwargs):
     :return:
     '''
     try:
-        response = client.disassociate_route_table(
+        response = _call(
+            client, 'disassociate_route_table',
             DryRun=kwargs['DryRun'],
             AssociationId=kwargs['AssociationId']
         )
@@ -978,7 +1580,7 @@ def disassociate_route_table(**kwargs):
         print(e)
 
 
-def associate_route_table(**kwargs):
+def associate_route_table(client=None, **kwargs):
     '''
     Associates a subnet with a route table.
     :param kwargs:
@@ -988,7 +1590,8 @@ def associate_route_table(**kwargs):
     :return:
     '''
     try:
-        response = client.associate_route_table(
+        response = _call(
+            client, 'associate_route_table',
             DryRun=kwargs['DryRun'],
             SubnetId=kwargs['SubnetId'],
             RouteTableId=kwargs['RouteTableId']
@@ -998,7 +1601,7 @@ def associate_route_table(**kwargs):
         print(e)
 
 
-def replace_route_table_association(**kwargs):
+def replace_route_table_association(client=None, **kwargs):
     '''
     Changes the route table associated with a given subnet in a VPC.
     :param kwargs:
@@ -1008,7 +1611,8 @@ def replace_route_table_association(**kwargs):
     :return:
     '''
     try:
-        response = client.replace_route_table_association(
+        response = _call(
+            client, 'replace_route_table_association',
             DryRun=kwargs['DryRun'],
             AssociationId=kwargs['AssociationId'],
             RouteTableId=kwargs['RouteTableId']
@@ -1018,7 +1622,7 @@ def replace_route_table_association(**kwargs):
         print(e)
 
 
-def delete_route_table(**kwargs):
+def delete_route_table(client=None, **kwargs):
     '''
     # Deletes the specified route table.
     :param kwargs:
@@ -1027,7 +1631,8 @@ def delete_route_table(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_route_table(
+        response = _call(
+            client, 'delete_route_table',
             DryRun=kwargs['DryRun'],
             RouteTableId=kwargs['RouteTableId']
         )
@@ -1036,171 +1641,129 @@ def delete_route_table(**kwargs):
         print(e)
 
 
-def create_route(**kwargs):
+# Destinations and targets a route can have; create_route and replace_route
+# send whichever of them are given.
+ROUTE_DESTINATIONS = (
+    'DestinationCidrBlock',
+    'DestinationIpv6CidrBlock',
+    'DestinationPrefixListId',
+)
+ROUTE_TARGETS = (
+    'GatewayId',
+    'EgressOnlyInternetGatewayId',
+    'InstanceId',
+    'NetworkInterfaceId',
+    'VpcPeeringConnectionId',
+    'NatGatewayId',
+    'TransitGatewayId',
+    'LocalGatewayId',
+    'CarrierGatewayId',
+    'VpcEndpointId',
+)
+
+
+def _route_arguments(kwargs):
+    '''
+    Picks the route destination and target arguments present in kwargs.
+    :param kwargs: Keyword arguments of create_route or replace_route.
+    :return: Dictionary of the arguments to send.
+    '''
+    return {key: kwargs[key] for key in ROUTE_DESTINATIONS + ROUTE_TARGETS if key in kwargs}
+
+
+def create_route(client=None, **kwargs):
     '''
     Creates a route in a route table within a VPC.
     :param kwargs:
         DryRun=True|False,
         RouteTableId='string',
         DestinationCidrBlock='string',
-        GatewayId='string',
         DestinationIpv6CidrBlock='string',
+        DestinationPrefixListId='string',
+        GatewayId='string',
         EgressOnlyInternetGatewayId='string',
         InstanceId='string',
         NetworkInterfaceId='string',
         VpcPeeringConnectionId='string',
-        NatGatewayId='string'
+        NatGatewayId='string',
+        TransitGatewayId='string',
+        LocalGatewayId='string',
+        CarrierGatewayId='string',
+        VpcEndpointId='string'
+        Only the destination and target keys present are sent.
     :return:
     '''
     try:
-        if 'GatewayId' in kwargs:
-            response = client.create_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                GatewayId=kwargs['GatewayId'],
-            )
-        elif 'InstanceId' in kwargs:
-            response = client.create_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                InstanceId=kwargs['InstanceId']
-            )
-        elif 'EgressOnlyInternetGatewayId' in kwargs:
-            response = client.create_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                EgressOnlyInternetGatewayId=kwargs['EgressOnlyInternetGatewayId']
-            )
-        elif 'NetworkInterfaceId' in kwargs:
-            response = client.create_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                NetworkInterfaceId=kwargs['NetworkInterfaceId']
-            )
-        elif 'VpcPeeringConnectionId' in kwargs:
-            response = client.create_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                VpcPeeringConnectionId=kwargs['VpcPeeringConnectionId']
-            )
-        elif 'NatGatewayId' in kwargs:
-            response = client.create_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                NatGatewayId=kwargs['NatGatewayId']
-            )
-        elif 'DestinationIpv6CidrBlock' in kwargs:
-            response = client.create_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationIpv6CidrBlock=kwargs['DestinationIpv6CidrBlock'],
-                EgressOnlyInternetGatewayId=kwargs['EgressOnlyInternetGatewayId']
-            )
+        response = _call(
+            client, 'create_route',
+            DryRun=kwargs['DryRun'],
+            RouteTableId=kwargs['RouteTableId'],
+            **_route_arguments(kwargs)
+        )
         return response
     except ClientError as e:
         print(e)
 
 
-def delete_route(**kwargs):
+def delete_route(client=None, **kwargs):
     '''
     Deletes a specified route from the specified route table.
     :param kwargs:
         DryRun=True|False,
         RouteTableId='string',
         DestinationCidrBlock='string',
-        DestinationIpv6CidrBlock='string'
+        DestinationIpv6CidrBlock='string',
+        DestinationPrefixListId='string'
     :return:
     '''
     try:
-        if 'DestinationIpv6CidrBlock' in kwargs:
-            response = client.delete_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationIpv6CidrBlock=kwargs['DestinationIpv6CidrBlock']
-            )
-        else:
-            response = client.delete_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock']
-            )
+        response = _call(
+            client, 'delete_route',
+            DryRun=kwargs['DryRun'],
+            RouteTableId=kwargs['RouteTableId'],
+            **{key: kwargs[key] for key in ROUTE_DESTINATIONS if key in kwargs}
+        )
         return response
     except ClientError as e:
         print(e)
 
 
-def replace_route(**kwargs):
+def replace_route(client=None, **kwargs):
     '''
     Replaces an existing route within a route table in a VPC.
     :param kwargs:
-         DryRun=True|False,
+        DryRun=True|False,
         RouteTableId='string',
         DestinationCidrBlock='string',
-        GatewayId='string',
         DestinationIpv6CidrBlock='string',
+        DestinationPrefixListId='string',
+        GatewayId='string',
         EgressOnlyInternetGatewayId='string',
         InstanceId='string',
         NetworkInterfaceId='string',
         VpcPeeringConnectionId='string',
-        NatGatewayId='string'
+        NatGatewayId='string',
+        TransitGatewayId='string',
+        LocalGatewayId='string',
+        CarrierGatewayId='string',
+        VpcEndpointId='string'
+        Only the destination and target keys present are sent.
     :return:
     '''
     try:
-        if 'GatewayId' in kwargs:
-            response = client.replace_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                GatewayId=kwargs['GatewayId']
-            )
-        elif 'InstanceId' in kwargs:
-            response = client.replace_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                InstanceId=kwargs['InstanceId']
-            )
-        elif 'NetworkInterfaceId' in kwargs:
-            response = client.replace_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                NetworkInterfaceId=kwargs['NetworkInterfaceId']
-            )
-        elif 'VpcPeeringConnectionId' in kwargs:
-            response = client.replace_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                VpcPeeringConnectionId=kwargs['VpcPeeringConnectionId']
-            )
-        elif 'NatGatewayId' in kwargs:
-            response = client.replace_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationCidrBlock=kwargs['DestinationCidrBlock'],
-                NatGatewayId=kwargs['NatGatewayId']
-            )
-        elif 'DestinationIpv6CidrBlock' in kwargs:
-            response = client.replace_route(
-                DryRun=kwargs['DryRun'],
-                RouteTableId=kwargs['RouteTableId'],
-                DestinationIpv6CidrBlock=kwargs['DestinationIpv6CidrBlock'],
-                EgressOnlyInternetGatewayId=kwargs['EgressOnlyInternetGatewayId']
-            )
+        response = _call(
+            client, 'replace_route',
+            DryRun=kwargs['DryRun'],
+            RouteTableId=kwargs['RouteTableId'],
+            **_route_arguments(kwargs)
+        )
         return response
     except ClientError as e:
         print(e)
 
 
 ########## ACL ##########
-def describe_network_acls(**kwargs):
+def describe_network_acls(client=None, **kwargs):
     '''
     Describes one or more of your network ACLs.
     :param kwargs:
@@ -1211,12 +1774,14 @@ def describe_network_acls(**kwargs):
     '''
     try:
         if 'NetworkAclIds' in kwargs:
-            response = client.describe_network_acls(
+            response = _call(
+                client, 'describe_network_acls',
                 DryRun=kwargs['DryRun'],
                 NetworkAclIds=kwargs['NetworkAclIds']
             )
         elif 'Filters' in kwargs:
-            response = client.describe_network_acls(
+            response = _call(
+                client, 'describe_network_acls',
                 DryRun=kwargs['DryRun'],
                 Filters=kwargs['Filters']
             )
@@ -1227,39 +1792,75 @@ def describe_network_acls(**kwargs):
         print(e)
 
 
-def create_network_acl(network_acl_name, **kwargs):
+def iter_network_acls(PageSize=100, client=None, **kwargs):
+    '''
+    Yields network ACLs one at a time across all result pages.
+    :param PageSize: Number of network ACLs fetched per call.
+    :param kwargs:
+        DryRun=True|False,
+        NetworkAclIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_network_acls', 'NetworkAcls', PageSize, kwargs)
+
+
+def create_network_acl(network_acl_name, client=None, **kwargs):
     '''
     Creates a network ACL in a VPC.
     :param kwargs:
         DryRun=True|False,
         VpcId='string'
+        ClientToken='string' optional
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
     :return:
     '''
     try:
-        response = client.create_network_acl(
+        tags = _name_tags(network_acl_name, kwargs)
+        existing, idempotency = _idempotency('create_network_acl', network_acl_name, tags, client, kwargs)
+        if existing is not None:
+            return existing
+        tag_specifications = _tag_specifications('network-acl', tags, kwargs)
+        response = _call(
+            client, 'create_network_acl',
             DryRun=kwargs['DryRun'],
-            VpcId=kwargs['VpcId']
+            VpcId=kwargs['VpcId'],
+            **tag_specifications,
+            **idempotency
         )
         network_acl = response.get('NetworkAcl', 'Key not found')
         network_acl_id = network_acl.get('NetworkAclId', 'Key not found')
-        create_tags(DryRun=False,
-                    Resources=[
-                        network_acl_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': network_acl_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, network_acl_id, tags, tag_specifications)
 
         return response
     except ClientError as e:
         print(e)
 
 
-def create_network_acl_entry(**kwargs):
+# Optional network ACL entry arguments; create_network_acl_entry and
+# replace_network_acl_entry send whichever of them are given.
+ACL_ENTRY_OPTIONS = (
+    'CidrBlock',
+    'Ipv6CidrBlock',
+    'IcmpTypeCode',
+    'PortRange',
+)
+
+
+def _acl_entry_arguments(kwargs):
+    '''
+    Picks the network ACL entry arguments present in kwargs.
+    :param kwargs: Keyword arguments of create_network_acl_entry or
+        replace_network_acl_entry.
+    :return: Dictionary of the arguments to send.
+    '''
+    return {key: kwargs[key] for key in ACL_ENTRY_OPTIONS if key in kwargs}
+
+
+def create_network_acl_entry(client=None, **kwargs):
     '''
     Creates an entry (a rule) in a network ACL with the specified rule number.
     :param kwargs:
@@ -1273,49 +1874,49 @@ def create_network_acl_entry(**kwargs):
         Ipv6CidrBlock='string',
         IcmpTypeCode={'Type': 123, 'Code': 123},
         PortRange={'From': 123, 'To': 123}
+        Only the optional keys present are sent.
     :return:
     '''
     try:
-        if 'Ipv6CidrBlock' not in kwargs and 'IcmpTypeCode' not in kwargs:
-            response = client.create_network_acl_entry(
-                DryRun=kwargs['DryRun'],
-                NetworkAclId=kwargs['NetworkAclId'],
-                RuleNumber=kwargs['RuleNumber'],
-                Protocol=kwargs['Protocol'],
-                RuleAction=kwargs['RuleAction'],
-                Egress=kwargs['Egress'],
-                CidrBlock=kwargs['CidrBlock'],
-                PortRange=kwargs['PortRange']
-            )
-        elif 'Ipv6CidrBlock' not in kwargs and 'IcmpTypeCode' in kwargs:
-            response = client.create_network_acl_entry(
-                DryRun=kwargs['DryRun'],
-                NetworkAclId=kwargs['NetworkAclId'],
-                RuleNumber=kwargs['RuleNumber'],
-                Protocol=kwargs['Protocol'],
-                RuleAction=kwargs['RuleAction'],
-                Egress=kwargs['Egress'],
-                CidrBlock=kwargs['CidrBlock'],
-                IcmpTypeCode=kwargs['IcmpTypeCode'],
-                PortRange=kwargs['PortRange']
-            )
-        elif 'Ipv6CidrBlock' in kwargs:
-            response = client.create_network_acl_entry(
-                DryRun=kwargs['DryRun'],
-                NetworkAclId=kwargs['NetworkAclId'],
-                RuleNumber=kwargs['RuleNumber'],
-                Protocol=kwargs['Protocol'],
-                RuleAction=kwargs['RuleAction'],
-                Egress=kwargs['Egress'],
-                Ipv6CidrBlock=kwargs['Ipv6CidrBlock'],
-                PortRange=kwargs['PortRange']
-            )
+        response = _call(
+            client, 'create_network_acl_entry',
+            DryRun=kwargs['DryRun'],
+            NetworkAclId=kwargs['NetworkAclId'],
+            RuleNumber=kwargs['RuleNumber'],
+            Protocol=kwargs['Protocol'],
+            RuleAction=kwargs['RuleAction'],
+            Egress=kwargs['Egress'],
+            **_acl_entry_arguments(kwargs)
+        )
         return response
     except ClientError as e:
         print(e)
 
 
-def delete_network_acl(**kwargs):
+def delete_network_acl_entry(client=None, **kwargs):
+    '''
+    Deletes the entry (rule) with the specified rule number from a network ACL.
+    :param kwargs:
+        DryRun=True|False,
+        NetworkAclId='string',
+        RuleNumber=123,
+        Egress=True|False
+    :return:
+    '''
+    try:
+        response = _call(
+            client, 'delete_network_acl_entry',
+            DryRun=kwargs['DryRun'],
+            NetworkAclId=kwargs['NetworkAclId'],
+            RuleNumber=kwargs['RuleNumber'],
+            Egress=kwargs['Egress']
+        )
+        return response
+    except ClientError as e:
+        print(e)
+
+
+def delete_network_acl(client=None, **kwargs):
     '''
     Deletes the specified network ACL.
     :param kwargs:
@@ -1324,7 +1925,8 @@ def delete_network_acl(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_network_acl(
+        response = _call(
+            client, 'delete_network_acl',
             DryRun=kwargs['DryRun'],
             NetworkAclId=kwargs['NetworkAclId']
         )
@@ -1333,7 +1935,7 @@ def delete_network_acl(**kwargs):
         print(e)
 
 
-def replace_network_acl_association(**kwargs):
+def replace_network_acl_association(client=None, **kwargs):
     '''
     Changes which network ACL a subnet is associated with.
     :param kwargs:
@@ -1343,7 +1945,8 @@ def replace_network_acl_association(**kwargs):
     :return:
     '''
     try:
-        response = client.replace_network_acl_association(
+        response = _call(
+            client, 'replace_network_acl_association',
             DryRun=kwargs['DryRun'],
             AssociationId=kwargs['AssociationId'],
             NetworkAclId=kwargs['NetworkAclId']
@@ -1353,11 +1956,10 @@ def replace_network_acl_association(**kwargs):
         print(e)
 
 
-def replace_network_acl_entry(**kwargs):
+def replace_network_acl_entry(client=None, **kwargs):
     '''
     Replaces an entry (rule) in a network ACL.
     :param kwargs:
-    :return:
         DryRun=True|False,
         NetworkAclId='string',
         RuleNumber=123,
@@ -1368,42 +1970,20 @@ def replace_network_acl_entry(**kwargs):
         Ipv6CidrBlock='string',
         IcmpTypeCode={'Type': 123, 'Code': 123},
         PortRange={'From': 123, 'To': 123}
+        Only the optional keys present are sent.
+    :return:
     '''
     try:
-        if 'Ipv6CidrBlock' not in kwargs and 'IcmpTypeCode' not in kwargs:
-            response = client.create_network_acl_entry(
-                DryRun=kwargs['DryRun'],
-                NetworkAclId=kwargs['NetworkAclId'],
-                RuleNumber=kwargs['RuleNumber'],
-                Protocol=kwargs['Protocol'],
-                RuleAction=kwargs['RuleAction'],
-                Egress=kwargs['Egress'],
-                CidrBlock=kwargs['CidrBlock'],
-                PortRange=kwargs['PortRange']
-            )
-        elif 'Ipv6CidrBlock' not in kwargs and 'IcmpTypeCode' in kwargs:
-            response = client.create_network_acl_entry(
-                DryRun=kwargs['DryRun'],
-                NetworkAclId=kwargs['NetworkAclId'],
-                RuleNumber=kwargs['RuleNumber'],
-                Protocol=kwargs['Protocol'],
-                RuleAction=kwargs['RuleAction'],
-                Egress=kwargs['Egress'],
-                CidrBlock=kwargs['CidrBlock'],
-                IcmpTypeCode=kwargs['IcmpTypeCode'],
-                PortRange=kwargs['PortRange']
-            )
-        elif 'Ipv6CidrBlock' in kwargs:
-            response = client.create_network_acl_entry(
-                DryRun=kwargs['DryRun'],
-                NetworkAclId=kwargs['NetworkAclId'],
-                RuleNumber=kwargs['RuleNumber'],
-                Protocol=kwargs['Protocol'],
-                RuleAction=kwargs['RuleAction'],
-                Egress=kwargs['Egress'],
-                Ipv6CidrBlock=kwargs['Ipv6CidrBlock'],
-                PortRange=kwargs['PortRange']
-            )
+        response = _call(
+            client, 'replace_network_acl_entry',
+            DryRun=kwargs['DryRun'],
+            NetworkAclId=kwargs['NetworkAclId'],
+            RuleNumber=kwargs['RuleNumber'],
+            Protocol=kwargs['Protocol'],
+            RuleAction=kwargs['RuleAction'],
+            Egress=kwargs['Egress'],
+            **_acl_entry_arguments(kwargs)
+        )
         return response
     except ClientError as e:
         print(e)
@@ -1411,7 +1991,7 @@ def replace_network_acl_entry(**kwargs):
 
 ########## PEERING ##########
 
-def describe_vpc_peering_connections(**kwargs):
+def describe_vpc_peering_connections(client=None, **kwargs):
     '''
     Describes one or more of your VPC peering connections.
     :param kwargs:
@@ -1422,12 +2002,14 @@ def describe_vpc_peering_connections(**kwargs):
     '''
     try:
         if 'VpcPeeringConnectionIds' in kwargs:
-            response = client.describe_vpc_peering_connections(
+            response = _call(
+                client, 'describe_vpc_peering_connections',
                 DryRun=kwargs['DryRun'],
                 VpcPeeringConnectionIds=kwargs['VpcPeeringConnectionIds']
             )
         elif 'Filters' in kwargs:
-            response = client.describe_vpc_peering_connections(
+            response = _call(
+                client, 'describe_vpc_peering_connections',
                 DryRun=kwargs['DryRun'],
                 Filters=kwargs['Filters']
             )
@@ -1436,7 +2018,20 @@ def describe_vpc_peering_connections(**kwargs):
         print(e)
 
 
-def create_vpc_peering_connection(peering_name, **kwargs):
+def iter_vpc_peering_connections(PageSize=100, client=None, **kwargs):
+    '''
+    Yields VPC peering connections one at a time across all result pages.
+    :param PageSize: Number of VPC peering connections fetched per call.
+    :param kwargs:
+        DryRun=True|False,
+        VpcPeeringConnectionIds=['string',]
+        Filters=[{'Name': 'string', 'Values': ['string',]},]
+    :return: Generator of resource dictionaries.
+    '''
+    return _paginate(client, 'describe_vpc_peering_connections', 'VpcPeeringConnections', PageSize, kwargs)
+
+
+def create_vpc_peering_connection(peering_name, client=None, **kwargs):
     '''
     Requests a VPC peering connection between two VPCs
     :param kwargs:
@@ -1444,35 +2039,37 @@ def create_vpc_peering_connection(peering_name, **kwargs):
         VpcId='string'
         PeerVpcId='string'
         PeerOwnerId='string'
+        Tags=[{'Key': 'string', 'Value': 'string'},] optional extra tags.
+        TagOnCreate=True|False optional, defaults to TAG_ON_CREATE.
+        Idempotent=True|False optional, defaults to IDEMPOTENT.
     :return:
     '''
     try:
-        response = client.create_vpc_peering_connection(
+        tags = _name_tags(peering_name, kwargs)
+        existing, idempotency = _idempotency('create_vpc_peering_connection', peering_name, tags, client, kwargs)
+        if existing is not None:
+            return existing
+        tag_specifications = _tag_specifications('vpc-peering-connection', tags, kwargs)
+        response = _call(
+            client, 'create_vpc_peering_connection',
             DryRun=kwargs['DryRun'],
             VpcId=kwargs['VpcId'],
             PeerVpcId=kwargs['PeerVpcId'],
-            PeerOwnerId=kwargs['PeerOwnerId']
+            PeerOwnerId=kwargs['PeerOwnerId'],
+            **tag_specifications,
+            **idempotency
         )
         vpc_peering_connection = response.get('VpcPeeringConnection', 'Key not found')
         vpc_peering_connection_id = vpc_peering_connection.get('VpcPeeringConnectionId', 'Key not found')
-        create_tags(DryRun=False,
-                    Resources=[
-                        vpc_peering_connection_id,
-                    ],
-                    Tags=[
-                        {
-                            'Key': 'Name',
-                            'Value': peering_name,
-                        },
-                    ],
-                    )
+        # Tag the object unless it was tagged on creation.
+        _tag_after_create(client, vpc_peering_connection_id, tags, tag_specifications)
 
         return response
     except ClientError as e:
         print(e)
 
 
-def accept_vpc_peering_connection(**kwargs):
+def accept_vpc_peering_connection(client=None, **kwargs):
     '''
     Accept a VPC peering connection request.
     :param kwargs:
@@ -1481,7 +2078,8 @@ def accept_vpc_peering_connection(**kwargs):
     :return:
     '''
     try:
-        response = client.accept_vpc_peering_connection(
+        response = _call(
+            client, 'accept_vpc_peering_connection',
             DryRun=kwargs['DryRun'],
             VpcPeeringConnectionId=kwargs['VpcPeeringConnectionId']
         )
@@ -1490,7 +2088,7 @@ def accept_vpc_peering_connection(**kwargs):
         print(e)
 
 
-def reject_vpc_peering_connection(**kwargs):
+def reject_vpc_peering_connection(client=None, **kwargs):
     '''
     Rejects a VPC peering connection request.
     :param kwargs:
@@ -1499,7 +2097,8 @@ def reject_vpc_peering_connection(**kwargs):
     :return:
     '''
     try:
-        response = client.reject_vpc_peering_connection(
+        response = _call(
+            client, 'reject_vpc_peering_connection',
             DryRun=kwargs['DryRun'],
             VpcPeeringConnectionId=kwargs['VpcPeeringConnectionId']
         )
@@ -1508,7 +2107,7 @@ def reject_vpc_peering_connection(**kwargs):
         print(e)
 
 
-def modify_vpc_peering_connection_options(**kwargs):
+def modify_vpc_peering_connection_options(client=None, **kwargs):
     '''
     Modifies the VPC peering connection options on one side of a VPC peering connection.
     :param kwargs:
@@ -1527,7 +2126,8 @@ def modify_vpc_peering_connection_options(**kwargs):
     :return:
     '''
     try:
-        response = client.modify_vpc_peering_connection_options(
+        response = _call(
+            client, 'modify_vpc_peering_connection_options',
             DryRun=kwargs['DryRun'],
             VpcPeeringConnectionId=kwargs['VpcPeeringConnectionId'],
             RequesterPeeringConnectionOptions=kwargs['RequesterPeeringConnectionOptions'],
@@ -1538,7 +2138,7 @@ def modify_vpc_peering_connection_options(**kwargs):
         print(e)
 
 
-def delete_vpc_peering_connection(**kwargs):
+def delete_vpc_peering_connection(client=None, **kwargs):
     '''
     Deletes a VPC peering connection.
     :param kwargs:
@@ -1547,7 +2147,8 @@ def delete_vpc_peering_connection(**kwargs):
     :return:
     '''
     try:
-        response = client.delete_vpc_peering_connection(
+        response = _call(
+            client, 'delete_vpc_peering_connection',
             DryRun=kwargs['DryRun'],
             VpcPeeringConnectionId=kwargs['VpcPeeringConnectionId']
         )
@@ -1557,22 +2158,32 @@ def delete_vpc_peering_connection(**kwargs):
 
 
 # General
-def create_tags(**kwargs):
+
+# Maximum number of resource ids accepted by one CreateTags call.
+MAX_TAG_RESOURCES = 1000
+
+
+def create_tags(client=None, **kwargs):
     '''
     Adds or overwrites one or more tags for the specified Amazon EC2 resource
-    or resources.
+    or resources. To tag many resources use tagging.TagBatcher, which groups
+    them into as few calls as possible.
     :param kwargs:
+        DryRun=True|False,
+        Resources=['string',] up to MAX_TAG_RESOURCES ids,
+        Tags=[{'Key': 'string', 'Value': 'string'},]
     :return:
     '''
     try:
-        response = client.create_tags(
+        response = _call(
+            client, 'create_tags',
             DryRun=kwargs['DryRun'],
             Resources=kwargs['Resources'],
             Tags=kwargs['Tags']
         )
+        return response
     except ClientError as e:
         print(e)
-    return response
 
 
 def main():
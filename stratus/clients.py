@@ -0,0 +1,144 @@
+__author__ = 'rafael'
+
+import threading
+
+# Lazily built, thread-safe registry of boto3 clients.
+
+# Clients are keyed by (region, profile, role_arn) so one process can work
+# against several regions and accounts at once. Nothing is imported or built
+# until the first client is requested.
+#
+# Usage:
+#     from stratus import clients, cirrus
+#
+#     client = clients.get_client(region='us-west-2', profile='prod')
+#     cirrus.describe_vpcs(client=client, DryRun=False, VpcIds=['all'])
+
+# Session name used when assuming a role for a client.
+ROLE_SESSION_NAME = 'stratus'
+
+
+def _boto3_factory(service, region=None, profile=None, role_arn=None):
+    '''
+    Builds a boto3 client, assuming role_arn with auto-refreshing credentials
+    when given.
+    :param service: AWS service name, e.g. 'ec2'.
+    :param region: Region name; None uses the profile/environment default.
+    :param profile: Named profile from the AWS config files.
+    :param role_arn: ARN of a role to assume, e.g. in another account.
+    :return: boto3 client
+    '''
+    import boto3
+    from botocore.credentials import (CredentialProvider, CredentialResolver,
+                                      DeferredRefreshableCredentials)
+    from botocore.session import Session
+
+    session = boto3.session.Session(profile_name=profile, region_name=region)
+    if role_arn is None:
+        return session.client(service)
+
+    sts = session.client('sts')
+
+    def refresh():
+        credentials = sts.assume_role(
+            RoleArn=role_arn,
+            RoleSessionName=ROLE_SESSION_NAME
+        )['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat(),
+        }
+
+    class AssumeRoleProvider(CredentialProvider):
+        METHOD = 'sts-assume-role'
+
+        def load(self):
+            return DeferredRefreshableCredentials(refresh_using=refresh,
+                                                  method=self.METHOD)
+
+    # The role session resolves credentials only through the assumed role,
+    # refreshed by botocore before they expire.
+    botocore_session = Session()
+    botocore_session.register_component(
+        'credential_provider', CredentialResolver(providers=[AssumeRoleProvider()]))
+    role_session = boto3.session.Session(
+        botocore_session=botocore_session,
+        region_name=session.region_name
+    )
+    return role_session.client(service)
+
+
+class ClientRegistry:
+    '''
+    Caches one client per (region, profile, role_arn).
+
+    Args:
+        service (str): AWS service name; default is 'ec2'.
+        factory (callable): Called as factory(service, region=, profile=,
+            role_arn=) to build a missing client; default builds a boto3
+            client.
+    '''
+
+    def __init__(self, service='ec2', factory=None):
+        self.service = service
+        self.factory = factory or _boto3_factory
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, region=None, profile=None, role_arn=None):
+        '''
+        Returns the client for the given region and credentials, building it
+        on first use.
+        :param region: Region name.
+        :param profile: Named profile.
+        :param role_arn: ARN of a role to assume.
+        :return: client
+        '''
+        key = (region, profile, role_arn)
+        client = self._clients.get(key)
+        if client is None:
+            # boto3 sessions are not thread-safe to build, so creation is
+            # serialized; lookups of existing clients stay lock-free.
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self.factory(self.service, region=region,
+                                          profile=profile, role_arn=role_arn)
+                    self._clients[key] = client
+        return client
+
+    def set_factory(self, factory):
+        '''
+        Replaces the client factory and drops every cached client.
+        :param factory: callable, see the class docstring.
+        :return:
+        '''
+        with self._lock:
+            self.factory = factory or _boto3_factory
+            self._clients = {}
+
+    def clear(self):
+        '''
+        Drops every cached client.
+        :return:
+        '''
+        with self._lock:
+            self._clients = {}
+
+
+# Registry shared by the cirrus functions.
+registry = ClientRegistry()
+
+
+def get_client(region=None, profile=None, role_arn=None):
+    '''
+    Returns an EC2 client from the shared registry. The default client,
+    get_client(), uses the region and credentials of the environment.
+    :param region: Region name.
+    :param profile: Named profile.
+    :param role_arn: ARN of a role to assume.
+    :return: EC2 client
+    '''
+    return registry.get(region=region, profile=profile, role_arn=role_arn)
@@ -10,6 +10,9 @@ from azure.mgmt.network import NetworkManagementClient
 
 from msrestazure import azure_exceptions
 
+from stratus import metrics
+from stratus import tracing
+
 # Cloud definitions:
 # AZURE_PUBLIC_CLOUD
 # AZURE_CHINA_CLOUD
@@ -44,6 +47,9 @@ https://azure-sdk-for-python.readthedocs.io/en/latest/ref/azure.mgmt.network.v20
 '''
 
 # Virtual Networks Functions:
+@tracing.traced(category='azure')
+@metrics.instrument(target=lambda resource_group_name, *args, **kwargs: resource_group_name,
+                    failed=lambda result: isinstance(result, azure_exceptions.CloudError))
 def create_update_vnet(
         resource_group_name,
         virtual_network_name,
@@ -0,0 +1,232 @@
+__author__ = 'rafael'
+
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from stratus import plan
+from stratus import tracing
+
+# Dependency graph of cirrus calls and a concurrent executor for it.
+
+# Every node is one function call. A node runs as soon as all the nodes it
+# depends on have succeeded, so independent calls (all subnets of a VPC, all
+# route table associations, ...) are in flight at the same time. Arguments can
+# hold Ref placeholders for values returned by other nodes; each Ref is also a
+# dependency. In plan mode every node reports its dependencies to the plan, so
+# the planned depth follows after= ordering as well as Refs.
+#
+# Usage:
+#     from stratus import cirrus, dag
+#
+#     graph = dag.Graph()
+#     graph.add('vpc', cirrus.create_vpc, args=('main',), kwargs={...})
+#     graph.add('subnet', cirrus.create_subnet, args=('web',),
+#               kwargs={'VpcId': dag.Ref('vpc', 'Vpc', 'VpcId'), ...})
+#     results = dag.execute(graph)
+
+
+class Ref:
+    '''
+    Placeholder for a value taken from the response of another node.
+
+    Args:
+        node (str): Key of the node.
+        *path (str): Keys followed into the node's response.
+    '''
+
+    def __init__(self, node, *path):
+        self.node = node
+        self.path = path
+
+    def __repr__(self):
+        return 'Ref({})'.format(', '.join(repr(part) for part in (self.node,) + self.path))
+
+    def resolve(self, results):
+        value = results[self.node]
+        for key in self.path:
+            value = value[key]
+        return value
+
+
+def _refs(value):
+    '''
+    Yields every Ref nested in value.
+    '''
+    if isinstance(value, Ref):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _refs(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _refs(item)
+
+
+def resolve(value, results):
+    '''
+    Returns a copy of value with every Ref replaced by its value.
+    :param value: Argument value, possibly nested dicts/lists holding Refs.
+    :param results: Responses of finished nodes keyed by node key.
+    :return: Resolved value.
+    '''
+    if isinstance(value, Ref):
+        return value.resolve(results)
+    if isinstance(value, dict):
+        return {key: resolve(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item, results) for item in value]
+    if isinstance(value, tuple):
+        return tuple(resolve(item, results) for item in value)
+    return value
+
+
+class Node:
+    def __init__(self, key, func, args, kwargs, after):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.deps = set(after)
+        self.deps.update(ref.node for ref in _refs((args, kwargs)))
+
+
+class Graph:
+    '''
+    Ordered collection of nodes.
+    '''
+
+    def __init__(self):
+        self.nodes = OrderedDict()
+
+    def add(self, key, func, args=(), kwargs=None, after=()):
+        '''
+        Adds a node.
+        :param key: Unique node key.
+        :param func: Function to call, usually a cirrus function.
+        :param args: Positional arguments; may hold Refs.
+        :param kwargs: Keyword arguments; may hold Refs.
+        :param after: Keys of nodes that must succeed first, in addition to
+            the nodes referenced by Refs.
+        :return: (Node)
+        '''
+        if key in self.nodes:
+            raise ValueError('Duplicate node {}'.format(key))
+        node = Node(key, func, tuple(args), dict(kwargs or {}), after)
+        self.nodes[key] = node
+        return node
+
+    def levels(self):
+        '''
+        Groups node keys by dependency depth. Nodes of one level only depend
+        on earlier levels, so the number of levels is the number of rounds of
+        calls needed when every level runs concurrently.
+        :return: List of lists of node keys.
+        '''
+        depth = {}
+        for key in self._order():
+            node = self.nodes[key]
+            depth[key] = 1 + max((depth[dep] for dep in node.deps), default=-1)
+        levels = []
+        for key, level in depth.items():
+            while len(levels) <= level:
+                levels.append([])
+            levels[level].append(key)
+        return levels
+
+    def _order(self):
+        '''
+        Returns node keys in dependency order.
+        '''
+        for node in self.nodes.values():
+            missing = node.deps - set(self.nodes)
+            if missing:
+                raise ValueError('Node {} depends on unknown nodes {}'.format(
+                    node.key, sorted(missing)))
+        order = []
+        done = set()
+        remaining = list(self.nodes)
+        while remaining:
+            ready = [key for key in remaining if self.nodes[key].deps <= done]
+            if not ready:
+                raise ValueError('Dependency cycle between {}'.format(remaining))
+            order.extend(ready)
+            done.update(ready)
+            remaining = [key for key in remaining if key not in done]
+        return order
+
+
+@tracing.traced('dag.execute', category='dag')
+def execute(graph, max_workers=16, journal=None):
+    '''
+    Runs every node of graph, each as soon as its dependencies succeeded.
+    A node fails when it raises or returns None, which is how cirrus functions
+    report a ClientError; nodes depending on it are skipped.
+    :param graph: (Graph)
+    :param max_workers: Number of calls in flight at once.
+    :param journal: Optional journal.Journal; nodes it records as done are
+        not called again and return their recorded response. Not allowed in
+        plan mode.
+    :return: Dictionary of node key to response; None for failed or skipped
+        nodes.
+    '''
+    graph._order()
+    if journal is not None and plan.active is not None:
+        raise RuntimeError('steps cannot be journaled in plan mode')
+    results = {}
+    waiting = OrderedDict((key, set(node.deps)) for key, node in graph.nodes.items())
+    running = {}
+
+    recorder = plan.active
+
+    def call(node):
+        args = resolve(node.args, results)
+        kwargs = resolve(node.kwargs, results)
+        if journal is not None:
+            return journal.step(node.key, node.func, *args, **kwargs)
+        return node.func(*args, **kwargs)
+
+    def run(node):
+        with tracing.span(node.key, category='dag', after=sorted(node.deps)):
+            if recorder is None:
+                return call(node)
+            with recorder.node(node.key, after=node.deps):
+                return call(node)
+
+    run = tracing.propagate(run)
+
+    def finish(key, response):
+        results[key] = response
+        if response is not None:
+            return
+        # Skip everything that transitively depends on the failed node.
+        failed = [key]
+        while failed:
+            current = failed.pop()
+            for other, deps in list(waiting.items()):
+                if current in deps:
+                    print('Step {} skipped, {} failed.'.format(other, current))
+                    del waiting[other]
+                    results[other] = None
+                    failed.append(other)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while waiting or running:
+            for key, deps in list(waiting.items()):
+                if all(results.get(dep) is not None for dep in deps):
+                    del waiting[key]
+                    running[executor.submit(run, graph.nodes[key])] = key
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    print('Step {} failed: {}'.format(key, e))
+                    response = None
+                else:
+                    if response is None:
+                        print('Step {} failed.'.format(key))
+                finish(key, response)
+    return results
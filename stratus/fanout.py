@@ -0,0 +1,163 @@
+__author__ = 'rafael'
+
+import queue
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from stratus import cirrus
+from stratus import clients
+from stratus import tracing
+
+# Runs a cirrus describer across many (account, region) targets at once.
+
+# Usage:
+#     from stratus import cirrus, fanout
+#
+#     targets = fanout.role_targets(['111111111111', '222222222222'],
+#                                   ['us-east-1', 'us-west-2'],
+#                                   'NetworkAudit')
+#     for result in fanout.fan_out(cirrus.iter_subnets, targets):
+#         print(result.account, result.region, result.resource['SubnetId'])
+
+# A target is an account/region pair plus the credentials used to reach it.
+# With neither profile nor role_arn the environment credentials are used.
+Target = namedtuple('Target', ['account', 'region', 'profile', 'role_arn'])
+Target.__new__.__defaults__ = (None, None)
+
+# One item of the merged stream. resource is a response dictionary for
+# describe_* functions and a single resource for iter_* generators; error is
+# set instead when the target failed (the ClientError of an AccessDenied or
+# still throttled call, say) or timed out. A target whose listing fails part
+# way yields the resources read so far and then its error.
+Result = namedtuple('Result', ['account', 'region', 'resource', 'error'])
+
+_DONE = object()
+
+
+def role_targets(accounts, regions, role_name, partition='aws'):
+    '''
+    Builds one target per account and region that assumes the same role name
+    in every account.
+    :param accounts: Account ids.
+    :param regions: Region names.
+    :param role_name: Name of the role to assume in each account.
+    :param partition: 'aws', 'aws-us-gov' or 'aws-cn'.
+    :return: List of Target.
+    '''
+    return [
+        Target(account, region,
+               role_arn='arn:{}:iam::{}:role/{}'.format(partition, account, role_name))
+        for account in accounts
+        for region in regions
+    ]
+
+
+class _TargetState:
+    def __init__(self, target):
+        self.target = target
+        self.started = None
+        self.expired = False
+        self.finished = False
+        # Time spent waiting on a full results queue, which is the consumer's
+        # time rather than the describer's and so does not count against the
+        # timeout.
+        self.blocked = 0.0
+        self.blocked_since = None
+
+    def elapsed(self, now):
+        blocked = self.blocked
+        if self.blocked_since is not None:
+            blocked += now - self.blocked_since
+        return now - self.started - blocked
+
+
+def fan_out(describer, targets, max_workers=16, timeout=60, **kwargs):
+    '''
+    Runs describer once per target on a bounded thread pool and yields Result
+    records as they arrive, so the total time is close to that of the slowest
+    target rather than the sum of all of them.
+    :param describer: A cirrus describe_* or iter_* function.
+    :param targets: Iterable of Target or (account, region) tuples.
+    :param max_workers: Number of targets queried at once.
+    :param timeout: Seconds a target's describer may run before the target is
+        reported as timed out and its remaining results are dropped; time spent
+        waiting for the caller to consume results is not counted. None waits
+        forever.
+    :param kwargs: Arguments passed to describer, e.g. DryRun=False.
+    :return: Generator of Result.
+    '''
+    states = [_TargetState(Target(*target)) for target in targets]
+    results = queue.Queue(maxsize=max_workers * 64)
+    closed = []
+
+    def put(item, state):
+        try:
+            results.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        state.blocked_since = time.monotonic()
+        try:
+            while not closed and not state.expired:
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            state.blocked += time.monotonic() - state.blocked_since
+            state.blocked_since = None
+
+    def run(index):
+        state = states[index]
+        state.started = time.monotonic()
+        target = state.target
+        try:
+            client = clients.get_client(region=target.region,
+                                        profile=target.profile,
+                                        role_arn=target.role_arn)
+            response = cirrus.raising(describer)(client=client, **kwargs)
+            if isinstance(response, dict):
+                put((index, Result(target.account, target.region, response, None)), state)
+            elif response is not None:
+                for resource in response:
+                    if not put((index, Result(target.account, target.region, resource, None)), state):
+                        break
+        except Exception as e:
+            put((index, Result(target.account, target.region, None, e)), state)
+        finally:
+            state.finished = True
+            put((index, _DONE), state)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        run = tracing.propagate(run)
+        for index in range(len(states)):
+            executor.submit(run, index)
+        pending = set(range(len(states)))
+        checked = time.monotonic()
+        while pending:
+            try:
+                index, item = results.get(timeout=0.1)
+            except queue.Empty:
+                index, item = None, None
+            if item is _DONE:
+                pending.discard(index)
+            elif item is not None and index in pending:
+                yield item
+            now = time.monotonic()
+            if timeout is None or now - checked < 0.1:
+                continue
+            checked = now
+            for index in list(pending):
+                state = states[index]
+                if state.started is not None and not state.finished and state.elapsed(now) > timeout:
+                    state.expired = True
+                    pending.discard(index)
+                    yield Result(state.target.account, state.target.region, None,
+                                 TimeoutError('Timed out after {}s'.format(timeout)))
+    finally:
+        closed.append(True)
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,394 @@
+__author__ = 'rafael'
+
+import heapq
+import ipaddress
+import threading
+
+from stratus import cirrus
+
+# CIDR allocation for new VPCs and subnets.
+
+# A Pool is a buddy allocator over one CIDR: free space is kept as aligned
+# blocks, one free list per prefix length. Allocating a /24 takes the lowest
+# free /24, or splits the smallest larger free block in halves until one is
+# left; releasing a block merges it back with its free buddy. Both touch at
+# most one list per prefix length and a heap operation on each, so the cost
+# is O(log n) in the number of free blocks. Every pool has a lock, so workers
+# sharing it never get the same block. A PoolGroup puts several pools behind
+# the same interface, for VPCs with secondary CIDR blocks.
+#
+# Usage:
+#     from stratus import cirrus, ipam
+#
+#     ipam.register_pool('prod', ipam.vpc_pool('10.0.0.0/8'))
+#     cirrus.create_vpc('prod-vpc', Pool='prod', PrefixLength=16, DryRun=False,
+#                       InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=False)
+#
+#     ipam.register_pool('prod-vpc', ipam.subnet_pool('vpc-?'))
+#     cirrus.create_subnet('app-a', Pool='prod-vpc', PrefixLength=24, VpcId='vpc-?',
+#                          DryRun=False)
+
+
+class PoolExhausted(Exception):
+    '''
+    Raised when a pool has no free block of the requested size.
+    '''
+
+
+class Pool:
+    '''
+    Buddy allocator over one IPv4 or IPv6 CIDR.
+
+    Args:
+        cidr (str): CIDR the pool hands out blocks from.
+        name (str): Optional name, used in messages.
+    '''
+
+    def __init__(self, cidr, name=None):
+        self.network = ipaddress.ip_network(cidr)
+        self.name = name or str(self.network)
+        self._bits = self.network.max_prefixlen
+        self._free = {length: set() for length in range(self.network.prefixlen, self._bits + 1)}
+        self._heaps = {length: [] for length in self._free}
+        self._allocated = {}
+        self._lock = threading.Lock()
+        self._add_free(int(self.network.network_address), self.network.prefixlen)
+
+    def __repr__(self):
+        return 'Pool({!r})'.format(self.name)
+
+    def _add_free(self, address, length):
+        self._free[length].add(address)
+        heapq.heappush(self._heaps[length], address)
+
+    def _pop_free(self, length):
+        '''
+        Removes and returns the lowest free block of a length, or None. Blocks
+        taken out of the set by other paths are dropped from the heap lazily.
+        '''
+        free, heap = self._free[length], self._heaps[length]
+        while heap:
+            address = heapq.heappop(heap)
+            if address in free:
+                free.discard(address)
+                return address
+        return None
+
+    def _split(self, address, length, target):
+        '''
+        Splits a free block down to target length, freeing every upper half
+        and returning the lowest block.
+        '''
+        while length < target:
+            length += 1
+            self._add_free(address + (1 << (self._bits - length)), length)
+        return address
+
+    def _cidr(self, address, length):
+        return str(ipaddress.ip_network((address, length)))
+
+    def _parse(self, cidr):
+        if not self.contains(cidr):
+            raise ValueError('{} is not inside pool {}'.format(cidr, self.name))
+        network = ipaddress.ip_network(cidr)
+        return int(network.network_address), network.prefixlen
+
+    def contains(self, cidr):
+        '''
+        Tells whether a block lies inside the pool.
+        :param cidr: CIDR string.
+        :return: (bool)
+        '''
+        network = ipaddress.ip_network(cidr)
+        return network.version == self.network.version and network.subnet_of(self.network)
+
+    def copy(self):
+        '''
+        Returns an independent pool with the same blocks free and in use,
+        e.g. to plan allocations without making them.
+        :return: (Pool)
+        '''
+        pool = Pool(self.network, name=self.name)
+        with self._lock:
+            pool._free = {length: set(free) for length, free in self._free.items()}
+            pool._heaps = {length: list(heap) for length, heap in self._heaps.items()}
+            pool._allocated = dict(self._allocated)
+        return pool
+
+    def allocate(self, prefix_length):
+        '''
+        Reserves the lowest free block of a prefix length.
+        :param prefix_length: e.g. 24 for a /24.
+        :return: (str) CIDR of the block.
+        '''
+        if prefix_length not in self._free:
+            raise ValueError('/{} does not fit in pool {}'.format(prefix_length, self.name))
+        with self._lock:
+            for length in range(prefix_length, self.network.prefixlen - 1, -1):
+                address = self._pop_free(length)
+                if address is not None:
+                    address = self._split(address, length, prefix_length)
+                    self._allocated[address] = prefix_length
+                    return self._cidr(address, prefix_length)
+        raise PoolExhausted('no free /{} in pool {}'.format(prefix_length, self.name))
+
+    def reserve(self, cidr):
+        '''
+        Marks a specific block as used, e.g. one that already exists in EC2.
+        :param cidr: CIDR inside the pool.
+        :return: (bool) False if the block was already in use.
+        '''
+        address, prefix_length = self._parse(cidr)
+        with self._lock:
+            for length in range(prefix_length, self.network.prefixlen - 1, -1):
+                block = address & ~((1 << (self._bits - length)) - 1)
+                if block in self._free[length]:
+                    self._free[length].discard(block)
+                    self._split_to(block, length, address, prefix_length)
+                    self._allocated[address] = prefix_length
+                    return True
+            # Parts of the block may still be free if smaller blocks inside it
+            # are in use; those are taken too, but the block as a whole cannot
+            # be released.
+            end = address + (1 << (self._bits - prefix_length))
+            taken = False
+            for length in range(prefix_length + 1, self._bits + 1):
+                inside = [block for block in self._free[length] if address <= block < end]
+                self._free[length].difference_update(inside)
+                taken = taken or bool(inside)
+            return taken
+
+    def _split_to(self, block, length, address, prefix_length):
+        '''
+        Splits a free block down to the one block at address, freeing the
+        halves that do not contain it.
+        '''
+        while length < prefix_length:
+            length += 1
+            half = 1 << (self._bits - length)
+            if address & half:
+                self._add_free(block, length)
+                block += half
+            else:
+                self._add_free(block + half, length)
+
+    def release(self, cidr):
+        '''
+        Returns a block to the pool, merging it with its free buddies.
+        :param cidr: CIDR returned by allocate() or passed to reserve().
+        :return:
+        '''
+        address, length = self._parse(cidr)
+        with self._lock:
+            if self._allocated.get(address) != length:
+                raise ValueError('{} is not allocated from pool {}'.format(cidr, self.name))
+            del self._allocated[address]
+            while length > self.network.prefixlen:
+                buddy = address ^ (1 << (self._bits - length))
+                if buddy not in self._free[length]:
+                    break
+                self._free[length].discard(buddy)
+                address = min(address, buddy)
+                length -= 1
+            self._add_free(address, length)
+
+    def allocated(self):
+        '''
+        Returns the CIDRs in use, lowest first.
+        :return: List of CIDR strings.
+        '''
+        with self._lock:
+            return [self._cidr(address, length)
+                    for address, length in sorted(self._allocated.items())]
+
+    def free_blocks(self):
+        '''
+        Returns the free blocks, lowest first.
+        :return: List of CIDR strings.
+        '''
+        with self._lock:
+            blocks = [(address, length) for length, free in self._free.items()
+                      for address in free]
+        return [self._cidr(address, length) for address, length in sorted(blocks)]
+
+
+class PoolGroup:
+    '''
+    Several pools used as one: blocks are allocated from the first pool with
+    room for them, and reserved or released in the pool that contains them.
+
+    Args:
+        pools (list): Pool objects, in allocation order.
+        name (str): Optional name, used in messages.
+    '''
+
+    def __init__(self, pools, name=None):
+        self.pools = list(pools)
+        self.name = name or ','.join(pool.name for pool in self.pools)
+
+    def __repr__(self):
+        return 'PoolGroup({!r})'.format(self.name)
+
+    def _pool(self, cidr):
+        for pool in self.pools:
+            if pool.contains(cidr):
+                return pool
+        raise ValueError('{} is not inside pool {}'.format(cidr, self.name))
+
+    def contains(self, cidr):
+        '''
+        Tells whether a block lies inside one of the pools.
+        :param cidr: CIDR string.
+        :return: (bool)
+        '''
+        return any(pool.contains(cidr) for pool in self.pools)
+
+    def copy(self):
+        '''
+        Returns an independent group of copies of the pools, see Pool.copy.
+        :return: (PoolGroup)
+        '''
+        return PoolGroup([pool.copy() for pool in self.pools], name=self.name)
+
+    def allocate(self, prefix_length):
+        '''
+        Reserves the lowest free block of a prefix length in the first pool
+        that has one.
+        :param prefix_length: e.g. 24 for a /24.
+        :return: (str) CIDR of the block.
+        '''
+        for pool in self.pools:
+            if prefix_length < pool.network.prefixlen or prefix_length > pool.network.max_prefixlen:
+                continue
+            try:
+                return pool.allocate(prefix_length)
+            except PoolExhausted:
+                continue
+        raise PoolExhausted('no free /{} in pool {}'.format(prefix_length, self.name))
+
+    def reserve(self, cidr):
+        '''
+        Marks a specific block as used, see Pool.reserve.
+        :param cidr: CIDR inside one of the pools.
+        :return: (bool) False if the block was already in use.
+        '''
+        return self._pool(cidr).reserve(cidr)
+
+    def release(self, cidr):
+        '''
+        Returns a block to the pool it came from.
+        :param cidr: CIDR returned by allocate() or passed to reserve().
+        :return:
+        '''
+        self._pool(cidr).release(cidr)
+
+    def allocated(self):
+        '''
+        Returns the CIDRs in use, pool by pool.
+        :return: List of CIDR strings.
+        '''
+        return [cidr for pool in self.pools for cidr in pool.allocated()]
+
+    def free_blocks(self):
+        '''
+        Returns the free blocks, pool by pool.
+        :return: List of CIDR strings.
+        '''
+        return [cidr for pool in self.pools for cidr in pool.free_blocks()]
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def register_pool(name, pool):
+    '''
+    Makes a pool available to the creators as Pool='name'.
+    :param name: Pool name.
+    :param pool: Pool or PoolGroup, or a CIDR to build an empty pool from.
+    :return: (Pool)
+    '''
+    if not isinstance(pool, (Pool, PoolGroup)):
+        pool = Pool(pool, name=name)
+    with _pools_lock:
+        _pools[name] = pool
+    return pool
+
+
+def get_pool(pool):
+    '''
+    Returns a registered pool by name; Pool and PoolGroup objects are
+    returned unchanged.
+    :param pool: Pool name, Pool or PoolGroup.
+    :return: (Pool)
+    '''
+    if isinstance(pool, (Pool, PoolGroup)):
+        return pool
+    try:
+        return _pools[pool]
+    except KeyError:
+        raise KeyError('no IPAM pool named {!r}'.format(pool))
+
+
+def vpc_pool(cidr, vpcs=None, client=None, name=None):
+    '''
+    Builds a pool for VPC CIDRs with every existing VPC block inside it
+    reserved.
+    :param cidr: Supernet VPCs are allocated from, e.g. '10.0.0.0/8'.
+    :param vpcs: VPC dictionaries from describe_vpcs; iter_vpcs() if None.
+    :param client: EC2 client used when vpcs is None.
+    :param name: Optional pool name.
+    :return: (Pool)
+    '''
+    pool = Pool(cidr, name=name)
+    if vpcs is None:
+        vpcs = cirrus.iter_vpcs(client=client)
+    for vpc in vpcs:
+        blocks = {vpc.get('CidrBlock')}
+        blocks.update(association['CidrBlock']
+                      for association in vpc.get('CidrBlockAssociationSet', [])
+                      if association.get('CidrBlockState', {}).get('State') != 'disassociated')
+        for block in blocks:
+            if block and ipaddress.ip_network(block).overlaps(pool.network):
+                _reserve_overlap(pool, block)
+    return pool
+
+
+def subnet_pool(vpc, subnets=None, client=None, name=None):
+    '''
+    Builds a pool for the subnets of a VPC with every existing subnet
+    reserved: one Pool per associated IPv4 CIDR block of the VPC, the
+    primary block first and then the secondary ones.
+    :param vpc: VPC id, or VPC dictionary from describe_vpcs.
+    :param subnets: Subnet dictionaries from describe_subnets; the subnets of
+        the VPC are listed if None.
+    :param client: EC2 client used for the describe calls.
+    :param name: Optional pool name.
+    :return: (PoolGroup)
+    '''
+    if isinstance(vpc, str):
+        vpc = next(cirrus.iter_vpcs(client=client, VpcIds=[vpc]))
+    if subnets is None:
+        subnets = cirrus.iter_subnets(
+            client=client, Filters=[{'Name': 'vpc-id', 'Values': [vpc['VpcId']]}])
+    blocks = [vpc['CidrBlock']]
+    for association in vpc.get('CidrBlockAssociationSet', []):
+        block = association.get('CidrBlock')
+        state = association.get('CidrBlockState', {}).get('State', 'associated')
+        if block and block not in blocks and state in ('associating', 'associated'):
+            blocks.append(block)
+    pool = PoolGroup([Pool(block) for block in blocks], name=name)
+    for subnet in subnets:
+        if subnet.get('VpcId') == vpc['VpcId'] and subnet.get('CidrBlock'):
+            if pool.contains(subnet['CidrBlock']):
+                pool.reserve(subnet['CidrBlock'])
+    return pool
+
+
+def _reserve_overlap(pool, cidr):
+    '''
+    Reserves the part of a block that overlaps a pool; a block larger than
+    the pool uses all of it.
+    '''
+    network = ipaddress.ip_network(cidr)
+    pool.reserve(str(network if network.subnet_of(pool.network) else pool.network))
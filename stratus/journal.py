@@ -0,0 +1,220 @@
+__author__ = 'rafael'
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from stratus import plan
+
+# Write-ahead journal that makes provisioning runs resumable.
+
+# Every step is recorded in an append-only JSON lines file: a 'started' record
+# before the call and a 'done' record with the response after it, or a
+# 'failed' record when the call raised an exception or returned None (a
+# ClientError cirrus printed). A run interrupted by KeyboardInterrupt or
+# SystemExit leaves its step 'started', as a killed process would. Records
+# are flushed and fsynced as they are written, so a run that dies keeps
+# everything it finished. Opening the journal again replays the
+# file; a completed step is then skipped and its recorded response returned,
+# without any EC2 call, and the run picks up at the first unfinished step.
+#
+# A record cut short by a crash is dropped from the file when it is opened
+# again, so the next record starts on a line of its own. Steps are not
+# journaled in plan mode, where responses carry placeholder ids.
+#
+# A step whose arguments changed since it was journaled runs again. Steps
+# left 'started' without an outcome may or may not have taken effect;
+# in_doubt() lists them and they run again on resume, which is safe for
+# creates in idempotency mode (cirrus.IDEMPOTENT).
+#
+# Usage:
+#     from stratus import cirrus, journal, topology
+#
+#     with journal.Journal('build-main.journal') as run:
+#         topology.apply(spec, journal=run)                  # every dag node
+#
+#     with journal.Journal('peer.journal') as run:
+#         pcx = run.step('pcx', cirrus.create_vpc_peering_connection, 'a-b',
+#                        DryRun=False, VpcId='vpc-a', PeerVpcId='vpc-b', PeerOwnerId='?')
+
+
+def _default(value):
+    '''
+    JSON fallback: datetimes become strings, other objects their type name so
+    the fingerprint of a step does not depend on object addresses.
+    '''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return type(value).__name__
+
+
+def fingerprint(args, kwargs):
+    '''
+    Returns a digest of the arguments of a step; the client argument is left
+    out since it differs between runs.
+    :param args: Positional arguments.
+    :param kwargs: Keyword arguments.
+    :return: (str)
+    '''
+    kwargs = {key: value for key, value in kwargs.items() if key != 'client'}
+    text = json.dumps([list(args), kwargs], sort_keys=True, default=_default)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+class Journal:
+    '''
+    Append-only record of the steps of a run.
+
+    Args:
+        path (str): Journal file, created if missing.
+        sync (bool): fsync every record; turn off only when losing the last
+            records on a crash is acceptable.
+
+    Attributes:
+        completed (dict): Step key to (fingerprint, response) of the steps
+            done, from earlier runs and this one.
+        skipped (int): Steps skipped in this run because they were done.
+    '''
+
+    def __init__(self, path, sync=True):
+        self.path = path
+        self.sync = sync
+        self.completed = {}
+        self.skipped = 0
+        self._started = {}
+        self._lock = threading.Lock()
+        self._replay()
+        self._file = open(path, 'a')
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        self._drop_partial()
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record cut short by a crash; everything before it is
+                    # intact.
+                    continue
+                key = record['key']
+                if record['state'] == 'started':
+                    self._started[key] = record['fingerprint']
+                elif record['state'] == 'done':
+                    self._started.pop(key, None)
+                    self.completed[key] = (record['fingerprint'], record['response'])
+                else:
+                    self._started.pop(key, None)
+                    self.completed.pop(key, None)
+
+    def _drop_partial(self):
+        '''
+        Truncates the file after its last complete line, dropping a record
+        a crash cut short so appended records are not glued to it.
+        '''
+        with open(self.path, 'rb+') as journal_file:
+            journal_file.seek(0, os.SEEK_END)
+            size = journal_file.tell()
+            end = size
+            while end > 0:
+                start = max(0, end - 4096)
+                journal_file.seek(start)
+                block = journal_file.read(end - start)
+                newline = block.rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                journal_file.truncate(end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, key):
+        return key in self.completed
+
+    def _write(self, record):
+        line = json.dumps(record, default=_default) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+
+    def _failed(self, key, digest):
+        self._write({'key': key, 'state': 'failed', 'fingerprint': digest, 'time': time.time()})
+        with self._lock:
+            self._started.pop(key, None)
+            self.completed.pop(key, None)
+
+    def get(self, key):
+        '''
+        Returns the recorded response of a completed step.
+        :param key: Step key.
+        :return: Response, or None if the step is not done.
+        '''
+        entry = self.completed.get(key)
+        return entry and entry[1]
+
+    def in_doubt(self):
+        '''
+        Returns the keys of steps that started but have no outcome.
+        :return: List of step keys.
+        '''
+        with self._lock:
+            return [key for key in self._started if key not in self.completed]
+
+    def step(self, key, func, *args, **kwargs):
+        '''
+        Runs func(*args, **kwargs) once per key across runs.
+        :param key: Step key, unique and stable between runs.
+        :param func: Function to call, usually a cirrus function.
+        :param args: Positional arguments.
+        :param kwargs: Keyword arguments.
+        :return: The response, recorded or new; None if the call failed.
+        '''
+        if plan.active is not None:
+            raise RuntimeError('steps cannot be journaled in plan mode')
+        digest = fingerprint(args, kwargs)
+        entry = self.completed.get(key)
+        if entry is not None:
+            if entry[0] == digest:
+                with self._lock:
+                    self.skipped += 1
+                return entry[1]
+            print('Step {} changed since it was journaled; running it again.'.format(key))
+        self._write({'key': key, 'state': 'started', 'fingerprint': digest, 'time': time.time()})
+        with self._lock:
+            self._started[key] = digest
+        try:
+            response = func(*args, **kwargs)
+        except Exception:
+            self._failed(key, digest)
+            raise
+        if response is None:
+            self._failed(key, digest)
+            return None
+        # The response is stored as JSON, so a resumed run sees the same
+        # values (datetimes as strings) as this one.
+        response = json.loads(json.dumps(response, default=_default))
+        self._write({'key': key, 'state': 'done', 'fingerprint': digest, 'time': time.time(),
+                     'response': response})
+        with self._lock:
+            self._started.pop(key, None)
+            self.completed[key] = (digest, response)
+        return response
+
+    def close(self):
+        '''
+        Closes the journal file.
+        :return:
+        '''
+        with self._lock:
+            self._file.close()
@@ -37,6 +37,9 @@ from msrestazure.azure_cloud import AZURE_PUBLIC_CLOUD
 from msrestazure import azure_exceptions
 from msrest.exceptions import AuthenticationError
 
+from stratus import metrics
+from stratus import tracing
+
 
 class Loader:
     """
@@ -145,6 +148,9 @@ class Loader:
             print('Deployment failed, {}'.format(e))
             sys.exit(1)
 
+    @tracing.traced(category='azure')
+    @metrics.instrument(target=lambda self: self.resource_group,
+                        failed=lambda result: result is None)
     def create_resource_group(self):
         """
         Create resource group for the deployment if the resource group doesn't
@@ -160,6 +166,7 @@ class Loader:
             )
             self.resource_group_output = result
             print('Created or updated resource group {}'.format(self.resource_group_output.name))
+            return result
         except azure_exceptions.CloudError as e:
             print(e)
 
@@ -207,12 +214,15 @@ class Loader:
                                                now.hour, now.minute, now.second)
         return timestamp
 
+    @tracing.traced(category='azure')
+    @metrics.instrument(target=lambda self: self.resource_group,
+                        failed=lambda result: result is None)
     def deploy(self):
         """
         Deploys the template using the specified deployment properties and
         prints the name of the deployment from the name property of the
         deployment output.
-        :return: (None)
+        :return: (DeploymentExtended), None if the deployment failed.
         """
 
         self.create_resource_group()
@@ -231,17 +241,21 @@ class Loader:
             deployment_async_operation.wait()
             self.deployment_output = deployment_async_operation.result()
             print('Deployed job {}'.format(self.deployment_output.name))
+            return self.deployment_output
         except azure_exceptions.CloudError as e:
             print(e)
 
+    @tracing.traced(category='azure')
+    @metrics.instrument(target=lambda self: self.resource_group,
+                        failed=lambda result: result is None)
     def destroy(self):
         """
         Destroy the specified resource group.
 
-        :return: (None)
+        :return: (AzureOperationPoller) of the deletion, None if it failed.
         """
         try:
-            self.client.resource_groups.delete(self.resource_group)
+            return self.client.resource_groups.delete(self.resource_group)
         except azure_exceptions.CloudError as e:
             print(e)
 
@@ -0,0 +1,1021 @@
+__author__ = 'rafael'
+
+import copy
+import fnmatch
+import functools
+import ipaddress
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from stratus import clients
+
+# In-memory stand-in for the EC2 client.
+
+# MemoryEC2 implements the EC2 calls cirrus makes for VPCs, subnets, DHCP
+# options, Internet, NAT, customer and VPN gateways, VPN connections, route
+# tables, network ACLs, peerings and tags, with the same request and response
+# shapes, error codes and filters. Resources are kept in dictionaries and
+# change state immediately (a new NAT gateway is available, a deleted one is
+# deleted). The describes paginated in botocore take MaxResults and
+# NextToken, and the checks EC2 makes up front are modelled where cirrus
+# workflows depend on them: dependency violations on delete, an attached
+# Internet gateway for public NAT gateways, the reserved default ACL entries
+# (32767, and 32768 in IPv6-enabled VPCs) and the quota of ACL entries per
+# direction. Every call can be slowed down by a
+# fixed latency and fail with RequestLimitExceeded at a given rate, to
+# exercise the limiter and retries.
+# install() plugs it into the client registry, so every cirrus function and
+# module built on them runs against it unchanged.
+#
+# Usage:
+#     from stratus import cirrus, memory
+#
+#     ec2 = memory.install(latency=0.05, throttle_rate=0.01)
+#     cirrus.create_vpc('test', DryRun=False, CidrBlock='10.0.0.0/16',
+#                       InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=False)
+#     print(ec2.calls)
+#     memory.uninstall()
+
+# Resource types: id prefix and the error code of an unknown id.
+KINDS = {
+    'vpc': ('vpc', 'InvalidVpcID.NotFound'),
+    'subnet': ('subnet', 'InvalidSubnetID.NotFound'),
+    'dhcp-options': ('dopt', 'InvalidDhcpOptionID.NotFound'),
+    'internet-gateway': ('igw', 'InvalidInternetGatewayID.NotFound'),
+    'natgateway': ('nat', 'NatGatewayNotFound'),
+    'customer-gateway': ('cgw', 'InvalidCustomerGatewayID.NotFound'),
+    'vpn-gateway': ('vgw', 'InvalidVpnGatewayID.NotFound'),
+    'vpn-connection': ('vpn', 'InvalidVpnConnectionID.NotFound'),
+    'route-table': ('rtb', 'InvalidRouteTableID.NotFound'),
+    'network-acl': ('acl', 'InvalidNetworkAclID.NotFound'),
+    'vpc-peering-connection': ('pcx', 'InvalidVpcPeeringConnectionID.NotFound'),
+}
+
+# Network ACL entries allowed per direction, not counting the default ones.
+ACL_ENTRY_LIMIT = 20
+
+# Describe operations that take MaxResults and NextToken, as in botocore.
+PAGINATED = {
+    'describe_vpcs', 'describe_subnets', 'describe_dhcp_options', 'describe_internet_gateways',
+    'describe_nat_gateways', 'describe_route_tables', 'describe_network_acls',
+    'describe_vpc_peering_connections',
+}
+
+_PREFIXES = {prefix: kind for kind, (prefix, _) in KINDS.items()}
+
+# Filter names that do not follow the key-name-in-kebab-case rule.
+_FILTER_PATHS = {
+    'status-code': ('Status', 'Code'),
+    'default': ('IsDefault',),
+    'attachment.vpc-id': ('Attachments|VpcAttachments', 'VpcId'),
+    'attachment.state': ('Attachments|VpcAttachments', 'State'),
+    'route.destination-cidr-block': ('Routes', 'DestinationCidrBlock'),
+}
+
+_ROUTE_DESTINATIONS = ('DestinationCidrBlock', 'DestinationIpv6CidrBlock', 'DestinationPrefixListId')
+_ROUTE_TARGETS = ('GatewayId', 'EgressOnlyInternetGatewayId', 'InstanceId', 'NetworkInterfaceId',
+                  'VpcPeeringConnectionId', 'NatGatewayId', 'TransitGatewayId', 'LocalGatewayId',
+                  'CarrierGatewayId', 'VpcEndpointId')
+
+_service_model = None
+_service_model_lock = threading.Lock()
+
+
+def _operation_name(method):
+    return ''.join(part.title() for part in method.split('_'))
+
+
+def _error(method, code, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': 400}},
+                       _operation_name(method))
+
+
+class _Meta:
+    '''
+    The parts of client.meta that cirrus, snapshot and botocore waiters use.
+    '''
+
+    def __init__(self, region_name):
+        from botocore.hooks import HierarchicalEmitter
+        self.region_name = region_name
+        self.events = HierarchicalEmitter()
+
+    @property
+    def service_model(self):
+        global _service_model
+        if _service_model is None:
+            with _service_model_lock:
+                if _service_model is None:
+                    import botocore.session
+                    _service_model = botocore.session.get_session().get_service_model('ec2')
+        return _service_model
+
+
+def _api(method):
+    '''
+    Wraps an API method: counts the call, injects latency and throttling,
+    honours DryRun and returns a copy of the response.
+    '''
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, **kwargs):
+        with self._lock:
+            self.calls[name] += 1
+            throttled = self.throttle_rate and self._random.random() < self.throttle_rate
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            with self._lock:
+                self.throttled += 1
+            raise _error(name, 'RequestLimitExceeded', 'Request limit exceeded.')
+        if kwargs.get('DryRun'):
+            raise _error(name, 'DryRunOperation',
+                         'Request would have succeeded, but DryRun flag is set.')
+        with self._lock:
+            return copy.deepcopy(method(self, **kwargs))
+    return wrapper
+
+
+class MemoryEC2:
+    '''
+    EC2 client backed by dictionaries.
+
+    Args:
+        region (str): Region reported by meta.region_name.
+        account (str): Owner id of every resource.
+        latency (float): Seconds every call takes.
+        jitter (float): Extra random seconds, up to this much, per call.
+        throttle_rate (float): Fraction of calls that fail with
+            RequestLimitExceeded, 0 to 1.
+        seed: Seed of the random generator used for jitter and throttling.
+
+    Attributes:
+        calls (Counter): Number of calls per method, throttled ones included.
+        throttled (int): Number of calls that were throttled.
+    '''
+
+    def __init__(self, region='us-east-1', account='123456789012', latency=0.0, jitter=0.0,
+                 throttle_rate=0.0, seed=None):
+        self.meta = _Meta(region)
+        self.account = account
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.calls = Counter()
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._ipv6_blocks = ipaddress.ip_network('2600:1f18::/32').subnets(new_prefix=56)
+        self._store = {kind: {} for kind in KINDS}
+        self._vpc_attributes = {}
+        self._tokens = {}
+
+    def can_paginate(self, operation_name):
+        return operation_name in PAGINATED
+
+    # Helpers
+
+    def _new_id(self, prefix):
+        return '{}-{:017x}'.format(prefix, next(self._ids))
+
+    def _new(self, kind, resource, kwargs=None, id_key=None):
+        token = (kwargs or {}).get('ClientToken')
+        if token is not None:
+            # EC2 returns the resource an earlier call with the token created.
+            existing = self._store[kind].get(self._tokens.get((kind, token)))
+            if existing is not None:
+                return existing
+        prefix = KINDS[kind][0]
+        resource_id = self._new_id(prefix)
+        if token is not None:
+            self._tokens[kind, token] = resource_id
+        resource[id_key] = resource_id
+        resource.setdefault('Tags', [])
+        for specification in (kwargs or {}).get('TagSpecifications', []):
+            if specification.get('ResourceType') == kind:
+                self._merge_tags(resource, specification['Tags'])
+        self._store[kind][resource_id] = resource
+        return resource
+
+    def _get(self, method, kind, resource_id):
+        resource = self._store[kind].get(resource_id)
+        if resource is None:
+            raise _error(method, KINDS[kind][1],
+                         "The ID '{}' does not exist".format(resource_id))
+        return resource
+
+    def _find(self, resource_id):
+        kind = _PREFIXES.get(resource_id.split('-', 1)[0])
+        return kind and self._store[kind].get(resource_id)
+
+    @staticmethod
+    def _merge_tags(resource, tags):
+        current = {tag['Key']: tag for tag in resource.setdefault('Tags', [])}
+        for tag in tags:
+            current[tag['Key']] = {'Key': tag['Key'], 'Value': tag.get('Value', '')}
+        resource['Tags'] = list(current.values())
+
+    @staticmethod
+    def _filter_values(resource, name):
+        if name.startswith('tag:'):
+            return [tag['Value'] for tag in resource.get('Tags', []) if tag['Key'] == name[4:]]
+        if name == 'tag-key':
+            return [tag['Key'] for tag in resource.get('Tags', [])]
+        path = _FILTER_PATHS.get(name) or [
+            ''.join(word.title() for word in part.split('-')) for part in name.split('.')]
+        values = [resource]
+        for part in path:
+            found = []
+            for value in values:
+                if not isinstance(value, dict):
+                    continue
+                for key in part.split('|'):
+                    for candidate in (key, key + 's'):
+                        if candidate in value:
+                            item = value[candidate]
+                            found.extend(item if isinstance(item, list) else [item])
+                            break
+            values = found
+        return [str(value).lower() if isinstance(value, bool) else str(value) for value in values]
+
+    def _describe(self, method, kind, result_key, ids, filters, kwargs):
+        if ids:
+            resources = [self._get(method, kind, resource_id) for resource_id in ids]
+        else:
+            resources = list(self._store[kind].values())
+        for item in filters or []:
+            patterns = item['Values']
+            resources = [
+                resource for resource in resources
+                if any(fnmatch.fnmatchcase(value, pattern)
+                       for value in self._filter_values(resource, item['Name'])
+                       for pattern in patterns)
+            ]
+        if method not in PAGINATED:
+            return {result_key: resources}
+        max_results = kwargs.get('MaxResults')
+        if max_results is not None and ids:
+            raise _error(method, 'InvalidParameterCombination',
+                         'MaxResults cannot be used with resource ids.')
+        start = int(kwargs.get('NextToken') or 0)
+        end = len(resources) if max_results is None else start + max_results
+        response = {result_key: resources[start:end]}
+        if end < len(resources):
+            response['NextToken'] = str(end)
+        return response
+
+    # VPC
+
+    @_api
+    def describe_vpcs(self, VpcIds=None, Filters=None, **kwargs):
+        return self._describe('describe_vpcs', 'vpc', 'Vpcs', VpcIds, Filters, kwargs)
+
+    @_api
+    def create_vpc(self, CidrBlock, InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=False,
+                   **kwargs):
+        network = ipaddress.ip_network(CidrBlock)
+        if not 16 <= network.prefixlen <= 28:
+            raise _error('create_vpc', 'InvalidVpc.Range',
+                         'The CIDR {} is invalid.'.format(CidrBlock))
+        vpc = self._new('vpc', {
+            'CidrBlock': CidrBlock,
+            'State': 'available',
+            'OwnerId': self.account,
+            'InstanceTenancy': InstanceTenancy,
+            'IsDefault': False,
+            'DhcpOptionsId': 'default',
+        }, kwargs, 'VpcId')
+        vpc['CidrBlockAssociationSet'] = [{
+            'AssociationId': self._new_id('vpc-cidr-assoc'),
+            'CidrBlock': CidrBlock,
+            'CidrBlockState': {'State': 'associated'},
+        }]
+        if AmazonProvidedIpv6CidrBlock:
+            vpc['Ipv6CidrBlockAssociationSet'] = [{
+                'AssociationId': self._new_id('vpc-cidr-assoc'),
+                'Ipv6CidrBlock': str(next(self._ipv6_blocks)),
+                'Ipv6CidrBlockState': {'State': 'associated'},
+                'Ipv6Pool': 'Amazon',
+            }]
+        vpc_id = vpc['VpcId']
+        self._vpc_attributes[vpc_id] = {'EnableDnsSupport': True, 'EnableDnsHostnames': False}
+        route_table = self._new_route_table(vpc)
+        route_table['Associations'].append({
+            'Main': True,
+            'RouteTableAssociationId': self._new_id('rtbassoc'),
+            'RouteTableId': route_table['RouteTableId'],
+            'AssociationState': {'State': 'associated'},
+        })
+        self._new_network_acl(vpc_id, default=True)
+        return {'Vpc': vpc}
+
+    @_api
+    def describe_vpc_attribute(self, VpcId, Attribute, **kwargs):
+        self._get('describe_vpc_attribute', 'vpc', VpcId)
+        key = Attribute[0].upper() + Attribute[1:]
+        return {'VpcId': VpcId, key: {'Value': self._vpc_attributes[VpcId][key]}}
+
+    @_api
+    def modify_vpc_attribute(self, VpcId, **kwargs):
+        self._get('modify_vpc_attribute', 'vpc', VpcId)
+        for key in ('EnableDnsSupport', 'EnableDnsHostnames'):
+            if key in kwargs:
+                self._vpc_attributes[VpcId][key] = kwargs[key]['Value']
+        return {}
+
+    @_api
+    def delete_vpc(self, VpcId, **kwargs):
+        self._get('delete_vpc', 'vpc', VpcId)
+        dependencies = [
+            resource_id for kind, key in (('subnet', 'VpcId'), ('route-table', 'VpcId'),
+                                          ('network-acl', 'VpcId'))
+            for resource_id, resource in self._store[kind].items()
+            if resource[key] == VpcId
+            and not resource.get('IsDefault')
+            and not any(association.get('Main') for association in resource.get('Associations', []))
+        ]
+        dependencies += [
+            igw_id for igw_id, igw in self._store['internet-gateway'].items()
+            if any(attachment['VpcId'] == VpcId for attachment in igw['Attachments'])
+        ]
+        dependencies += [
+            vgw_id for vgw_id, vgw in self._store['vpn-gateway'].items()
+            if any(attachment['VpcId'] == VpcId and attachment['State'] != 'detached'
+                   for attachment in vgw['VpcAttachments'])
+        ]
+        if dependencies:
+            raise _error('delete_vpc', 'DependencyViolation',
+                         "The vpc '{}' has dependencies and cannot be deleted.".format(VpcId))
+        for kind in ('route-table', 'network-acl'):
+            for resource_id in [resource_id for resource_id, resource in self._store[kind].items()
+                                if resource['VpcId'] == VpcId]:
+                del self._store[kind][resource_id]
+        del self._store['vpc'][VpcId]
+        del self._vpc_attributes[VpcId]
+        return {}
+
+    # Subnet
+
+    @_api
+    def describe_subnets(self, SubnetIds=None, Filters=None, **kwargs):
+        return self._describe('describe_subnets', 'subnet', 'Subnets', SubnetIds, Filters, kwargs)
+
+    @_api
+    def create_subnet(self, VpcId, CidrBlock, AvailabilityZone=None, **kwargs):
+        vpc = self._get('create_subnet', 'vpc', VpcId)
+        network = ipaddress.ip_network(CidrBlock)
+        if not any(network.subnet_of(ipaddress.ip_network(association['CidrBlock']))
+                   for association in vpc['CidrBlockAssociationSet']):
+            raise _error('create_subnet', 'InvalidSubnet.Range',
+                         'The CIDR {} is invalid.'.format(CidrBlock))
+        for subnet in self._store['subnet'].values():
+            if subnet['VpcId'] == VpcId and network.overlaps(ipaddress.ip_network(subnet['CidrBlock'])):
+                raise _error('create_subnet', 'InvalidSubnet.Conflict',
+                             'The CIDR {} conflicts with another subnet'.format(CidrBlock))
+        subnet = self._new('subnet', {
+            'VpcId': VpcId,
+            'CidrBlock': CidrBlock,
+            'AvailabilityZone': AvailabilityZone or self.meta.region_name + 'a',
+            'AvailableIpAddressCount': network.num_addresses - 5,
+            'State': 'available',
+            'MapPublicIpOnLaunch': False,
+            'DefaultForAz': False,
+            'OwnerId': self.account,
+        }, kwargs, 'SubnetId')
+        for network_acl in self._store['network-acl'].values():
+            if network_acl['VpcId'] == VpcId and network_acl['IsDefault']:
+                network_acl['Associations'].append({
+                    'NetworkAclAssociationId': self._new_id('aclassoc'),
+                    'NetworkAclId': network_acl['NetworkAclId'],
+                    'SubnetId': subnet['SubnetId'],
+                })
+        return {'Subnet': subnet}
+
+    @_api
+    def modify_subnet_attribute(self, SubnetId, **kwargs):
+        subnet = self._get('modify_subnet_attribute', 'subnet', SubnetId)
+        for key, value in kwargs.items():
+            if isinstance(value, dict) and 'Value' in value:
+                subnet[key] = value['Value']
+        return {}
+
+    @_api
+    def delete_subnet(self, SubnetId, **kwargs):
+        self._get('delete_subnet', 'subnet', SubnetId)
+        if any(nat['SubnetId'] == SubnetId and nat['State'] not in ('deleted', 'failed')
+               for nat in self._store['natgateway'].values()):
+            raise _error('delete_subnet', 'DependencyViolation',
+                         "The subnet '{}' has dependencies and cannot be deleted.".format(SubnetId))
+        for kind in ('route-table', 'network-acl'):
+            for resource in self._store[kind].values():
+                resource['Associations'] = [association for association in resource['Associations']
+                                            if association.get('SubnetId') != SubnetId]
+        del self._store['subnet'][SubnetId]
+        return {}
+
+    # DHCP options
+
+    @_api
+    def describe_dhcp_options(self, DhcpOptionsIds=None, Filters=None, **kwargs):
+        return self._describe('describe_dhcp_options', 'dhcp-options', 'DhcpOptions',
+                              DhcpOptionsIds, Filters, kwargs)
+
+    @_api
+    def create_dhcp_options(self, DhcpConfigurations, **kwargs):
+        dhcp_options = self._new('dhcp-options', {
+            'DhcpConfigurations': [
+                {'Key': item['Key'], 'Values': [{'Value': value} for value in item['Values']]}
+                for item in DhcpConfigurations
+            ],
+            'OwnerId': self.account,
+        }, kwargs, 'DhcpOptionsId')
+        return {'DhcpOptions': dhcp_options}
+
+    @_api
+    def associate_dhcp_options(self, DhcpOptionsId, VpcId, **kwargs):
+        vpc = self._get('associate_dhcp_options', 'vpc', VpcId)
+        if DhcpOptionsId != 'default':
+            self._get('associate_dhcp_options', 'dhcp-options', DhcpOptionsId)
+        vpc['DhcpOptionsId'] = DhcpOptionsId
+        return {}
+
+    @_api
+    def delete_dhcp_options(self, DhcpOptionsId, **kwargs):
+        self._get('delete_dhcp_options', 'dhcp-options', DhcpOptionsId)
+        if any(vpc['DhcpOptionsId'] == DhcpOptionsId for vpc in self._store['vpc'].values()):
+            raise _error('delete_dhcp_options', 'DependencyViolation',
+                         "The dhcpOptions '{}' has dependencies.".format(DhcpOptionsId))
+        del self._store['dhcp-options'][DhcpOptionsId]
+        return {}
+
+    # Internet gateway
+
+    @_api
+    def describe_internet_gateways(self, InternetGatewayIds=None, Filters=None, **kwargs):
+        return self._describe('describe_internet_gateways', 'internet-gateway',
+                              'InternetGateways', InternetGatewayIds, Filters, kwargs)
+
+    @_api
+    def create_internet_gateway(self, **kwargs):
+        igw = self._new('internet-gateway', {'Attachments': [], 'OwnerId': self.account},
+                        kwargs, 'InternetGatewayId')
+        return {'InternetGateway': igw}
+
+    @_api
+    def attach_internet_gateway(self, InternetGatewayId, VpcId, **kwargs):
+        igw = self._get('attach_internet_gateway', 'internet-gateway', InternetGatewayId)
+        self._get('attach_internet_gateway', 'vpc', VpcId)
+        if igw['Attachments']:
+            raise _error('attach_internet_gateway', 'Resource.AlreadyAssociated',
+                         '{} is already attached'.format(InternetGatewayId))
+        igw['Attachments'] = [{'VpcId': VpcId, 'State': 'available'}]
+        return {}
+
+    @_api
+    def detach_internet_gateway(self, InternetGatewayId, VpcId, **kwargs):
+        igw = self._get('detach_internet_gateway', 'internet-gateway', InternetGatewayId)
+        if not any(attachment['VpcId'] == VpcId for attachment in igw['Attachments']):
+            raise _error('detach_internet_gateway', 'Gateway.NotAttached',
+                         '{} is not attached to {}'.format(InternetGatewayId, VpcId))
+        igw['Attachments'] = []
+        return {}
+
+    @_api
+    def delete_internet_gateway(self, InternetGatewayId, **kwargs):
+        igw = self._get('delete_internet_gateway', 'internet-gateway', InternetGatewayId)
+        if igw['Attachments']:
+            raise _error('delete_internet_gateway', 'DependencyViolation',
+                         '{} has dependencies and cannot be deleted.'.format(InternetGatewayId))
+        del self._store['internet-gateway'][InternetGatewayId]
+        return {}
+
+    # NAT gateway
+
+    @_api
+    def describe_nat_gateways(self, NatGatewayIds=None, Filter=None, **kwargs):
+        return self._describe('describe_nat_gateways', 'natgateway', 'NatGateways',
+                              NatGatewayIds, Filter, kwargs)
+
+    @_api
+    def create_nat_gateway(self, SubnetId, AllocationId=None, **kwargs):
+        subnet = self._get('create_nat_gateway', 'subnet', SubnetId)
+        if kwargs.get('ConnectivityType', 'public') == 'public' and not any(
+                attachment['VpcId'] == subnet['VpcId']
+                for igw in self._store['internet-gateway'].values()
+                for attachment in igw['Attachments']):
+            raise _error('create_nat_gateway', 'Gateway.NotAttached',
+                         'Network {} has no Internet gateway attached'.format(subnet['VpcId']))
+        nat = self._new('natgateway', {
+            'SubnetId': SubnetId,
+            'VpcId': subnet['VpcId'],
+            'State': 'available',
+            'NatGatewayAddresses': [{'AllocationId': AllocationId}] if AllocationId else [],
+            'ConnectivityType': kwargs.get('ConnectivityType', 'public'),
+            'CreateTime': datetime.now(timezone.utc),
+        }, kwargs, 'NatGatewayId')
+        return {'ClientToken': kwargs.get('ClientToken'), 'NatGateway': nat}
+
+    @_api
+    def delete_nat_gateway(self, NatGatewayId, **kwargs):
+        nat = self._get('delete_nat_gateway', 'natgateway', NatGatewayId)
+        nat['State'] = 'deleted'
+        nat['DeleteTime'] = datetime.now(timezone.utc)
+        return {'NatGatewayId': NatGatewayId}
+
+    # Customer gateway
+
+    @_api
+    def describe_customer_gateways(self, CustomerGatewayIds=None, Filters=None, **kwargs):
+        return self._describe('describe_customer_gateways', 'customer-gateway',
+                              'CustomerGateways', CustomerGatewayIds, Filters, kwargs)
+
+    @_api
+    def create_customer_gateway(self, BgpAsn, Type, PublicIp=None, **kwargs):
+        cgw = self._new('customer-gateway', {
+            'BgpAsn': str(BgpAsn),
+            'IpAddress': PublicIp or kwargs.get('IpAddress'),
+            'Type': Type,
+            'State': 'available',
+        }, kwargs, 'CustomerGatewayId')
+        return {'CustomerGateway': cgw}
+
+    @_api
+    def delete_customer_gateway(self, CustomerGatewayId, **kwargs):
+        self._get('delete_customer_gateway', 'customer-gateway', CustomerGatewayId)
+        del self._store['customer-gateway'][CustomerGatewayId]
+        return {}
+
+    # VPN gateway
+
+    @_api
+    def describe_vpn_gateways(self, VpnGatewayIds=None, Filters=None, **kwargs):
+        return self._describe('describe_vpn_gateways', 'vpn-gateway', 'VpnGateways',
+                              VpnGatewayIds, Filters, kwargs)
+
+    @_api
+    def create_vpn_gateway(self, Type, AvailabilityZone=None, AmazonSideAsn=64512, **kwargs):
+        vgw = self._new('vpn-gateway', {
+            'Type': Type,
+            'State': 'available',
+            'VpcAttachments': [],
+            'AmazonSideAsn': AmazonSideAsn,
+        }, kwargs, 'VpnGatewayId')
+        if AvailabilityZone:
+            vgw['AvailabilityZone'] = AvailabilityZone
+        return {'VpnGateway': vgw}
+
+    @_api
+    def attach_vpn_gateway(self, VpcId, VpnGatewayId, **kwargs):
+        vgw = self._get('attach_vpn_gateway', 'vpn-gateway', VpnGatewayId)
+        self._get('attach_vpn_gateway', 'vpc', VpcId)
+        if any(attachment['State'] == 'attached' for attachment in vgw['VpcAttachments']):
+            raise _error('attach_vpn_gateway', 'VpnGatewayAttachmentLimitExceeded',
+                         '{} is already attached'.format(VpnGatewayId))
+        attachment = {'VpcId': VpcId, 'State': 'attached'}
+        vgw['VpcAttachments'] = [attachment]
+        return {'VpcAttachment': attachment}
+
+    @_api
+    def detach_vpn_gateway(self, VpcId, VpnGatewayId, **kwargs):
+        vgw = self._get('detach_vpn_gateway', 'vpn-gateway', VpnGatewayId)
+        for attachment in vgw['VpcAttachments']:
+            if attachment['VpcId'] == VpcId and attachment['State'] == 'attached':
+                attachment['State'] = 'detached'
+                return {}
+        raise _error('detach_vpn_gateway', 'InvalidVpnGatewayAttachment.NotFound',
+                     '{} is not attached to {}'.format(VpnGatewayId, VpcId))
+
+    @_api
+    def enable_vgw_route_propagation(self, GatewayId, RouteTableId, **kwargs):
+        route_table = self._get('enable_vgw_route_propagation', 'route-table', RouteTableId)
+        self._get('enable_vgw_route_propagation', 'vpn-gateway', GatewayId)
+        if not any(item['GatewayId'] == GatewayId for item in route_table['PropagatingVgws']):
+            route_table['PropagatingVgws'].append({'GatewayId': GatewayId})
+        return {}
+
+    @_api
+    def disable_vgw_route_propagation(self, GatewayId, RouteTableId, **kwargs):
+        route_table = self._get('disable_vgw_route_propagation', 'route-table', RouteTableId)
+        route_table['PropagatingVgws'] = [item for item in route_table['PropagatingVgws']
+                                          if item['GatewayId'] != GatewayId]
+        return {}
+
+    @_api
+    def delete_vpn_gateway(self, VpnGatewayId, **kwargs):
+        vgw = self._get('delete_vpn_gateway', 'vpn-gateway', VpnGatewayId)
+        if any(attachment['State'] == 'attached' for attachment in vgw['VpcAttachments']):
+            raise _error('delete_vpn_gateway', 'IncorrectState',
+                         '{} is attached'.format(VpnGatewayId))
+        del self._store['vpn-gateway'][VpnGatewayId]
+        return {}
+
+    # VPN connection
+
+    @_api
+    def describe_vpn_connections(self, VpnConnectionIds=None, Filters=None, **kwargs):
+        return self._describe('describe_vpn_connections', 'vpn-connection', 'VpnConnections',
+                              VpnConnectionIds, Filters, kwargs)
+
+    @_api
+    def create_vpn_connection(self, Type, CustomerGatewayId, VpnGatewayId=None, Options=None,
+                              **kwargs):
+        self._get('create_vpn_connection', 'customer-gateway', CustomerGatewayId)
+        if VpnGatewayId:
+            self._get('create_vpn_connection', 'vpn-gateway', VpnGatewayId)
+        vpn = self._new('vpn-connection', {
+            'Type': Type,
+            'CustomerGatewayId': CustomerGatewayId,
+            'VpnGatewayId': VpnGatewayId,
+            'State': 'available',
+            'Options': Options or {},
+            'Routes': [],
+        }, kwargs, 'VpnConnectionId')
+        return {'VpnConnection': vpn}
+
+    @_api
+    def delete_vpn_connection(self, VpnConnectionId, **kwargs):
+        self._get('delete_vpn_connection', 'vpn-connection', VpnConnectionId)
+        del self._store['vpn-connection'][VpnConnectionId]
+        return {}
+
+    @_api
+    def create_vpn_connection_route(self, VpnConnectionId, DestinationCidrBlock, **kwargs):
+        vpn = self._get('create_vpn_connection_route', 'vpn-connection', VpnConnectionId)
+        if not any(route['DestinationCidrBlock'] == DestinationCidrBlock for route in vpn['Routes']):
+            vpn['Routes'].append({'DestinationCidrBlock': DestinationCidrBlock,
+                                  'Source': 'Static', 'State': 'available'})
+        return {}
+
+    @_api
+    def delete_vpn_connection_route(self, VpnConnectionId, DestinationCidrBlock, **kwargs):
+        vpn = self._get('delete_vpn_connection_route', 'vpn-connection', VpnConnectionId)
+        routes = [route for route in vpn['Routes']
+                  if route['DestinationCidrBlock'] != DestinationCidrBlock]
+        if len(routes) == len(vpn['Routes']):
+            raise _error('delete_vpn_connection_route', 'InvalidRoute.NotFound',
+                         'No route for {}'.format(DestinationCidrBlock))
+        vpn['Routes'] = routes
+        return {}
+
+    # Route table
+
+    def _new_route_table(self, vpc, kwargs=None):
+        return self._new('route-table', {
+            'VpcId': vpc['VpcId'],
+            'Routes': [{'DestinationCidrBlock': vpc['CidrBlock'], 'GatewayId': 'local',
+                        'Origin': 'CreateRouteTable', 'State': 'active'}],
+            'Associations': [],
+            'PropagatingVgws': [],
+            'OwnerId': self.account,
+        }, kwargs, 'RouteTableId')
+
+    def _association(self, method, association_id):
+        for route_table in self._store['route-table'].values():
+            for association in route_table['Associations']:
+                if association['RouteTableAssociationId'] == association_id:
+                    return route_table, association
+        raise _error(method, 'InvalidAssociationID.NotFound',
+                     "The association ID '{}' does not exist".format(association_id))
+
+    @_api
+    def describe_route_tables(self, RouteTableIds=None, Filters=None, **kwargs):
+        return self._describe('describe_route_tables', 'route-table', 'RouteTables',
+                              RouteTableIds, Filters, kwargs)
+
+    @_api
+    def create_route_table(self, VpcId, **kwargs):
+        vpc = self._get('create_route_table', 'vpc', VpcId)
+        return {'ClientToken': kwargs.get('ClientToken'),
+                'RouteTable': self._new_route_table(vpc, kwargs)}
+
+    @_api
+    def associate_route_table(self, RouteTableId, SubnetId, **kwargs):
+        route_table = self._get('associate_route_table', 'route-table', RouteTableId)
+        self._get('associate_route_table', 'subnet', SubnetId)
+        for other in self._store['route-table'].values():
+            if any(association.get('SubnetId') == SubnetId for association in other['Associations']):
+                raise _error('associate_route_table', 'Resource.AlreadyAssociated',
+                             '{} is already associated'.format(SubnetId))
+        association_id = self._new_id('rtbassoc')
+        route_table['Associations'].append({
+            'Main': False,
+            'RouteTableAssociationId': association_id,
+            'RouteTableId': RouteTableId,
+            'SubnetId': SubnetId,
+            'AssociationState': {'State': 'associated'},
+        })
+        return {'AssociationId': association_id, 'AssociationState': {'State': 'associated'}}
+
+    @_api
+    def disassociate_route_table(self, AssociationId, **kwargs):
+        route_table, association = self._association('disassociate_route_table', AssociationId)
+        route_table['Associations'].remove(association)
+        return {}
+
+    @_api
+    def replace_route_table_association(self, AssociationId, RouteTableId, **kwargs):
+        route_table, association = self._association('replace_route_table_association',
+                                                     AssociationId)
+        target = self._get('replace_route_table_association', 'route-table', RouteTableId)
+        route_table['Associations'].remove(association)
+        association = dict(association, RouteTableAssociationId=self._new_id('rtbassoc'),
+                           RouteTableId=RouteTableId)
+        target['Associations'].append(association)
+        return {'NewAssociationId': association['RouteTableAssociationId'],
+                'AssociationState': {'State': 'associated'}}
+
+    @_api
+    def delete_route_table(self, RouteTableId, **kwargs):
+        route_table = self._get('delete_route_table', 'route-table', RouteTableId)
+        if route_table['Associations']:
+            raise _error('delete_route_table', 'DependencyViolation',
+                         "The routeTable '{}' has dependencies.".format(RouteTableId))
+        del self._store['route-table'][RouteTableId]
+        return {}
+
+    def _route_parts(self, method, kwargs):
+        destinations = [key for key in _ROUTE_DESTINATIONS if key in kwargs]
+        targets = {key: kwargs[key] for key in _ROUTE_TARGETS if key in kwargs}
+        if len(destinations) != 1 or len(targets) != 1:
+            raise _error(method, 'InvalidParameterCombination',
+                         'Specify exactly one destination and one target.')
+        for value in targets.values():
+            kind = _PREFIXES.get(value.split('-', 1)[0])
+            if kind is not None:
+                self._get(method, kind, value)
+        return destinations[0], targets
+
+    @_api
+    def create_route(self, RouteTableId, **kwargs):
+        route_table = self._get('create_route', 'route-table', RouteTableId)
+        destination, targets = self._route_parts('create_route', kwargs)
+        if any(route.get(destination) == kwargs[destination] for route in route_table['Routes']):
+            raise _error('create_route', 'RouteAlreadyExists',
+                         'The route identified by {} already exists.'.format(kwargs[destination]))
+        route = dict(targets, Origin='CreateRoute', State='active')
+        route[destination] = kwargs[destination]
+        route_table['Routes'].append(route)
+        return {'Return': True}
+
+    @_api
+    def replace_route(self, RouteTableId, **kwargs):
+        route_table = self._get('replace_route', 'route-table', RouteTableId)
+        destination, targets = self._route_parts('replace_route', kwargs)
+        for index, route in enumerate(route_table['Routes']):
+            if route.get(destination) == kwargs[destination] and route.get('GatewayId') != 'local':
+                route = dict(targets, Origin='CreateRoute', State='active')
+                route[destination] = kwargs[destination]
+                route_table['Routes'][index] = route
+                return {}
+        raise _error('replace_route', 'InvalidRoute.NotFound',
+                     'no route with destination {}'.format(kwargs[destination]))
+
+    @_api
+    def delete_route(self, RouteTableId, **kwargs):
+        route_table = self._get('delete_route', 'route-table', RouteTableId)
+        destination = next((key for key in _ROUTE_DESTINATIONS if key in kwargs), None)
+        for route in route_table['Routes']:
+            if destination and route.get(destination) == kwargs[destination] \
+                    and route.get('GatewayId') != 'local':
+                route_table['Routes'].remove(route)
+                return {}
+        raise _error('delete_route', 'InvalidRoute.NotFound',
+                     'no route with destination {}'.format(destination and kwargs[destination]))
+
+    # Network ACL
+
+    def _new_network_acl(self, vpc_id, default=False, kwargs=None):
+        # ACLs of a VPC with an IPv6 block get the IPv6 default entries too:
+        # rule 101 in the default ACL and the 32768 deny in every ACL.
+        ipv6 = bool(self._store['vpc'][vpc_id].get('Ipv6CidrBlockAssociationSet'))
+        entries = []
+        for egress in (True, False):
+            if default:
+                entries.append({'RuleNumber': 100, 'Protocol': '-1', 'RuleAction': 'allow',
+                                'Egress': egress, 'CidrBlock': '0.0.0.0/0'})
+                if ipv6:
+                    entries.append({'RuleNumber': 101, 'Protocol': '-1', 'RuleAction': 'allow',
+                                    'Egress': egress, 'Ipv6CidrBlock': '::/0'})
+            entries.append({'RuleNumber': 32767, 'Protocol': '-1', 'RuleAction': 'deny',
+                            'Egress': egress, 'CidrBlock': '0.0.0.0/0'})
+            if ipv6:
+                entries.append({'RuleNumber': 32768, 'Protocol': '-1', 'RuleAction': 'deny',
+                                'Egress': egress, 'Ipv6CidrBlock': '::/0'})
+        return self._new('network-acl', {
+            'VpcId': vpc_id,
+            'IsDefault': default,
+            'Entries': entries,
+            'Associations': [],
+            'OwnerId': self.account,
+        }, kwargs, 'NetworkAclId')
+
+    def _entry(self, method, network_acl_id, rule_number, egress):
+        network_acl = self._get(method, 'network-acl', network_acl_id)
+        if not 1 <= rule_number <= 32766:
+            # The default entries, 32767 and up, cannot be changed.
+            raise _error(method, 'InvalidParameterValue',
+                         'Invalid value for parameter ruleNumber: {}'.format(rule_number))
+        for index, entry in enumerate(network_acl['Entries']):
+            if entry['RuleNumber'] == rule_number and entry['Egress'] == egress:
+                return network_acl, index
+        return network_acl, None
+
+    @staticmethod
+    def _new_entry(kwargs):
+        entry = {key: kwargs[key] for key in ('RuleNumber', 'Protocol', 'RuleAction', 'Egress',
+                                              'CidrBlock', 'Ipv6CidrBlock', 'IcmpTypeCode',
+                                              'PortRange') if key in kwargs}
+        entry['Protocol'] = str(entry['Protocol'])
+        return entry
+
+    @_api
+    def describe_network_acls(self, NetworkAclIds=None, Filters=None, **kwargs):
+        return self._describe('describe_network_acls', 'network-acl', 'NetworkAcls',
+                              NetworkAclIds, Filters, kwargs)
+
+    @_api
+    def create_network_acl(self, VpcId, **kwargs):
+        self._get('create_network_acl', 'vpc', VpcId)
+        return {'ClientToken': kwargs.get('ClientToken'),
+                'NetworkAcl': self._new_network_acl(VpcId, kwargs=kwargs)}
+
+    @_api
+    def create_network_acl_entry(self, NetworkAclId, RuleNumber, Egress, **kwargs):
+        network_acl, index = self._entry('create_network_acl_entry', NetworkAclId,
+                                         RuleNumber, Egress)
+        if index is not None:
+            raise _error('create_network_acl_entry', 'NetworkAclEntryAlreadyExists',
+                         'The network acl entry identified by {} already exists.'.format(RuleNumber))
+        if sum(1 for entry in network_acl['Entries']
+               if entry['Egress'] == Egress and entry['RuleNumber'] < 32767) >= ACL_ENTRY_LIMIT:
+            raise _error('create_network_acl_entry', 'NetworkAclEntryLimitExceeded',
+                         'The maximum number of network acl entries has been reached.')
+        network_acl['Entries'].append(self._new_entry(
+            dict(kwargs, RuleNumber=RuleNumber, Egress=Egress)))
+        return {}
+
+    @_api
+    def replace_network_acl_entry(self, NetworkAclId, RuleNumber, Egress, **kwargs):
+        network_acl, index = self._entry('replace_network_acl_entry', NetworkAclId,
+                                         RuleNumber, Egress)
+        if index is None:
+            raise _error('replace_network_acl_entry', 'InvalidNetworkAclEntry.NotFound',
+                         'The network acl entry identified by {} does not exist.'.format(RuleNumber))
+        network_acl['Entries'][index] = self._new_entry(
+            dict(kwargs, RuleNumber=RuleNumber, Egress=Egress))
+        return {}
+
+    @_api
+    def delete_network_acl_entry(self, NetworkAclId, RuleNumber, Egress, **kwargs):
+        network_acl, index = self._entry('delete_network_acl_entry', NetworkAclId,
+                                         RuleNumber, Egress)
+        if index is None:
+            raise _error('delete_network_acl_entry', 'InvalidNetworkAclEntry.NotFound',
+                         'The network acl entry identified by {} does not exist.'.format(RuleNumber))
+        del network_acl['Entries'][index]
+        return {}
+
+    @_api
+    def replace_network_acl_association(self, AssociationId, NetworkAclId, **kwargs):
+        target = self._get('replace_network_acl_association', 'network-acl', NetworkAclId)
+        for network_acl in self._store['network-acl'].values():
+            for association in network_acl['Associations']:
+                if association['NetworkAclAssociationId'] == AssociationId:
+                    network_acl['Associations'].remove(association)
+                    association = {'NetworkAclAssociationId': self._new_id('aclassoc'),
+                                   'NetworkAclId': NetworkAclId,
+                                   'SubnetId': association['SubnetId']}
+                    target['Associations'].append(association)
+                    return {'NewAssociationId': association['NetworkAclAssociationId']}
+        raise _error('replace_network_acl_association', 'InvalidAssociationID.NotFound',
+                     "The association ID '{}' does not exist".format(AssociationId))
+
+    @_api
+    def delete_network_acl(self, NetworkAclId, **kwargs):
+        network_acl = self._get('delete_network_acl', 'network-acl', NetworkAclId)
+        if network_acl['IsDefault']:
+            raise _error('delete_network_acl', 'Client.CannotDelete',
+                         'Cannot delete default network ACL {}'.format(NetworkAclId))
+        if network_acl['Associations']:
+            raise _error('delete_network_acl', 'DependencyViolation',
+                         "The networkAcl '{}' has dependencies.".format(NetworkAclId))
+        del self._store['network-acl'][NetworkAclId]
+        return {}
+
+    # Peering
+
+    @_api
+    def describe_vpc_peering_connections(self, VpcPeeringConnectionIds=None, Filters=None,
+                                         **kwargs):
+        return self._describe('describe_vpc_peering_connections', 'vpc-peering-connection',
+                              'VpcPeeringConnections', VpcPeeringConnectionIds, Filters, kwargs)
+
+    @_api
+    def create_vpc_peering_connection(self, VpcId, PeerVpcId, PeerOwnerId=None, PeerRegion=None,
+                                      **kwargs):
+        vpc = self._get('create_vpc_peering_connection', 'vpc', VpcId)
+        peer = self._get('create_vpc_peering_connection', 'vpc', PeerVpcId)
+        pcx = self._new('vpc-peering-connection', {
+            'RequesterVpcInfo': {'VpcId': VpcId, 'CidrBlock': vpc['CidrBlock'],
+                                 'OwnerId': self.account, 'Region': self.meta.region_name},
+            'AccepterVpcInfo': {'VpcId': PeerVpcId, 'CidrBlock': peer['CidrBlock'],
+                                'OwnerId': PeerOwnerId or self.account,
+                                'Region': PeerRegion or self.meta.region_name},
+            'Status': {'Code': 'pending-acceptance', 'Message': 'Pending Acceptance'},
+        }, kwargs, 'VpcPeeringConnectionId')
+        return {'VpcPeeringConnection': pcx}
+
+    def _peering_status(self, method, peering_id, code, allowed):
+        pcx = self._get(method, 'vpc-peering-connection', peering_id)
+        if pcx['Status']['Code'] not in allowed:
+            raise _error(method, 'InvalidStateTransition',
+                         '{} is {}'.format(peering_id, pcx['Status']['Code']))
+        pcx['Status'] = {'Code': code, 'Message': code.title()}
+        return pcx
+
+    @_api
+    def accept_vpc_peering_connection(self, VpcPeeringConnectionId, **kwargs):
+        pcx = self._peering_status('accept_vpc_peering_connection', VpcPeeringConnectionId,
+                                   'active', ('pending-acceptance',))
+        return {'VpcPeeringConnection': pcx}
+
+    @_api
+    def reject_vpc_peering_connection(self, VpcPeeringConnectionId, **kwargs):
+        self._peering_status('reject_vpc_peering_connection', VpcPeeringConnectionId,
+                             'rejected', ('pending-acceptance',))
+        return {'Return': True}
+
+    @_api
+    def modify_vpc_peering_connection_options(self, VpcPeeringConnectionId, **kwargs):
+        pcx = self._get('modify_vpc_peering_connection_options', 'vpc-peering-connection',
+                        VpcPeeringConnectionId)
+        response = {}
+        for side, info in (('Requester', 'RequesterVpcInfo'), ('Accepter', 'AccepterVpcInfo')):
+            options = kwargs.get(side + 'PeeringConnectionOptions')
+            if options:
+                pcx[info].setdefault('PeeringOptions', {}).update(options)
+                response[side + 'PeeringConnectionOptions'] = options
+        return response
+
+    @_api
+    def delete_vpc_peering_connection(self, VpcPeeringConnectionId, **kwargs):
+        self._peering_status('delete_vpc_peering_connection', VpcPeeringConnectionId, 'deleted',
+                             ('pending-acceptance', 'active', 'provisioning'))
+        return {'Return': True}
+
+    # Tags
+
+    @_api
+    def create_tags(self, Resources, Tags, **kwargs):
+        found = []
+        for resource_id in Resources:
+            resource = self._find(resource_id)
+            if resource is None:
+                raise _error('create_tags', 'InvalidID',
+                             "The ID '{}' is not valid".format(resource_id))
+            found.append(resource)
+        for resource in found:
+            self._merge_tags(resource, Tags)
+        return {}
+
+    @_api
+    def delete_tags(self, Resources, Tags=None, **kwargs):
+        for resource_id in Resources:
+            resource = self._find(resource_id)
+            if resource is None:
+                continue
+            if Tags is None:
+                resource['Tags'] = []
+            else:
+                keys = {tag['Key'] for tag in Tags}
+                resource['Tags'] = [tag for tag in resource['Tags'] if tag['Key'] not in keys]
+        return {}
+
+
+def install(**kwargs):
+    '''
+    Makes every client of the shared registry one MemoryEC2 backend.
+    :param kwargs: MemoryEC2 arguments.
+    :return: (MemoryEC2)
+    '''
+    backend = MemoryEC2(**kwargs)
+    clients.registry.set_factory(lambda service, region=None, profile=None, role_arn=None: backend)
+    return backend
+
+
+def uninstall():
+    '''
+    Restores the boto3 client factory of the shared registry.
+    :return:
+    '''
+    clients.registry.set_factory(None)
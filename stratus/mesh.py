@@ -0,0 +1,256 @@
+__author__ = 'rafael'
+
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stratus import cirrus
+from stratus import tracing
+
+# Peers every VPC of a set with every other one.
+
+# The mesh is built in phases, each one running concurrently across all pairs
+# or route tables:
+#
+#     describe VPCs, existing peerings and route tables (one call each)
+#     -> request a peering for every pair not already peered
+#     -> accept every peering pending acceptance
+#     -> add routes to the peer VPC CIDRs, one worker per route table
+#
+# Pairs with an active or pending peering are not requested again, and routes
+# already pointing at the right peering are left alone, so running the mesh
+# again only fills in what is missing. Only routes that already point at a
+# peering connection are repointed; a peer CIDR already routed to anything
+# else (an internet, transit or virtual private gateway, a NAT gateway, the
+# local route) is left in place and reported as a conflict. A peering this run
+# requested but could not accept is deleted again, or reported as orphaned if
+# that fails too.
+#
+# Usage:
+#     from stratus import mesh
+#
+#     result = mesh.build_mesh(['vpc-a', 'vpc-b', 'vpc-c'], DryRun=False)
+#     print(result['connections'])
+
+# Peering states that count as an existing connection for a pair.
+_LIVE_STATES = ('initiating-request', 'pending-acceptance', 'provisioning', 'active')
+
+# A new peering may not be visible to accept_vpc_peering_connection right
+# away; accepting is retried this many times, doubling the delay.
+_ACCEPT_ATTEMPTS = 5
+_ACCEPT_DELAY = 1
+
+
+def _pair(vpc_a, vpc_b):
+    return tuple(sorted((vpc_a, vpc_b)))
+
+
+def _vpc_cidrs(vpc):
+    '''
+    Returns the associated IPv4 CIDR blocks of a VPC.
+    '''
+    cidrs = [association['CidrBlock']
+             for association in vpc.get('CidrBlockAssociationSet', [])
+             if association.get('CidrBlockState', {}).get('State') == 'associated']
+    return cidrs or [vpc['CidrBlock']]
+
+
+def discover(vpc_ids, client=None):
+    '''
+    Describes the VPCs, the live peerings between them and their route
+    tables, all three at once.
+    :param vpc_ids: Ids of the VPCs in the mesh.
+    :param client: EC2 client; default client if None.
+    :return: (vpcs, peerings, route_tables); vpcs maps VPC id to VPC, peerings
+        maps a sorted VPC id pair to its peering, route_tables maps VPC id to
+        a list of route tables.
+    '''
+    vpc_ids = list(vpc_ids)
+    vpc_filter = [{'Name': 'vpc-id', 'Values': vpc_ids}]
+    queries = {
+        'vpcs': (cirrus.iter_vpcs, {'VpcIds': vpc_ids}),
+        'peerings': (cirrus.iter_vpc_peering_connections, {'Filters': [
+            {'Name': 'requester-vpc-info.vpc-id', 'Values': vpc_ids},
+            {'Name': 'status-code', 'Values': list(_LIVE_STATES)}]}),
+        'route_tables': (cirrus.iter_route_tables, {'Filters': vpc_filter}),
+    }
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        describe = tracing.propagate(lambda query: list(query[0](client=client, **query[1])))
+        futures = {key: executor.submit(describe, query) for key, query in queries.items()}
+        found = {key: future.result() for key, future in futures.items()}
+
+    vpcs = {vpc['VpcId']: vpc for vpc in found['vpcs']}
+    peerings = {}
+    members = set(vpc_ids)
+    for peering in found['peerings']:
+        requester = peering['RequesterVpcInfo']['VpcId']
+        accepter = peering['AccepterVpcInfo']['VpcId']
+        if accepter in members:
+            pair = _pair(requester, accepter)
+            # Prefer an active peering over one still being set up.
+            current = peerings.get(pair)
+            if current is None or peering['Status']['Code'] == 'active':
+                peerings[pair] = peering
+    route_tables = {vpc_id: [] for vpc_id in vpc_ids}
+    for route_table in found['route_tables']:
+        route_tables[route_table['VpcId']].append(route_table)
+    return vpcs, peerings, route_tables
+
+
+def _request(client, vpcs, pair, DryRun):
+    requester, accepter = pair
+    response = cirrus.create_vpc_peering_connection(
+        '{}-{}'.format(requester, accepter),
+        client=client,
+        DryRun=DryRun,
+        VpcId=requester,
+        PeerVpcId=accepter,
+        PeerOwnerId=vpcs[accepter]['OwnerId'],
+    )
+    return response and response['VpcPeeringConnection']
+
+
+def _accept(client, peering_id, DryRun):
+    delay = _ACCEPT_DELAY
+    attempts = 1 if DryRun else _ACCEPT_ATTEMPTS
+    for attempt in range(attempts):
+        response = cirrus.accept_vpc_peering_connection(
+            client=client, DryRun=DryRun, VpcPeeringConnectionId=peering_id)
+        if response is not None:
+            return response['VpcPeeringConnection']
+        if attempt + 1 < attempts:
+            time.sleep(delay)
+            delay *= 2
+    return None
+
+
+def _route_target(route):
+    for key in cirrus.ROUTE_TARGETS:
+        if route.get(key):
+            return route[key]
+    return None
+
+
+def _program_routes(client, route_table, routes, DryRun):
+    '''
+    Adds or repoints the routes of one route table, one call at a time.
+    Returns (routes changed, routes that failed, conflicts), conflicts being
+    (route table id, CIDR, target) of routes to a peer CIDR with a target
+    other than a peering connection, which are left alone.
+    '''
+    existing = {route.get('DestinationCidrBlock'): route
+                for route in route_table.get('Routes', [])}
+    changed = failed = 0
+    conflicts = []
+    for cidr, peering_id in routes:
+        current = existing.get(cidr)
+        if current is not None and current.get('VpcPeeringConnectionId') == peering_id:
+            continue
+        if current is not None and not current.get('VpcPeeringConnectionId'):
+            conflicts.append((route_table['RouteTableId'], cidr, _route_target(current)))
+            continue
+        function = cirrus.replace_route if current is not None else cirrus.create_route
+        response = function(
+            client=client,
+            DryRun=DryRun,
+            RouteTableId=route_table['RouteTableId'],
+            DestinationCidrBlock=cidr,
+            VpcPeeringConnectionId=peering_id,
+        )
+        if response is None:
+            failed += 1
+        else:
+            changed += 1
+    return changed, failed, conflicts
+
+
+@tracing.traced('mesh.build_mesh')
+def build_mesh(vpc_ids, client=None, DryRun=False, max_workers=16, route_tables=None):
+    '''
+    Peers every pair of VPCs and routes each VPC to the CIDRs of its peers.
+    :param vpc_ids: Ids of the VPCs in the mesh, all reachable with client.
+    :param client: EC2 client; default client if None.
+    :param DryRun: Passed to every mutating cirrus call.
+    :param max_workers: Calls in flight at once within a phase.
+    :param route_tables: Optional {vpc id: [route table id,]} restricting
+        which route tables get peer routes; all tables of each VPC if None.
+    :return: Dictionary with 'connections' ({(vpc, vpc): peering id}),
+        'requested', 'accepted' and 'routes' counts, 'failed', a list of
+        pairs or route table ids a phase could not complete, 'conflicts', a
+        list of (route table id, CIDR, target) of routes left alone because
+        they point at something other than a peering, and 'orphaned', the
+        ids of peerings requested but neither accepted nor deleted.
+    '''
+    vpcs, peerings, tables = discover(vpc_ids, client=client)
+    missing = [vpc_id for vpc_id in vpc_ids if vpc_id not in vpcs]
+    if missing:
+        raise ValueError('VPCs not found: {}'.format(', '.join(missing)))
+    result = {'connections': {}, 'requested': 0, 'accepted': 0, 'routes': 0, 'failed': [],
+              'conflicts': [], 'orphaned': []}
+    pairs = [_pair(a, b) for a, b in itertools.combinations(sorted(set(vpc_ids)), 2)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Request
+        wanted = [pair for pair in pairs if pair not in peerings]
+        requested_ids = set()
+        requested = executor.map(
+            tracing.propagate(lambda pair: _request(client, vpcs, pair, DryRun)), wanted)
+        for pair, peering in zip(wanted, requested):
+            if peering is None:
+                result['failed'].append(pair)
+            else:
+                peerings[pair] = peering
+                requested_ids.add(peering['VpcPeeringConnectionId'])
+                result['requested'] += 1
+
+        # Accept
+        pending = [pair for pair, peering in peerings.items()
+                   if peering['Status']['Code'] in ('initiating-request', 'pending-acceptance')]
+        accepted = executor.map(tracing.propagate(
+            lambda pair: _accept(client, peerings[pair]['VpcPeeringConnectionId'], DryRun)),
+            pending)
+        abandoned = []
+        for pair, peering in zip(pending, accepted):
+            if peering is None:
+                result['failed'].append(pair)
+                peering_id = peerings.pop(pair)['VpcPeeringConnectionId']
+                if peering_id in requested_ids:
+                    abandoned.append(peering_id)
+            else:
+                result['accepted'] += 1
+
+        # Delete the peerings this run requested but could not accept, so a
+        # rerun does not find them pending and skip the pair.
+        deleted = executor.map(tracing.propagate(
+            lambda peering_id: cirrus.delete_vpc_peering_connection(
+                client=client, DryRun=DryRun, VpcPeeringConnectionId=peering_id)),
+            abandoned)
+        for peering_id, response in zip(abandoned, deleted):
+            if response is None:
+                result['orphaned'].append(peering_id)
+
+        # Routes, grouped per route table so each table is programmed by one
+        # worker.
+        work = []
+        for vpc_id in vpcs:
+            routes = []
+            for pair, peering in peerings.items():
+                if vpc_id in pair:
+                    peer = pair[1] if pair[0] == vpc_id else pair[0]
+                    routes.extend((cidr, peering['VpcPeeringConnectionId'])
+                                  for cidr in _vpc_cidrs(vpcs[peer]))
+            selected = None if route_tables is None else set(route_tables.get(vpc_id, ()))
+            for route_table in tables[vpc_id]:
+                if routes and (selected is None or route_table['RouteTableId'] in selected):
+                    work.append((route_table, routes))
+        changed = executor.map(tracing.propagate(
+            lambda item: _program_routes(client, item[0], item[1], DryRun)), work)
+        for (route_table, _), (count, failed, conflicts) in zip(work, changed):
+            result['routes'] += count
+            result['conflicts'].extend(conflicts)
+            if failed:
+                result['failed'].append(route_table['RouteTableId'])
+
+    result['connections'] = {pair: peering['VpcPeeringConnectionId']
+                             for pair, peering in peerings.items()}
+    return result
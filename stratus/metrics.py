@@ -0,0 +1,395 @@
+__author__ = 'rafael'
+
+import functools
+import os
+import tempfile
+import threading
+import time
+from array import array
+
+# Call counts, error counts and latency histograms per operation and target.
+
+# While metrics are enabled, every attempt of an EC2 API call cirrus makes
+# (each retry of a throttled call on its own, rate limiter waits and backoff
+# left out, describe cache hits excluded) is timed per operation and region,
+# and the decorated Azure entry points (Loader.create_resource_group/deploy/
+# destroy, cumulus.create_update_vnet) per resource group. Latencies go into
+# log-linear histograms of fixed size, like HdrHistogram: 2 ** significant_bits
+# buckets per power of two, so every recorded value is kept to within about 3%
+# and memory does not grow with the number of calls. When disabled the cost is one global lookup per call.
+#
+# flush() hands a snapshot to every sink. Sinks are objects with an
+# emit(snapshot) method; SnapshotSink keeps the last snapshot in memory and
+# PrometheusTextfileSink writes it for the node_exporter textfile collector.
+#
+# Usage:
+#     from stratus import metrics
+#
+#     textfile = metrics.PrometheusTextfileSink('/var/lib/node_exporter/stratus.prom')
+#     collector = metrics.enable(sinks=[textfile])
+#     topology.apply(spec)
+#     for series in collector.snapshot():
+#         print(series['operation'], series['target'], series['calls'], series['p99'])
+#     metrics.disable()                                   # flushes the sinks
+
+# Upper bounds, in seconds, of the buckets written to Prometheus.
+PROMETHEUS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    '''
+    Log-linear histogram of non-negative integers with a fixed number of
+    buckets. Not thread-safe; Metrics serializes access.
+
+    Args:
+        significant_bits (int): Sub-buckets per power of two, as a power of
+            two; 5 keeps values to within 1/32.
+        highest (int): Largest value told apart; larger values are counted in
+            the last bucket. Default is 2 ** 40 ns, about 18 minutes.
+    '''
+
+    def __init__(self, significant_bits=5, highest=2 ** 40):
+        self.significant_bits = significant_bits
+        self.highest = highest
+        self._sub_buckets = 1 << significant_bits
+        self.counts = array('Q', bytes(8 * (self._index(highest) + 1)))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < 2 * self._sub_buckets:
+            return value
+        shift = value.bit_length() - self.significant_bits - 1
+        return (shift + 1) * self._sub_buckets + (value >> shift) - self._sub_buckets
+
+    def _upper(self, index):
+        '''
+        Returns the highest value counted in bucket index.
+        '''
+        if index < 2 * self._sub_buckets:
+            return index
+        shift = index // self._sub_buckets - 1
+        mantissa = index % self._sub_buckets + self._sub_buckets
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value):
+        '''
+        Counts one value.
+        :param value: (int) >= 0.
+        :return:
+        '''
+        self.counts[self._index(min(value, self.highest))] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        '''
+        Returns the value below which the given percentage of values fall,
+        as the upper bound of its bucket capped at the largest value seen.
+        :param percent: 0 to 100.
+        :return: (int) or None when empty.
+        '''
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper(index), self.max)
+        return self.max
+
+    def buckets(self):
+        '''
+        Returns the non-empty buckets as (highest value, count), in order.
+        :return: List of tuples.
+        '''
+        return [(self._upper(index), count) for index, count in enumerate(self.counts) if count]
+
+    def copy(self):
+        histogram = Histogram.__new__(Histogram)
+        histogram.__dict__.update(self.__dict__)
+        histogram.counts = array('Q', self.counts)
+        return histogram
+
+
+def _seconds(nanoseconds):
+    return None if nanoseconds is None else nanoseconds / 1e9
+
+
+class Series:
+    '''
+    Counters and latency histogram of one (operation, target).
+    '''
+
+    def __init__(self, operation, target, significant_bits):
+        self.operation = operation
+        self.target = target
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram(significant_bits)
+
+
+class Metrics:
+    '''
+    Collects the series of every (operation, target) and flushes them to
+    sinks.
+
+    Args:
+        sinks (list): Objects with an emit(snapshot) method.
+        significant_bits (int): Histogram precision, see Histogram.
+    '''
+
+    def __init__(self, sinks=(), significant_bits=5):
+        self.sinks = list(sinks)
+        self.significant_bits = significant_bits
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, target, nanoseconds, error=False):
+        '''
+        Counts one call.
+        :param operation: Operation name, e.g. 'create_subnet'.
+        :param target: Region, resource group or None.
+        :param nanoseconds: Duration of the call.
+        :param error: Whether the call failed.
+        :return:
+        '''
+        key = (operation, target)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = Series(operation, target, self.significant_bits)
+            series.calls += 1
+            if error:
+                series.errors += 1
+            series.latency.record(nanoseconds)
+
+    def timed(self, operation, target, func):
+        '''
+        Wraps func so each call of it is recorded; a call that raises counts
+        as an error.
+        :param operation: Operation name.
+        :param target: Region, resource group or None.
+        :param func: Callable without arguments.
+        :return: Callable.
+        '''
+        def call():
+            start = time.perf_counter_ns()
+            error = True
+            try:
+                response = func()
+                error = False
+                return response
+            finally:
+                self.record(operation, target, time.perf_counter_ns() - start, error)
+        return call
+
+    def snapshot(self):
+        '''
+        Returns a consistent copy of every series. Latencies are in seconds.
+        :return: List of dictionaries with 'operation', 'target', 'calls',
+            'errors', 'seconds' (total), 'min', 'p50', 'p90', 'p99', 'max'
+            and 'buckets', the non-empty histogram buckets as (highest
+            seconds, count), sorted by operation and target.
+        '''
+        with self._lock:
+            copies = [(series.operation, series.target, series.calls, series.errors,
+                       series.latency.copy())
+                      for series in self._series.values()]
+        snapshot = []
+        for operation, target, calls, errors, latency in copies:
+            snapshot.append({
+                'operation': operation,
+                'target': target,
+                'calls': calls,
+                'errors': errors,
+                'seconds': latency.total / 1e9,
+                'min': _seconds(latency.min),
+                'p50': _seconds(latency.percentile(50)),
+                'p90': _seconds(latency.percentile(90)),
+                'p99': _seconds(latency.percentile(99)),
+                'max': _seconds(latency.max),
+                'buckets': [(upper / 1e9, count) for upper, count in latency.buckets()],
+            })
+        snapshot.sort(key=lambda series: (series['operation'], str(series['target'])))
+        return snapshot
+
+    def flush(self):
+        '''
+        Emits a snapshot to every sink.
+        :return: The snapshot emitted.
+        '''
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.emit(snapshot)
+        return snapshot
+
+    def reset(self):
+        '''
+        Drops every series.
+        :return:
+        '''
+        with self._lock:
+            self._series = {}
+
+
+class SnapshotSink:
+    '''
+    Keeps the last snapshot emitted.
+
+    Attributes:
+        latest (list): Last snapshot, empty before the first flush.
+    '''
+
+    def __init__(self):
+        self.latest = []
+
+    def emit(self, snapshot):
+        self.latest = snapshot
+
+
+def _labels(series):
+    target = '' if series['target'] is None else str(series['target'])
+    return 'operation="{}",target="{}"'.format(
+        series['operation'], target.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+class PrometheusTextfileSink:
+    '''
+    Writes snapshots in the Prometheus text format, replacing the file
+    atomically so the collector never reads a partial file.
+
+    Args:
+        path (str): File to write, usually *.prom in the textfile directory.
+        prefix (str): Prefix of the metric names.
+    '''
+
+    def __init__(self, path, prefix='stratus'):
+        self.path = path
+        self.prefix = prefix
+
+    def render(self, snapshot):
+        '''
+        Formats a snapshot.
+        :param snapshot: Value returned by Metrics.snapshot.
+        :return: (str)
+        '''
+        calls = '{}_calls_total'.format(self.prefix)
+        errors = '{}_errors_total'.format(self.prefix)
+        duration = '{}_call_duration_seconds'.format(self.prefix)
+        lines = [
+            '# HELP {} Calls per operation and target.'.format(calls),
+            '# TYPE {} counter'.format(calls),
+        ]
+        lines += ['{}{{{}}} {}'.format(calls, _labels(series), series['calls'])
+                  for series in snapshot]
+        lines += [
+            '# HELP {} Failed calls per operation and target.'.format(errors),
+            '# TYPE {} counter'.format(errors),
+        ]
+        lines += ['{}{{{}}} {}'.format(errors, _labels(series), series['errors'])
+                  for series in snapshot]
+        lines += [
+            '# HELP {} Call latency per operation and target.'.format(duration),
+            '# TYPE {} histogram'.format(duration),
+        ]
+        for series in snapshot:
+            labels = _labels(series)
+            buckets = series['buckets']
+            position = cumulative = 0
+            for bound in PROMETHEUS_BUCKETS:
+                while position < len(buckets) and buckets[position][0] <= bound:
+                    cumulative += buckets[position][1]
+                    position += 1
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(duration, labels, bound, cumulative))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(duration, labels, series['calls']))
+            lines.append('{}_sum{{{}}} {}'.format(duration, labels, series['seconds']))
+            lines.append('{}_count{{{}}} {}'.format(duration, labels, series['calls']))
+        return '\n'.join(lines) + '\n'
+
+    def emit(self, snapshot):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.stratus', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as output:
+                output.write(self.render(snapshot))
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+def region(client):
+    '''
+    Returns the region of a boto3 client, the target of EC2 series.
+    '''
+    meta = getattr(client, 'meta', None)
+    return getattr(meta, 'region_name', None)
+
+
+def instrument(operation=None, target=None, failed=None):
+    '''
+    Decorator recording each call of a function while metrics are enabled.
+    A call that raises counts as an error.
+    :param operation: Operation name; default is the function's qualified
+        name, e.g. 'Loader.deploy'.
+    :param target: Callable taking the function's arguments and returning
+        the target, e.g. the resource group.
+    :param failed: Callable taking the return value and returning whether
+        the call failed, for functions that return their errors.
+    :return: Decorator.
+    '''
+    def decorator(func):
+        name = operation or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = active
+            if recorder is None:
+                return func(*args, **kwargs)
+            key = target(*args, **kwargs) if target is not None else None
+            start = time.perf_counter_ns()
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = failed is not None and bool(failed(result))
+                return result
+            finally:
+                recorder.record(name, key, time.perf_counter_ns() - start, error)
+        return wrapper
+    return decorator
+
+
+# Metrics used by cirrus._call and instrument(); None records nothing.
+active = None
+
+
+def enable(sinks=(), significant_bits=5):
+    '''
+    Starts recording into a new Metrics.
+    :param sinks: Objects with an emit(snapshot) method.
+    :param significant_bits: Histogram precision, see Histogram.
+    :return: (Metrics)
+    '''
+    global active
+    active = Metrics(sinks=sinks, significant_bits=significant_bits)
+    return active
+
+
+def disable():
+    '''
+    Stops recording and flushes the sinks one last time.
+    :return: (Metrics) The metrics recorded, or None.
+    '''
+    global active
+    recorded, active = active, None
+    if recorded is not None:
+        recorded.flush()
+    return recorded
@@ -0,0 +1,290 @@
+__author__ = 'rafael'
+
+import contextvars
+import copy
+import threading
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+# Offline plan mode: records what a workflow would do without calling EC2.
+
+# While a Plan is active, cirrus._call hands every API call to it instead of
+# EC2. Mutating calls are recorded and answered with a response carrying
+# placeholder ids (vpc-plan00001, subnet-plan00002, ...), so later steps that
+# need those ids run on as usual. Describe calls return empty results. Each
+# recorded call depends on the calls that produced the placeholder ids in its
+# arguments, and, for calls made by a dag node, on the calls of the nodes it
+# runs after (dag.execute reports them through node()), which gives the full
+# dependency graph of the workflow: its ordered calls, the count per operation
+# and the parallel depth, i.e. the number of rounds the calls need when every
+# independent call runs at once.
+#
+# CIDRs taken from IPAM pools while planning come from a copy of each pool
+# (pool()), so planning leaves the real pools as they were.
+#
+# Usage:
+#     from stratus import plan, topology
+#
+#     with plan.recording() as recorded:
+#         topology.apply(spec)
+#     print(recorded.report())
+
+# Response key, id key and id prefix of the resource each create call returns.
+CREATES = {
+    'create_vpc': ('Vpc', 'VpcId', 'vpc'),
+    'create_subnet': ('Subnet', 'SubnetId', 'subnet'),
+    'create_dhcp_options': ('DhcpOptions', 'DhcpOptionsId', 'dopt'),
+    'create_internet_gateway': ('InternetGateway', 'InternetGatewayId', 'igw'),
+    'create_nat_gateway': ('NatGateway', 'NatGatewayId', 'nat'),
+    'create_customer_gateway': ('CustomerGateway', 'CustomerGatewayId', 'cgw'),
+    'create_vpn_gateway': ('VpnGateway', 'VpnGatewayId', 'vgw'),
+    'create_vpn_connection': ('VpnConnection', 'VpnConnectionId', 'vpn'),
+    'create_route_table': ('RouteTable', 'RouteTableId', 'rtb'),
+    'create_network_acl': ('NetworkAcl', 'NetworkAclId', 'acl'),
+    'create_vpc_peering_connection': ('VpcPeeringConnection', 'VpcPeeringConnectionId', 'pcx'),
+}
+
+# Calls that return a new association id rather than a resource.
+ASSOCIATIONS = {
+    'associate_route_table': ('AssociationId', 'rtbassoc'),
+    'replace_route_table_association': ('NewAssociationId', 'rtbassoc'),
+    'replace_network_acl_association': ('NewAssociationId', 'aclassoc'),
+}
+
+# One recorded call. depends_on holds the indexes of the steps whose ids it
+# uses and level the round it can run in, starting at 0.
+Step = namedtuple('Step', ['index', 'operation', 'kwargs', 'produces', 'depends_on', 'level'])
+
+# Dag node whose calls are being recorded, and the nodes it runs after.
+_node = contextvars.ContextVar('stratus_plan_node', default=None)
+
+
+def _result_key(operation):
+    '''
+    Returns the list key of a describe response, e.g. 'RouteTables' for
+    describe_route_tables.
+    '''
+    return ''.join(part.title() for part in operation.split('_')[1:])
+
+
+class Plan:
+    '''
+    Recorder of the mutating calls of a workflow.
+    '''
+
+    def __init__(self):
+        self.steps = []
+        self.describes = Counter()
+        self._producers = {}
+        self._subnet_acls = {}
+        self._node_steps = {}
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _placeholder(self, prefix):
+        return '{}-plan{:05d}'.format(prefix, len(self._producers) + 1)
+
+    def _dependencies(self, value, found):
+        if isinstance(value, str):
+            if value in self._producers:
+                found.add(self._producers[value])
+        elif isinstance(value, dict):
+            for item in value.values():
+                self._dependencies(item, found)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                self._dependencies(item, found)
+        return found
+
+    def _default_acls(self, kwargs):
+        '''
+        Answers describe_network_acls for the default ACL associations of
+        planned subnets.
+        '''
+        associations = []
+        for item in kwargs.get('Filters', []):
+            if item['Name'] == 'association.subnet-id':
+                associations.extend(
+                    {'SubnetId': subnet_id,
+                     'NetworkAclAssociationId': self._subnet_acls[subnet_id]}
+                    for subnet_id in item['Values'] if subnet_id in self._subnet_acls)
+        if not associations:
+            return {'NetworkAcls': []}
+        return {'NetworkAcls': [{'NetworkAclId': 'acl-default', 'IsDefault': True,
+                                 'Associations': associations, 'Entries': []}]}
+
+    @contextmanager
+    def node(self, key, after=()):
+        '''
+        Attributes the calls made inside a with block to a dag node, which
+        depend on every call of the nodes it runs after.
+        :param key: Node key.
+        :param after: Keys of the nodes it depends on.
+        :return:
+        '''
+        token = _node.set((key, tuple(after)))
+        try:
+            yield
+        finally:
+            _node.reset(token)
+
+    def pool(self, pool):
+        '''
+        Returns the copy of an IPAM pool that allocations are planned from.
+        :param pool: ipam.Pool or ipam.PoolGroup.
+        :return: Copy of the pool, the same one for every call.
+        '''
+        with self._lock:
+            if id(pool) not in self._pools:
+                self._pools[id(pool)] = (pool, pool.copy())
+            return self._pools[id(pool)][1]
+
+    def record(self, operation, kwargs):
+        '''
+        Records one API call and returns the response EC2 would give, with
+        placeholder ids.
+        :param operation: Client method name, e.g. 'create_subnet'.
+        :param kwargs: Arguments of the API call.
+        :return: Response dictionary.
+        '''
+        if operation.startswith(('describe_', 'get_', 'list_')):
+            with self._lock:
+                self.describes[operation] += 1
+                if operation == 'describe_network_acls':
+                    return self._default_acls(kwargs)
+            return {_result_key(operation): []}
+
+        kwargs = copy.deepcopy(kwargs)
+        node = _node.get()
+        with self._lock:
+            found = self._dependencies(kwargs, set())
+            if node is not None:
+                for dependency in node[1]:
+                    found.update(self._node_steps.get(dependency, ()))
+            depends_on = sorted(found)
+            level = max((self.steps[index].level + 1 for index in depends_on), default=0)
+            index = len(self.steps)
+            response = {}
+            produces = None
+            if operation in CREATES:
+                response_key, id_key, prefix = CREATES[operation]
+                produces = self._placeholder(prefix)
+                resource = {key: value for key, value in kwargs.items()
+                            if key not in ('DryRun', 'TagSpecifications', 'ClientToken')}
+                resource[id_key] = produces
+                resource['State'] = 'available'
+                for specification in kwargs.get('TagSpecifications', []):
+                    resource['Tags'] = specification['Tags']
+                response[response_key] = resource
+            elif operation in ASSOCIATIONS:
+                id_key, prefix = ASSOCIATIONS[operation]
+                produces = self._placeholder(prefix)
+                response[id_key] = produces
+            if produces is not None:
+                self._producers[produces] = index
+            if operation == 'create_subnet':
+                # New subnets are associated with the default network ACL,
+                # which topology replaces by describing the association.
+                association_id = self._placeholder('aclassoc')
+                self._producers[association_id] = index
+                self._subnet_acls[produces] = association_id
+            self.steps.append(Step(index, operation, kwargs, produces, depends_on, level))
+            if node is not None:
+                self._node_steps.setdefault(node[0], []).append(index)
+        return response
+
+    def counts(self):
+        '''
+        Returns the number of recorded calls per operation.
+        :return: (Counter)
+        '''
+        return Counter(step.operation for step in self.steps)
+
+    def depth(self):
+        '''
+        Returns the number of rounds the calls need when every call runs as
+        soon as the calls it depends on are done.
+        :return: (int)
+        '''
+        return max((step.level for step in self.steps), default=-1) + 1
+
+    def levels(self):
+        '''
+        Groups the steps by round.
+        :return: List of lists of Step.
+        '''
+        levels = [[] for _ in range(self.depth())]
+        for step in self.steps:
+            levels[step.level].append(step)
+        return levels
+
+    def to_dict(self):
+        '''
+        Returns the plan as plain data, e.g. to dump as JSON in CI.
+        :return: Dictionary with 'steps', 'counts', 'calls', 'depth' and
+            'describes'.
+        '''
+        return {
+            'steps': [step._asdict() for step in self.steps],
+            'counts': dict(self.counts()),
+            'calls': len(self.steps),
+            'depth': self.depth(),
+            'describes': dict(self.describes),
+        }
+
+    def report(self):
+        '''
+        Formats the plan: every call grouped by round, then the totals.
+        :return: (str)
+        '''
+        lines = []
+        for level, steps in enumerate(self.levels()):
+            lines.append('Round {} ({} calls)'.format(level + 1, len(steps)))
+            for step in steps:
+                line = '  #{} {}'.format(step.index, step.operation)
+                if step.produces:
+                    line += ' -> {}'.format(step.produces)
+                if step.depends_on:
+                    line += ' after {}'.format(', '.join('#{}'.format(i) for i in step.depends_on))
+                lines.append(line)
+        lines.append('{} calls in {} rounds'.format(len(self.steps), self.depth()))
+        for operation, count in sorted(self.counts().items()):
+            lines.append('  {:<40} {}'.format(operation, count))
+        return '\n'.join(lines)
+
+
+# Plan used by cirrus._call; None makes real calls.
+active = None
+
+
+def enable():
+    '''
+    Starts recording into a new plan; cirrus stops calling EC2.
+    :return: (Plan)
+    '''
+    global active
+    active = Plan()
+    return active
+
+
+def disable():
+    '''
+    Stops recording; cirrus calls EC2 again.
+    :return: (Plan) The plan recorded, or None.
+    '''
+    global active
+    recorded, active = active, None
+    return recorded
+
+
+@contextmanager
+def recording():
+    '''
+    Records the cirrus calls made inside a with block.
+    :return: (Plan)
+    '''
+    recorded = enable()
+    try:
+        yield recorded
+    finally:
+        disable()
@@ -0,0 +1,205 @@
+__author__ = 'rafael'
+
+import ipaddress
+import socket
+from array import array
+
+from stratus import cirrus
+
+# Longest-prefix-match lookups over VPC route tables.
+
+# Each route table is loaded into two binary radix tries, IPv4 and IPv6, kept
+# in flat integer arrays. A lookup walks at most 32 (or 128) array slots, so
+# answering "which route does traffic from subnet X to IP Y use?" no longer
+# means scanning every route of every table.
+#
+# Usage:
+#     from stratus import routeindex
+#
+#     index = routeindex.load(vpc_ids=['vpc-?'])
+#     route = index.lookup('subnet-?', '10.1.2.3')
+#     routes = index.lookup_many([('subnet-a', '10.1.2.3'), ('subnet-b', '::1')])
+#
+# Subnets without an explicit association use the main route table of their
+# VPC, which needs the subnets (describe_subnets output) to be loaded too.
+
+
+def _parse_address(address):
+    '''
+    Returns (version, integer) for an IPv4 or IPv6 address. inet_pton is an
+    order of magnitude faster than ipaddress for plain strings.
+    '''
+    if isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return address.version, int(address)
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+    except OSError:
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+    except OSError:
+        raise ValueError('{!r} is not an IP address'.format(address))
+
+
+class _Trie:
+    '''
+    Array-backed binary trie. Node 0 is the root; left, right and value hold
+    child node indexes and route indexes, -1 meaning none.
+    '''
+
+    __slots__ = ('bits', 'left', 'right', 'value', 'routes')
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.left = array('i', [-1])
+        self.right = array('i', [-1])
+        self.value = array('i', [-1])
+        self.routes = []
+
+    def insert(self, network, prefixlen, route):
+        node = 0
+        for shift in range(self.bits - 1, self.bits - 1 - prefixlen, -1):
+            children = self.right if (network >> shift) & 1 else self.left
+            child = children[node]
+            if child < 0:
+                child = len(self.left)
+                self.left.append(-1)
+                self.right.append(-1)
+                self.value.append(-1)
+                children[node] = child
+            node = child
+        if self.value[node] < 0:
+            self.value[node] = len(self.routes)
+            self.routes.append(route)
+        else:
+            self.routes[self.value[node]] = route
+
+    def lookup(self, address):
+        left, right, value = self.left, self.right, self.value
+        best = value[0]
+        node = 0
+        shift = self.bits - 1
+        while shift >= 0:
+            node = (right if (address >> shift) & 1 else left)[node]
+            if node < 0:
+                break
+            if value[node] >= 0:
+                best = value[node]
+            shift -= 1
+        return self.routes[best] if best >= 0 else None
+
+
+class RouteIndex:
+    '''
+    Route tables, their subnet associations and a trie per table and address
+    family.
+
+    Args:
+        prefix_lists (dict): Optional {prefix list id: ['cidr',]} used to
+            index routes whose destination is a managed prefix list; without
+            it those routes are left out.
+    '''
+
+    def __init__(self, prefix_lists=None):
+        self.prefix_lists = prefix_lists or {}
+        self.tables = {}
+        self.subnet_tables = {}
+        self.main_tables = {}
+        self.subnet_vpcs = {}
+
+    def add_route_table(self, route_table):
+        '''
+        Indexes one route table from describe_route_tables output.
+        :param route_table: Route table dictionary.
+        :return:
+        '''
+        tries = {4: _Trie(32), 6: _Trie(128)}
+        routes = route_table.get('Routes', [])
+        # Prefix list routes first, so an explicit CIDR for the same prefix
+        # takes precedence.
+        for route in routes:
+            for cidr in self.prefix_lists.get(route.get('DestinationPrefixListId'), []):
+                network = ipaddress.ip_network(cidr)
+                tries[network.version].insert(int(network.network_address),
+                                              network.prefixlen, route)
+        for route in routes:
+            cidr = route.get('DestinationCidrBlock') or route.get('DestinationIpv6CidrBlock')
+            if cidr:
+                network = ipaddress.ip_network(cidr)
+                tries[network.version].insert(int(network.network_address),
+                                              network.prefixlen, route)
+        route_table_id = route_table['RouteTableId']
+        self.tables[route_table_id] = tries
+        for association in route_table.get('Associations', []):
+            if association.get('Main'):
+                self.main_tables[route_table.get('VpcId')] = route_table_id
+            elif association.get('SubnetId'):
+                self.subnet_tables[association['SubnetId']] = route_table_id
+
+    def add_subnet(self, subnet):
+        '''
+        Records the VPC of a subnet from describe_subnets output, so it can
+        fall back to the main route table.
+        :param subnet: Subnet dictionary.
+        :return:
+        '''
+        self.subnet_vpcs[subnet['SubnetId']] = subnet['VpcId']
+
+    def route_table_for(self, subnet_id):
+        '''
+        Returns the id of the route table a subnet uses, or None.
+        :param subnet_id: Id of the subnet.
+        :return: (str)
+        '''
+        route_table_id = self.subnet_tables.get(subnet_id)
+        if route_table_id is None:
+            route_table_id = self.main_tables.get(self.subnet_vpcs.get(subnet_id))
+        return route_table_id
+
+    def lookup(self, subnet_id, destination):
+        '''
+        Returns the route traffic from a subnet to a destination address uses.
+        :param subnet_id: Id of the source subnet.
+        :param destination: IPv4 or IPv6 address, as a string or ipaddress
+            object.
+        :return: Route dictionary from describe_route_tables, or None when no
+            route matches or the subnet's route table is unknown.
+        '''
+        return self.lookup_many([(subnet_id, destination)])[0]
+
+    def lookup_many(self, pairs):
+        '''
+        Resolves many (subnet, destination) pairs in one call.
+        :param pairs: Iterable of (subnet id, destination address).
+        :return: List of route dictionaries or None, in the order of pairs.
+        '''
+        results = []
+        tries_by_subnet = {}
+        for subnet_id, destination in pairs:
+            tries = tries_by_subnet.get(subnet_id)
+            if tries is None:
+                tries = self.tables.get(self.route_table_for(subnet_id), {})
+                tries_by_subnet[subnet_id] = tries
+            version, address = _parse_address(destination)
+            trie = tries.get(version)
+            results.append(trie.lookup(address) if trie else None)
+        return results
+
+
+def load(client=None, vpc_ids=None, prefix_lists=None):
+    '''
+    Builds a RouteIndex from the route tables and subnets of some or all VPCs.
+    :param client: EC2 client; default client if None.
+    :param vpc_ids: VPCs to load; all VPCs visible to the client if None.
+    :param prefix_lists: See RouteIndex.
+    :return: (RouteIndex)
+    '''
+    kwargs = {}
+    if vpc_ids is not None:
+        kwargs['Filters'] = [{'Name': 'vpc-id', 'Values': list(vpc_ids)}]
+    index = RouteIndex(prefix_lists=prefix_lists)
+    for route_table in cirrus.iter_route_tables(client=client, **kwargs):
+        index.add_route_table(route_table)
+    for subnet in cirrus.iter_subnets(client=client, **kwargs):
+        index.add_subnet(subnet)
+    return index
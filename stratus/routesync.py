@@ -0,0 +1,237 @@
+__author__ = 'rafael'
+
+import ipaddress
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from stratus import cirrus
+from stratus import tracing
+
+# Brings route tables to a desired set of routes with the fewest calls.
+
+# The current routes of every table come from one describe_route_tables call.
+# Each desired route is matched to the current route with the same
+# destination: missing routes are created, routes with a different target are
+# replaced, and current routes that are not desired are deleted. Only those
+# changes are sent, all concurrently. The local route and routes propagated
+# from a virtual private gateway are never touched.
+#
+# Routes use the keys of cirrus.create_route: one destination key and one
+# target key.
+#
+# Usage:
+#     from stratus import routesync
+#
+#     result = routesync.sync_routes({
+#         'rtb-?': [
+#             {'DestinationCidrBlock': '0.0.0.0/0', 'NatGatewayId': 'nat-?'},
+#             {'DestinationCidrBlock': '10.8.0.0/16', 'TransitGatewayId': 'tgw-?'},
+#         ],
+#     }, DryRun=False)
+#
+# The static routes of VPN connections are synced the same way from the Routes
+# of one describe_vpn_connections call. The desired prefixes are aggregated
+# first, so adjacent and overlapping prefixes need fewer routes:
+#
+#     result = routesync.sync_vpn_routes({
+#         'vpn-?': ['10.8.0.0/24', '10.8.1.0/24', '172.16.0.0/16'],
+#     })
+
+
+def _destination(route):
+    '''
+    Returns (key, value) of the destination of a route.
+    '''
+    for key in cirrus.ROUTE_DESTINATIONS:
+        if route.get(key):
+            return key, route[key]
+    raise ValueError('route has no destination: {}'.format(route))
+
+
+def _target(route):
+    '''
+    Returns the target keys of a route and their values.
+    '''
+    return {key: route[key] for key in cirrus.ROUTE_TARGETS if route.get(key)}
+
+
+def _managed(route):
+    '''
+    Whether a current route is one sync_routes may change: not the local
+    route and not a propagated one.
+    '''
+    return (route.get('Origin', 'CreateRoute') == 'CreateRoute'
+            and route.get('GatewayId') != 'local')
+
+
+def plan_routes(desired, route_tables, prune=True):
+    '''
+    Diffs desired routes against the current route tables.
+    :param desired: {route table id: [route,]}, routes as create_route
+        keyword arguments without RouteTableId.
+    :param route_tables: Route table dictionaries from describe_route_tables.
+    :param prune: Delete current routes that are not desired. The local
+        route and propagated routes are never deleted, and desired routes to
+        the local destination are ignored.
+    :return: List of (action, kwargs) with action 'create', 'replace' or
+        'delete' and kwargs for the cirrus function of that name.
+    '''
+    tables = {route_table['RouteTableId']: route_table for route_table in route_tables}
+    changes = []
+    for route_table_id, routes in desired.items():
+        if route_table_id not in tables:
+            raise ValueError('route table not found: {}'.format(route_table_id))
+        current = {}
+        local = set()
+        for route in tables[route_table_id].get('Routes', []):
+            if not any(route.get(key) for key in cirrus.ROUTE_DESTINATIONS):
+                continue
+            if route.get('GatewayId') == 'local':
+                local.add(_destination(route))
+            elif _managed(route):
+                current[_destination(route)] = route
+        wanted = set()
+        for route in routes:
+            destination = _destination(route)
+            if destination in local:
+                continue
+            wanted.add(destination)
+            existing = current.get(destination)
+            target = _target(route)
+            kwargs = dict(target, RouteTableId=route_table_id)
+            kwargs[destination[0]] = destination[1]
+            if existing is None:
+                changes.append(('create', kwargs))
+            elif any(existing.get(key) != value for key, value in target.items()):
+                changes.append(('replace', kwargs))
+        if prune:
+            for destination in current:
+                if destination not in wanted:
+                    changes.append(('delete', {'RouteTableId': route_table_id,
+                                               destination[0]: destination[1]}))
+    return changes
+
+
+_ACTIONS = {
+    'create': cirrus.create_route,
+    'replace': cirrus.replace_route,
+    'delete': cirrus.delete_route,
+    'create-vpn-route': cirrus.create_vpn_connection_route,
+    'delete-vpn-route': cirrus.delete_vpn_connection_route,
+}
+
+
+def apply_changes(changes, client=None, DryRun=False, max_workers=16):
+    '''
+    Issues route changes concurrently, each through the shared rate limiter.
+    :param changes: Value returned by plan_routes or plan_vpn_routes.
+    :param client: EC2 client; default client if None.
+    :param DryRun: Passed to every cirrus call.
+    :param max_workers: Calls in flight at once.
+    :return: Dictionary with a Counter of applied changes per action under
+        'applied' and the (action, kwargs) that failed under 'failed'.
+    '''
+    def apply(change):
+        action, kwargs = change
+        return _ACTIONS[action](client=client, DryRun=DryRun, **kwargs)
+
+    result = {'applied': Counter(), 'failed': []}
+    if not changes:
+        return result
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for change, response in zip(changes, executor.map(tracing.propagate(apply), changes)):
+            if response is None:
+                result['failed'].append(change)
+            else:
+                result['applied'][change[0]] += 1
+    return result
+
+
+@tracing.traced('routesync.sync_routes')
+def sync_routes(desired, client=None, DryRun=False, prune=True, max_workers=16):
+    '''
+    Makes the routes of many route tables match the desired ones.
+    :param desired: {route table id: [route,]}, see plan_routes.
+    :param client: EC2 client; default client if None.
+    :param DryRun: Passed to every mutating cirrus call.
+    :param prune: Delete current routes that are not desired.
+    :param max_workers: Calls in flight at once.
+    :return: Value of apply_changes, plus the planned changes under
+        'changes'.
+    '''
+    route_tables = list(cirrus.iter_route_tables(client=client, RouteTableIds=list(desired)))
+    changes = plan_routes(desired, route_tables, prune=prune)
+    result = apply_changes(changes, client=client, DryRun=DryRun, max_workers=max_workers)
+    result['changes'] = changes
+    return result
+
+
+def aggregate_prefixes(prefixes):
+    '''
+    Collapses prefixes into the fewest covering prefixes: duplicates and
+    prefixes inside others are dropped and adjacent ones merged.
+    :param prefixes: Iterable of IPv4 or IPv6 CIDR strings.
+    :return: Sorted list of CIDR strings, IPv4 first.
+    '''
+    networks = {4: [], 6: []}
+    for prefix in prefixes:
+        network = ipaddress.ip_network(prefix, strict=False)
+        networks[network.version].append(network)
+    return [str(network)
+            for version in (4, 6)
+            for network in ipaddress.collapse_addresses(networks[version])]
+
+
+def plan_vpn_routes(desired, vpn_connections, aggregate=True, prune=True):
+    '''
+    Diffs desired static route prefixes against the current VPN connections.
+    :param desired: {VPN connection id: ['cidr',]}.
+    :param vpn_connections: VPN connection dictionaries from
+        describe_vpn_connections.
+    :param aggregate: Collapse the desired prefixes first.
+    :param prune: Delete current static routes that are not desired.
+    :return: List of (action, kwargs) with action 'create-vpn-route' or
+        'delete-vpn-route'.
+    '''
+    connections = {connection['VpnConnectionId']: connection for connection in vpn_connections}
+    changes = []
+    for vpn_connection_id, prefixes in desired.items():
+        if vpn_connection_id not in connections:
+            raise ValueError('VPN connection not found: {}'.format(vpn_connection_id))
+        if aggregate:
+            prefixes = aggregate_prefixes(prefixes)
+        else:
+            prefixes = [str(ipaddress.ip_network(prefix, strict=False)) for prefix in prefixes]
+        current = {route['DestinationCidrBlock']
+                   for route in connections[vpn_connection_id].get('Routes', [])
+                   if route.get('State') not in ('deleting', 'deleted')}
+        for prefix in prefixes:
+            if prefix not in current:
+                changes.append(('create-vpn-route', {'VpnConnectionId': vpn_connection_id,
+                                                     'DestinationCidrBlock': prefix}))
+        if prune:
+            for prefix in sorted(current - set(prefixes)):
+                changes.append(('delete-vpn-route', {'VpnConnectionId': vpn_connection_id,
+                                                     'DestinationCidrBlock': prefix}))
+    return changes
+
+
+@tracing.traced('routesync.sync_vpn_routes')
+def sync_vpn_routes(desired, client=None, aggregate=True, prune=True, max_workers=16):
+    '''
+    Makes the static routes of many VPN connections match the desired
+    prefixes.
+    :param desired: {VPN connection id: ['cidr',]}, see plan_vpn_routes.
+    :param client: EC2 client; default client if None.
+    :param aggregate: Collapse the desired prefixes first.
+    :param prune: Delete current static routes that are not desired.
+    :param max_workers: Calls in flight at once.
+    :return: Value of apply_changes, plus the planned changes under
+        'changes'.
+    '''
+    vpn_connections = list(cirrus.iter_vpn_connections(
+        client=client, DryRun=False, VpnConnectionIds=list(desired)))
+    changes = plan_vpn_routes(desired, vpn_connections, aggregate=aggregate, prune=prune)
+    result = apply_changes(changes, client=client, max_workers=max_workers)
+    result['changes'] = changes
+    return result
@@ -0,0 +1,143 @@
+__author__ = 'rafael'
+
+import gzip
+import json
+from collections import Counter, OrderedDict
+
+from botocore.exceptions import ClientError
+
+from stratus import cirrus
+from stratus import clients
+from stratus import fanout
+
+# Point-in-time snapshot of the network estate as gzip-compressed JSON Lines.
+
+# Every resource is streamed from the paginated cirrus iter_* generators
+# straight into the file, one line per resource:
+#
+#     {"type": "subnet", "account": "111111111111", "region": "us-east-1",
+#      "resource": {...describe output...}}
+#
+# so memory use does not grow with the size of the estate. read_snapshot()
+# reads a snapshot back just as lazily.
+#
+# Usage:
+#     from stratus import fanout, snapshot
+#
+#     targets = fanout.role_targets(accounts, regions, 'NetworkAudit')
+#     snapshot.export_snapshot('estate.jsonl.gz', targets=targets)
+#     for record in snapshot.read_snapshot('estate.jsonl.gz', types=['subnet']):
+#         print(record['resource']['CidrBlock'])
+
+# Exported resource types and the generator that lists each of them.
+RESOURCE_TYPES = OrderedDict([
+    ('vpc', cirrus.iter_vpcs),
+    ('subnet', cirrus.iter_subnets),
+    ('route-table', cirrus.iter_route_tables),
+    ('network-acl', cirrus.iter_network_acls),
+    ('internet-gateway', cirrus.iter_internet_gateways),
+    ('nat-gateway', cirrus.iter_nat_gateways),
+    ('vpn-gateway', cirrus.iter_vpn_gateways),
+    ('customer-gateway', cirrus.iter_customer_gateways),
+    ('vpn-connection', cirrus.iter_vpn_connections),
+    ('vpc-peering-connection', cirrus.iter_vpc_peering_connections),
+    ('dhcp-options', cirrus.iter_dhcp_options),
+])
+
+
+def _iter_resources(client=None, types=None, PageSize=100):
+    '''
+    Yields (type, resource, error) for every resource of the given types
+    reachable with one client. A type whose listing fails yields its error
+    after the resources read so far, and the remaining types are still listed.
+    '''
+    for resource_type in types or RESOURCE_TYPES:
+        try:
+            for resource in RESOURCE_TYPES[resource_type](PageSize=PageSize, client=client):
+                yield resource_type, resource, None
+        except ClientError as e:
+            yield resource_type, None, e
+
+
+def _local_results(client, types):
+    '''
+    Yields fanout.Result records for the resources reachable with one client.
+    '''
+    region = client.meta.region_name
+    for item in _iter_resources(client=client, types=types):
+        yield fanout.Result(None, region, item, None)
+
+
+def export_snapshot(path, targets=None, types=None, client=None, max_workers=16,
+                    timeout=None, compresslevel=6):
+    '''
+    Writes every resource of the given types to a gzip-compressed JSON Lines
+    file.
+    :param path: Output file, conventionally ending in .jsonl.gz.
+    :param targets: fanout targets to snapshot concurrently; None snapshots
+        the region and account of client only.
+    :param types: Resource types to export, keys of RESOURCE_TYPES; all if
+        None.
+    :param client: EC2 client used when targets is None; default client if
+        None.
+    :param max_workers: Number of targets read at once.
+    :param timeout: Seconds a target may take, see fanout.fan_out.
+    :param compresslevel: gzip compression level, 1 (fast) to 9 (small).
+    :return: (Counter) Number of resources written per type, plus 'errors'
+        for every type of a target that failed to list, and for targets that
+        failed or timed out as a whole. A target counted in 'errors' may have
+        part of its resources in the file: the snapshot is incomplete for it.
+    '''
+    counts = Counter()
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=compresslevel) as snapshot_file:
+        if targets is None:
+            if client is None:
+                client = clients.get_client()
+            results = _local_results(client, types)
+        else:
+            results = fanout.fan_out(_iter_resources, targets, max_workers=max_workers,
+                                     timeout=timeout, types=types)
+        for result in results:
+            if result.error is not None:
+                print('Snapshot of {} {} failed: {}'.format(
+                    result.account, result.region, result.error))
+                counts['errors'] += 1
+                continue
+            resource_type, resource, error = result.resource
+            if error is not None:
+                print('Snapshot of {} in {} {} failed: {}'.format(
+                    resource_type, result.account, result.region, error))
+                counts['errors'] += 1
+                continue
+            record = {
+                'type': resource_type,
+                'account': result.account,
+                'region': result.region,
+                'resource': resource,
+            }
+            snapshot_file.write(json.dumps(record, default=str, separators=(',', ':')))
+            snapshot_file.write('\n')
+            counts[resource_type] += 1
+    return counts
+
+
+def read_snapshot(path, types=None, accounts=None, regions=None):
+    '''
+    Yields the records of a snapshot one at a time, optionally filtered.
+    :param path: Snapshot file written by export_snapshot().
+    :param types: Resource types to keep; all if None.
+    :param accounts: Account ids to keep; all if None.
+    :param regions: Regions to keep; all if None.
+    :return: Generator of {'type', 'account', 'region', 'resource'}
+        dictionaries.
+    '''
+    with gzip.open(path, 'rt', encoding='utf-8') as snapshot_file:
+        for line in snapshot_file:
+            record = json.loads(line)
+            if types is not None and record['type'] not in types:
+                continue
+            if accounts is not None and record['account'] not in accounts:
+                continue
+            if regions is not None and record['region'] not in regions:
+                continue
+            yield record
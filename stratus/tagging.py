@@ -0,0 +1,143 @@
+__author__ = 'rafael'
+
+import threading
+from collections import OrderedDict
+
+from stratus import cirrus
+
+# Coalesces tag requests from many operations into few create_tags calls.
+
+# Pending (resource, tags) pairs are grouped by identical tag sets; each group
+# is sent as create_tags calls of up to cirrus.MAX_TAG_RESOURCES resources. A
+# group is flushed as soon as it is full, everything is flushed every
+# flush_interval seconds while the batcher is running, and on close(). EC2
+# rejects a whole call when one of its resource ids is invalid or gone, so such
+# a call is split in halves and retried until the bad ids are isolated.
+#
+# Usage:
+#     from stratus import tagging
+#
+#     with tagging.TagBatcher() as batcher:
+#         for subnet_id in subnet_ids:
+#             batcher.add(subnet_id, [{'Key': 'CostCenter', 'Value': '1234'}])
+
+
+def _invalid_id(error):
+    '''
+    Tells whether a create_tags error was caused by a resource id, e.g.
+    InvalidID or InvalidSubnetID.NotFound, rather than by the call itself.
+    :param error: ClientError
+    :return: (bool)
+    '''
+    code = error.response.get('Error', {}).get('Code', '')
+    return code == 'InvalidID' or code.endswith(('.NotFound', '.Malformed'))
+
+
+class TagBatcher:
+    '''
+    Collects tags for many resources and flushes them in batched create_tags
+    calls.
+
+    Args:
+        client: EC2 client; default client if None.
+        max_resources (int): Resource ids per create_tags call.
+        flush_interval (float): Seconds between background flushes once
+            started; None flushes only when a group is full or on flush().
+        DryRun (bool): Passed to create_tags.
+
+    Attributes:
+        calls (int): Number of create_tags calls made.
+        failed (list): (resource_ids, tags) of calls that returned an error;
+            after an invalid or missing resource id only the offending ids.
+    '''
+
+    def __init__(self, client=None, max_resources=cirrus.MAX_TAG_RESOURCES,
+                 flush_interval=1.0, DryRun=False):
+        self.client = client
+        self.max_resources = min(max_resources, cirrus.MAX_TAG_RESOURCES)
+        self.flush_interval = flush_interval
+        self.dry_run = DryRun
+        self.calls = 0
+        self.failed = []
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, resource_id, tags):
+        '''
+        Queues tags for a resource.
+        :param resource_id: Id of any taggable EC2 resource.
+        :param tags: [{'Key': 'string', 'Value': 'string'},]
+        :return:
+        '''
+        key = tuple(sorted((tag['Key'], tag['Value']) for tag in tags))
+        with self._lock:
+            group = self._groups.setdefault(key, OrderedDict())
+            group[resource_id] = None
+            if len(group) < self.max_resources:
+                return
+            del self._groups[key]
+        self._send(key, list(group))
+
+    def flush(self):
+        '''
+        Sends every queued tag.
+        :return:
+        '''
+        with self._lock:
+            groups, self._groups = self._groups, OrderedDict()
+        for key, group in groups.items():
+            resource_ids = list(group)
+            for start in range(0, len(resource_ids), self.max_resources):
+                self._send(key, resource_ids[start:start + self.max_resources])
+
+    def _send(self, key, resource_ids):
+        tags = [{'Key': tag_key, 'Value': value} for tag_key, value in key]
+        with cirrus.capture_errors() as errors:
+            response = cirrus.create_tags(client=self.client, DryRun=self.dry_run,
+                                          Resources=resource_ids, Tags=tags)
+        with self._lock:
+            self.calls += 1
+        if response is not None:
+            return
+        if len(resource_ids) > 1 and errors and _invalid_id(errors[-1]):
+            middle = len(resource_ids) // 2
+            self._send(key, resource_ids[:middle])
+            self._send(key, resource_ids[middle:])
+            return
+        with self._lock:
+            self.failed.append((resource_ids, tags))
+
+    def start(self):
+        '''
+        Starts flushing in the background every flush_interval seconds.
+        :return:
+        '''
+        if self.flush_interval is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='TagBatcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        '''
+        Stops the background flush and sends everything still queued.
+        :return:
+        '''
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
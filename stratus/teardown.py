@@ -0,0 +1,237 @@
+__author__ = 'rafael'
+
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.waiter import NormalizedOperationMethod, Waiter, WaiterModel, xform_name
+
+from stratus import cache
+from stratus import cirrus
+from stratus import dag
+from stratus import plan
+from stratus import tracing
+
+# Deletes a VPC and everything cirrus can attach to it.
+
+# One inventory pass describes the NAT gateways, peerings, Internet and VPN
+# gateways, subnets, route tables and network ACLs of the VPC concurrently.
+# The deletes then run as a dependency graph, each layer concurrently, with
+# waiters where EC2 finishes a delete asynchronously:
+#
+#     NAT gateways, peerings, gateway route table associations, VPN gateway
+#     detach -> wait for NAT gateways deleted -> Internet gateway detach,
+#     subnets -> route tables, network ACLs, Internet gateways
+#     -> wait for VPN gateways detached -> VPC
+#
+# Subnet route table associations are not removed one by one: deleting the
+# subnet removes them, so a route table waits for its subnets instead.
+#
+# Security groups, endpoints and network interfaces are not managed by cirrus
+# and are not removed.
+#
+# Usage:
+#     from stratus import teardown
+#
+#     teardown.teardown('vpc-?', DryRun=False)
+
+_WAITERS = WaiterModel({
+    'version': 2,
+    'waiters': {
+        'NatGatewaysDeleted': {
+            'operation': 'DescribeNatGateways',
+            'delay': 5,
+            'maxAttempts': 120,
+            'acceptors': [
+                {'matcher': 'pathAll', 'argument': 'NatGateways[].State',
+                 'expected': 'deleted', 'state': 'success'},
+                {'matcher': 'error', 'expected': 'NatGatewayNotFound',
+                 'state': 'success'},
+            ],
+        },
+        'VpnGatewaysDetached': {
+            'operation': 'DescribeVpnGateways',
+            'delay': 5,
+            'maxAttempts': 120,
+            'acceptors': [
+                {'matcher': 'pathAll', 'argument': 'VpnGateways[].VpcAttachments[].State',
+                 'expected': 'detached', 'state': 'success'},
+            ],
+        },
+    },
+})
+
+
+def _wait(client, name, **kwargs):
+    '''
+    Blocks until the named waiter from _WAITERS succeeds. Its polls go
+    through cirrus._call, so they share the rate limiter and its retries,
+    and bypass the describe cache.
+    :return: (dict) Empty response, so the dag node counts as succeeded.
+    '''
+    if plan.active is not None:
+        return {}
+    config = _WAITERS.get_waiter(name)
+    describe = functools.partial(cirrus._call, client, xform_name(config.operation))
+
+    def poll(**arguments):
+        with cache.bypass():
+            return describe(**arguments)
+
+    Waiter(name, config, NormalizedOperationMethod(poll)).wait(**kwargs)
+    return {}
+
+
+def inventory(vpc_id, client=None):
+    '''
+    Describes everything attached to a VPC, with all describes in flight at
+    once.
+    :param vpc_id: Id of the VPC.
+    :param client: EC2 client; default client if None.
+    :return: Dictionary of resource lists keyed by 'NatGateways',
+        'VpcPeeringConnections', 'InternetGateways', 'VpnGateways', 'Subnets',
+        'RouteTables' and 'NetworkAcls'.
+    '''
+    vpc_filter = [{'Name': 'vpc-id', 'Values': [vpc_id]}]
+    queries = {
+        'NatGateways': (cirrus.iter_nat_gateways, {'Filter': vpc_filter + [
+            {'Name': 'state', 'Values': ['pending', 'available', 'deleting']}]}),
+        'RequesterPeerings': (cirrus.iter_vpc_peering_connections, {'Filters': [
+            {'Name': 'requester-vpc-info.vpc-id', 'Values': [vpc_id]}]}),
+        'AccepterPeerings': (cirrus.iter_vpc_peering_connections, {'Filters': [
+            {'Name': 'accepter-vpc-info.vpc-id', 'Values': [vpc_id]}]}),
+        'InternetGateways': (cirrus.iter_internet_gateways, {'Filters': [
+            {'Name': 'attachment.vpc-id', 'Values': [vpc_id]}]}),
+        'VpnGateways': (cirrus.iter_vpn_gateways, {'Filters': [
+            {'Name': 'attachment.vpc-id', 'Values': [vpc_id]},
+            {'Name': 'attachment.state', 'Values': ['attaching', 'attached']}]}),
+        'Subnets': (cirrus.iter_subnets, {'Filters': vpc_filter}),
+        'RouteTables': (cirrus.iter_route_tables, {'Filters': vpc_filter}),
+        'NetworkAcls': (cirrus.iter_network_acls, {'Filters': vpc_filter}),
+    }
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        describe = tracing.propagate(lambda query: list(query[0](client=client, **query[1])))
+        futures = {key: executor.submit(describe, query) for key, query in queries.items()}
+        found = {key: future.result() for key, future in futures.items()}
+
+    peerings = {}
+    for peering in found.pop('RequesterPeerings') + found.pop('AccepterPeerings'):
+        if peering['Status']['Code'] in ('initiating-request', 'pending-acceptance',
+                                         'provisioning', 'active'):
+            peerings[peering['VpcPeeringConnectionId']] = peering
+    found['VpcPeeringConnections'] = list(peerings.values())
+    return found
+
+
+def build_graph(vpc_id, resources, client=None, DryRun=False):
+    '''
+    Turns an inventory into a dependency graph of deletes.
+    :param vpc_id: Id of the VPC.
+    :param resources: Value returned by inventory().
+    :param client: EC2 client; default client if None.
+    :param DryRun: Passed to every cirrus call.
+    :return: (dag.Graph)
+    '''
+    graph = dag.Graph()
+    common = {'client': client, 'DryRun': DryRun}
+    last = []
+
+    nat_ids = [nat['NatGatewayId'] for nat in resources['NatGateways']]
+    for nat_id in nat_ids:
+        graph.add('nat-delete:' + nat_id, cirrus.delete_nat_gateway,
+                  kwargs={'client': client, 'NatGatewayId': nat_id})
+    nats_deleted = ()
+    if nat_ids:
+        graph.add('nat-wait', _wait, args=(client, 'NatGatewaysDeleted'),
+                  kwargs={'NatGatewayIds': nat_ids},
+                  after=['nat-delete:' + nat_id for nat_id in nat_ids])
+        nats_deleted = ('nat-wait',)
+
+    for peering in resources['VpcPeeringConnections']:
+        key = 'pcx-delete:' + peering['VpcPeeringConnectionId']
+        graph.add(key, cirrus.delete_vpc_peering_connection, kwargs=dict(
+            common, VpcPeeringConnectionId=peering['VpcPeeringConnectionId']))
+        last.append(key)
+
+    vgw_ids = [vgw['VpnGatewayId'] for vgw in resources['VpnGateways']]
+    for vgw_id in vgw_ids:
+        graph.add('vgw-detach:' + vgw_id, cirrus.detach_vpn_gateway,
+                  kwargs=dict(common, VpnGatewayId=vgw_id, VpcId=vpc_id))
+    if vgw_ids:
+        graph.add('vgw-wait', _wait, args=(client, 'VpnGatewaysDetached'),
+                  kwargs={'VpnGatewayIds': vgw_ids},
+                  after=['vgw-detach:' + vgw_id for vgw_id in vgw_ids])
+        last.append('vgw-wait')
+
+    for igw in resources['InternetGateways']:
+        igw_id = igw['InternetGatewayId']
+        graph.add('igw-detach:' + igw_id, cirrus.detach_internet_gateway,
+                  kwargs=dict(common, InternetGatewayId=igw_id, VpcId=vpc_id),
+                  after=nats_deleted)
+        graph.add('igw-delete:' + igw_id, cirrus.delete_internet_gateway,
+                  kwargs=dict(common, InternetGatewayId=igw_id),
+                  after=['igw-detach:' + igw_id])
+        last.append('igw-delete:' + igw_id)
+
+    subnet_ids = set()
+    for subnet in resources['Subnets']:
+        subnet_ids.add(subnet['SubnetId'])
+        key = 'subnet-delete:' + subnet['SubnetId']
+        graph.add(key, cirrus.delete_subnet,
+                  kwargs=dict(common, SubnetId=subnet['SubnetId']),
+                  after=nats_deleted)
+        last.append(key)
+
+    for route_table in resources['RouteTables']:
+        associations = route_table.get('Associations', [])
+        if any(association.get('Main') for association in associations):
+            continue
+        after = []
+        for association in associations:
+            # Deleting a subnet removes its association; disassociating it
+            # as well would race the delete.
+            if association.get('SubnetId') in subnet_ids:
+                after.append('subnet-delete:' + association['SubnetId'])
+                continue
+            key = 'rtb-disassoc:' + association['RouteTableAssociationId']
+            graph.add(key, cirrus.disassociate_route_table, kwargs=dict(
+                common, AssociationId=association['RouteTableAssociationId']))
+            after.append(key)
+        key = 'rtb-delete:' + route_table['RouteTableId']
+        graph.add(key, cirrus.delete_route_table,
+                  kwargs=dict(common, RouteTableId=route_table['RouteTableId']),
+                  after=after)
+        last.append(key)
+
+    for network_acl in resources['NetworkAcls']:
+        if network_acl.get('IsDefault'):
+            continue
+        # Deleting a subnet moves its association back to the default ACL.
+        after = ['subnet-delete:' + association['SubnetId']
+                 for association in network_acl.get('Associations', [])
+                 if association['SubnetId'] in subnet_ids]
+        key = 'acl-delete:' + network_acl['NetworkAclId']
+        graph.add(key, cirrus.delete_network_acl,
+                  kwargs=dict(common, NetworkAclId=network_acl['NetworkAclId']),
+                  after=after)
+        last.append(key)
+
+    graph.add('vpc-delete', cirrus.delete_vpc, kwargs=dict(common, VpcId=vpc_id),
+              after=last)
+    return graph
+
+
+@tracing.traced('teardown.teardown')
+def teardown(vpc_id, client=None, DryRun=False, max_workers=16):
+    '''
+    Deletes a VPC and the NAT gateways, peerings, gateways, subnets, route
+    tables and network ACLs attached to it.
+    :param vpc_id: Id of the VPC.
+    :param client: EC2 client; default client if None.
+    :param DryRun: Passed to every cirrus call.
+    :param max_workers: Number of calls in flight at once.
+    :return: Dictionary of step key to cirrus response; None for steps that
+        failed or were skipped because a step they need failed.
+    '''
+    resources = inventory(vpc_id, client=client)
+    graph = build_graph(vpc_id, resources, client=client, DryRun=DryRun)
+    return dag.execute(graph, max_workers=max_workers)
@@ -0,0 +1,208 @@
+__author__ = 'rafael'
+
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Shared rate limiting and adaptive retry for every cirrus API call.
+
+# EC2 throttles each account and region with token buckets, one for
+# describe (non-mutating) actions and one for mutating actions. The limiter
+# mirrors that: every client gets a describe bucket and a mutate bucket shared
+# by all threads, so concurrent workers stay under the allowed rate instead of
+# tripping it. When EC2 still answers RequestLimitExceeded the call is retried
+# with exponential backoff and full jitter, and the bucket's rate is halved;
+# each success then adds the rate back a little at a time (AIMD).
+#
+# Usage:
+#     from stratus import throttle
+#
+#     throttle.enable(describe_rate=50, mutate_rate=10)   # custom limits
+#     throttle.disable()                                  # no limiting
+
+# Error codes EC2 and other AWS services use for throttling.
+THROTTLE_CODES = {
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+    'RequestThrottled',
+    'TooManyRequestsException',
+}
+
+
+def action_class(operation):
+    '''
+    Returns 'describe' for non-mutating operations and 'mutate' otherwise.
+    :param operation: Client method name, e.g. 'create_route'.
+    :return: (str)
+    '''
+    if operation.startswith(('describe_', 'get_', 'list_')):
+        return 'describe'
+    return 'mutate'
+
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket whose refill rate adapts to throttling.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens, i.e. the burst size.
+        min_rate (float): Lowest rate the bucket backs off to.
+    '''
+
+    def __init__(self, rate, capacity, min_rate=0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Takes one token, sleeping until one is available.
+        :return:
+        '''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def throttled(self):
+        '''
+        Halves the rate and drops the tokens left, after EC2 throttled a call.
+        :return:
+        '''
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+
+    def succeeded(self):
+        '''
+        Grows the rate back towards its configured maximum.
+        :return:
+        '''
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+class AdaptiveLimiter:
+    '''
+    Token buckets per client and action class, plus retries of throttled
+    calls. The defaults follow EC2's documented request token buckets.
+
+    Args:
+        describe_rate (float): Describe calls per second per client.
+        describe_capacity (float): Describe burst size.
+        mutate_rate (float): Mutating calls per second per client.
+        mutate_capacity (float): Mutating burst size.
+        max_retries (int): Retries of a throttled call before giving up.
+        base_delay (float): First backoff delay in seconds.
+        max_delay (float): Longest backoff delay in seconds.
+    '''
+
+    def __init__(self, describe_rate=20, describe_capacity=100, mutate_rate=5,
+                 mutate_capacity=200, max_retries=8, base_delay=0.5, max_delay=20):
+        self.limits = {
+            'describe': (describe_rate, describe_capacity),
+            'mutate': (mutate_rate, mutate_capacity),
+        }
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, client, operation):
+        '''
+        Returns the bucket shared by every call of this action class on this
+        client.
+        :param client: EC2 client.
+        :param operation: Client method name.
+        :return: (TokenBucket)
+        '''
+        key = (id(client), action_class(operation))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(*self.limits[key[1]])
+                    self._buckets[key] = bucket
+        return bucket
+
+    def acquire(self, client, operation):
+        '''
+        Waits for a token without making a call, e.g. before fetching the next
+        page from a paginator.
+        :param client: EC2 client.
+        :param operation: Client method name.
+        :return:
+        '''
+        self.bucket(client, operation).acquire()
+
+    def call(self, client, operation, func):
+        '''
+        Calls func() once a token is available and retries it with backoff
+        while EC2 throttles it.
+        :param client: EC2 client the call is made with.
+        :param operation: Client method name.
+        :param func: Callable making the API call.
+        :return: Response of func().
+        '''
+        bucket = self.bucket(client, operation)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                response = func()
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code not in THROTTLE_CODES or attempt >= self.max_retries:
+                    raise
+                bucket.throttled()
+                with self._lock:
+                    self.throttled += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+                attempt += 1
+                continue
+            bucket.succeeded()
+            return response
+
+
+# Limiter used by cirrus._call; None disables rate limiting.
+active = AdaptiveLimiter()
+
+
+def enable(**kwargs):
+    '''
+    Replaces the shared limiter.
+    :param kwargs: AdaptiveLimiter arguments.
+    :return: (AdaptiveLimiter)
+    '''
+    global active
+    active = AdaptiveLimiter(**kwargs)
+    return active
+
+
+def disable():
+    '''
+    Turns rate limiting and throttling retries off.
+    :return:
+    '''
+    global active
+    active = None
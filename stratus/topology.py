@@ -0,0 +1,216 @@
+__author__ = 'rafael'
+
+from stratus import cirrus
+from stratus import dag
+from stratus import tracing
+from stratus.dag import Ref
+
+# Builds a whole VPC from a declarative topology spec.
+
+# The spec is turned into a dependency graph of cirrus calls and every call
+# runs as soon as the resources it needs exist: all subnets, route tables,
+# network ACLs and the Internet gateways are created at once right after the
+# VPC, then all associations, routes and ACL entries at once.
+#
+# Usage:
+#     from stratus import topology
+#
+#     spec = {
+#         'DryRun': False,
+#         'vpc': {'name': 'main', 'CidrBlock': '10.0.0.0/16'},
+#         'internet_gateways': [{'name': 'main-igw'}],
+#         'subnets': [
+#             {'name': 'web-a', 'CidrBlock': '10.0.0.0/24',
+#              'AvailabilityZone': 'us-east-1a',
+#              'route_table': 'public', 'network_acl': 'web'},
+#             {'name': 'app-a', 'CidrBlock': '10.0.10.0/24',
+#              'AvailabilityZone': 'us-east-1a', 'route_table': 'private-a'},
+#         ],
+#         'nat_gateways': [
+#             {'name': 'nat-a', 'subnet': 'web-a', 'AllocationId': 'eipalloc-?'},
+#         ],
+#         'route_tables': [
+#             {'name': 'public', 'routes': [
+#                 {'DestinationCidrBlock': '0.0.0.0/0', 'internet_gateway': 'main-igw'}]},
+#             {'name': 'private-a', 'routes': [
+#                 {'DestinationCidrBlock': '0.0.0.0/0', 'nat_gateway': 'nat-a'}]},
+#         ],
+#         'network_acls': [
+#             {'name': 'web', 'entries': [
+#                 {'RuleNumber': 100, 'Protocol': '6', 'RuleAction': 'allow',
+#                  'Egress': False, 'CidrBlock': '0.0.0.0/0',
+#                  'PortRange': {'From': 443, 'To': 443}}]},
+#         ],
+#     }
+#     results = topology.apply(spec)
+#
+# Routes name their target with one of internet_gateway, nat_gateway or
+# vpn_gateway (names from the spec) or with a literal EC2 target argument such
+# as VpcPeeringConnectionId.
+
+# Spec keys of route targets: EC2 argument, node prefix, id path in the
+# node's response and, for gateways, the attach node routes have to wait for.
+_ROUTE_TARGETS = {
+    'internet_gateway': ('GatewayId', 'igw:', ('InternetGateway', 'InternetGatewayId'), 'igw-attach:'),
+    'vpn_gateway': ('GatewayId', 'vgw:', ('VpnGateway', 'VpnGatewayId'), 'vgw-attach:'),
+    'nat_gateway': ('NatGatewayId', 'nat:', ('NatGateway', 'NatGatewayId'), None),
+}
+
+
+def _associate_network_acl(client=None, **kwargs):
+    '''
+    Moves a subnet from its current network ACL to another one. EC2 only
+    offers replace_network_acl_association, which needs the id of the
+    subnet's current association.
+    :param kwargs:
+        DryRun=True|False,
+        SubnetId='string',
+        NetworkAclId='string'
+    :return:
+    '''
+    response = cirrus.describe_network_acls(
+        client=client,
+        DryRun=kwargs['DryRun'],
+        Filters=[{'Name': 'association.subnet-id', 'Values': [kwargs['SubnetId']]}]
+    )
+    if response is None:
+        return None
+    for network_acl in response.get('NetworkAcls', []):
+        for association in network_acl.get('Associations', []):
+            if association.get('SubnetId') == kwargs['SubnetId']:
+                return cirrus.replace_network_acl_association(
+                    client=client,
+                    DryRun=kwargs['DryRun'],
+                    AssociationId=association['NetworkAclAssociationId'],
+                    NetworkAclId=kwargs['NetworkAclId']
+                )
+    print('No network ACL association found for {}'.format(kwargs['SubnetId']))
+
+
+def build_graph(spec, client=None):
+    '''
+    Turns a topology spec into a dependency graph of cirrus calls.
+    :param spec: Topology spec, see the module comment.
+    :param client: EC2 client; default client if None.
+    :return: (dag.Graph)
+    '''
+    dry_run = spec.get('DryRun', False)
+    graph = dag.Graph()
+    vpc_id = Ref('vpc', 'Vpc', 'VpcId')
+
+    vpc = dict(spec['vpc'])
+    vpc_name = vpc.pop('name')
+    vpc.setdefault('InstanceTenancy', 'default')
+    vpc.setdefault('AmazonProvidedIpv6CidrBlock', False)
+    graph.add('vpc', cirrus.create_vpc, args=(vpc_name,),
+              kwargs=dict(vpc, client=client, DryRun=dry_run))
+
+    for igw in spec.get('internet_gateways', []):
+        name = igw['name']
+        graph.add('igw:' + name, cirrus.create_internet_gateway, args=(name,),
+                  kwargs={'client': client, 'DryRun': dry_run})
+        graph.add('igw-attach:' + name, cirrus.attach_internet_gateway, kwargs={
+            'client': client,
+            'DryRun': dry_run,
+            'InternetGatewayId': Ref('igw:' + name, 'InternetGateway', 'InternetGatewayId'),
+            'VpcId': vpc_id,
+        })
+
+    for vgw in spec.get('vpn_gateways', []):
+        vgw = dict(vgw)
+        name = vgw.pop('name')
+        vgw.setdefault('Type', 'ipsec.1')
+        graph.add('vgw:' + name, cirrus.create_vpn_gateway, args=(name,),
+                  kwargs=dict(vgw, client=client, DryRun=dry_run))
+        graph.add('vgw-attach:' + name, cirrus.attach_vpn_gateway, kwargs={
+            'client': client,
+            'DryRun': dry_run,
+            'VpnGatewayId': Ref('vgw:' + name, 'VpnGateway', 'VpnGatewayId'),
+            'VpcId': vpc_id,
+        })
+
+    for subnet in spec.get('subnets', []):
+        subnet = dict(subnet)
+        name = subnet.pop('name')
+        route_table = subnet.pop('route_table', None)
+        network_acl = subnet.pop('network_acl', None)
+        subnet_id = Ref('subnet:' + name, 'Subnet', 'SubnetId')
+        graph.add('subnet:' + name, cirrus.create_subnet, args=(name,),
+                  kwargs=dict(subnet, client=client, DryRun=dry_run, VpcId=vpc_id))
+        if route_table:
+            graph.add('rtb-assoc:' + name, cirrus.associate_route_table, kwargs={
+                'client': client,
+                'DryRun': dry_run,
+                'SubnetId': subnet_id,
+                'RouteTableId': Ref('rtb:' + route_table, 'RouteTable', 'RouteTableId'),
+            })
+        if network_acl:
+            graph.add('acl-assoc:' + name, _associate_network_acl, kwargs={
+                'client': client,
+                'DryRun': dry_run,
+                'SubnetId': subnet_id,
+                'NetworkAclId': Ref('acl:' + network_acl, 'NetworkAcl', 'NetworkAclId'),
+            })
+
+    # EC2 refuses a public NAT gateway in a VPC without an attached Internet
+    # gateway.
+    igw_attached = ['igw-attach:' + igw['name'] for igw in spec.get('internet_gateways', [])]
+    for nat in spec.get('nat_gateways', []):
+        nat = dict(nat)
+        name = nat.pop('name')
+        subnet = nat.pop('subnet')
+        graph.add('nat:' + name, cirrus.create_nat_gateway, args=(name,),
+                  kwargs=dict(nat, client=client,
+                              SubnetId=Ref('subnet:' + subnet, 'Subnet', 'SubnetId')),
+                  after=() if nat.get('ConnectivityType') == 'private' else igw_attached)
+
+    for route_table in spec.get('route_tables', []):
+        name = route_table['name']
+        route_table_id = Ref('rtb:' + name, 'RouteTable', 'RouteTableId')
+        graph.add('rtb:' + name, cirrus.create_route_table, args=(name,),
+                  kwargs={'client': client, 'DryRun': dry_run, 'VpcId': vpc_id})
+        for route in route_table.get('routes', []):
+            route = dict(route)
+            after = ()
+            for spec_key, (argument, prefix, path, attach) in _ROUTE_TARGETS.items():
+                if spec_key in route:
+                    target = route.pop(spec_key)
+                    route[argument] = Ref(prefix + target, *path)
+                    if attach:
+                        after = (attach + target,)
+            destination = (route.get('DestinationCidrBlock') or route.get('DestinationIpv6CidrBlock')
+                           or route.get('DestinationPrefixListId'))
+            graph.add('route:{}:{}'.format(name, destination), cirrus.create_route,
+                      kwargs=dict(route, client=client, DryRun=dry_run,
+                                  RouteTableId=route_table_id),
+                      after=after)
+
+    for network_acl in spec.get('network_acls', []):
+        name = network_acl['name']
+        network_acl_id = Ref('acl:' + name, 'NetworkAcl', 'NetworkAclId')
+        graph.add('acl:' + name, cirrus.create_network_acl, args=(name,),
+                  kwargs={'client': client, 'DryRun': dry_run, 'VpcId': vpc_id})
+        for entry in network_acl.get('entries', []):
+            direction = 'egress' if entry['Egress'] else 'ingress'
+            graph.add('acl-entry:{}:{}:{}'.format(name, direction, entry['RuleNumber']),
+                      cirrus.create_network_acl_entry,
+                      kwargs=dict(entry, client=client, DryRun=dry_run,
+                                  NetworkAclId=network_acl_id))
+
+    return graph
+
+
+@tracing.traced('topology.apply')
+def apply(spec, client=None, max_workers=16, journal=None):
+    '''
+    Builds the topology, running independent steps concurrently.
+    :param spec: Topology spec, see the module comment.
+    :param client: EC2 client; default client if None.
+    :param max_workers: Number of calls in flight at once.
+    :param journal: Optional journal.Journal; a rerun with the same journal
+        skips the steps already done and resumes at the first unfinished one.
+    :return: Dictionary of step key to cirrus response; None for steps that
+        failed or were skipped because a step they need failed.
+    '''
+    return dag.execute(build_graph(spec, client=client), max_workers=max_workers,
+                       journal=journal)
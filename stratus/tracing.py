@@ -0,0 +1,427 @@
+__author__ = 'rafael'
+
+import bisect
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Spans of workflow steps and API calls, with a critical-path report.
+
+# While tracing is enabled, every EC2 API call cirrus makes, every dag node,
+# the workflow entry points (topology.apply, teardown.teardown,
+# mesh.build_mesh, the sync functions) and the decorated Azure calls record a
+# span: name, start, end, thread and the span it ran inside. The current span
+# lives in a context variable, and dag, fanout and the other worker pools run
+# their tasks in a copy of the submitting context, so a call made on a worker
+# thread is still the child of the step that issued it. dag nodes also record
+# the nodes they waited for (after).
+#
+# export_chrome() writes the spans as a Chrome trace (chrome://tracing,
+# Perfetto, speedscope). report() shows the critical path of the run, the
+# chain of spans that determined its duration, with the wait before each one
+# (time spent in queues, waiters or serial code rather than in a step), and
+# the parallelism achieved: busy time of the leaf spans over wall time, and
+# the peak number in flight.
+#
+# Usage:
+#     from stratus import topology, tracing
+#
+#     with tracing.tracing() as tracer:
+#         topology.apply(spec)
+#     tracer.export_chrome('build.trace.json')
+#     print(tracer.report())
+
+# One step of a critical path: depth below the root, the span, and the
+# nanoseconds between the end of the previous step (or the start of the
+# parent) and the start of this one.
+PathStep = namedtuple('PathStep', ['depth', 'span', 'wait'])
+
+
+class Span:
+    '''
+    One timed operation. Times are time.perf_counter_ns() values.
+    '''
+
+    __slots__ = ('id', 'parent', 'name', 'category', 'after', 'attributes', 'thread',
+                 'start', 'end', 'error')
+
+    def __init__(self, span_id, parent, name, category, after, attributes):
+        self.id = span_id
+        self.parent = parent
+        self.name = name
+        self.category = category
+        self.after = tuple(after)
+        self.attributes = attributes
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter_ns()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+_current = contextvars.ContextVar('stratus_span', default=None)
+
+
+def current():
+    '''
+    Returns the span the caller runs inside, or None.
+    :return: (Span)
+    '''
+    return _current.get()
+
+
+class Tracer:
+    '''
+    Collects finished spans.
+
+    Attributes:
+        spans (list): Finished spans, in the order they ended.
+    '''
+
+    def __init__(self):
+        self.spans = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, name, category='stratus', after=(), **attributes):
+        '''
+        Starts a span as a child of the current one and makes it current.
+        :return: (span, token) to pass to finish().
+        '''
+        parent = _current.get()
+        span = Span(next(self._ids), parent and parent.id, name, category, after, attributes)
+        return span, _current.set(span)
+
+    def finish(self, span, token, error=None):
+        '''
+        Ends a span and restores the span that was current before it.
+        :return:
+        '''
+        span.end = time.perf_counter_ns()
+        span.error = error
+        _current.reset(token)
+        with self._lock:
+            self.spans.append(span)
+
+    def timed(self, name, category, func, **attributes):
+        '''
+        Wraps func so each call of it is a span; a call that raises records
+        the error.
+        :param func: Callable without arguments.
+        :return: Callable.
+        '''
+        def call():
+            span, token = self.start(name, category, **attributes)
+            error = None
+            try:
+                return func()
+            except Exception as e:
+                error = repr(e)
+                raise
+            finally:
+                self.finish(span, token, error)
+        return call
+
+    def _finished(self):
+        with self._lock:
+            return list(self.spans)
+
+    def export_chrome(self, path):
+        '''
+        Writes the spans as a Chrome trace JSON file.
+        :param path: Output file.
+        :return: Number of spans written.
+        '''
+        spans = self._finished()
+        origin = min((span.start for span in spans), default=0)
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for span in sorted(spans, key=lambda span: span.start):
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            args = dict(span.attributes, span_id=span.id, parent_id=span.parent)
+            if span.after:
+                args['after'] = list(span.after)
+            if span.error:
+                args['error'] = span.error
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': (span.start - origin) / 1e3,
+                'dur': span.duration / 1e3,
+                'pid': pid,
+                'tid': tid,
+                'args': args,
+            })
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                    'args': {'name': 'thread-{}'.format(tid)}}
+                   for tid in threads.values()]
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file,
+                      default=str)
+        return len(spans)
+
+    def critical_path(self, root=None):
+        '''
+        See critical_path().
+        '''
+        return critical_path(self._finished(), root)
+
+    def parallelism(self, root=None):
+        '''
+        See parallelism().
+        '''
+        return parallelism(self._finished(), root)
+
+    def report(self, root=None, top=5):
+        '''
+        See report().
+        '''
+        return report(self._finished(), root, top)
+
+
+def _children(spans):
+    children = {}
+    for span in spans:
+        children.setdefault(span.parent, []).append(span)
+    return children
+
+
+def _root_id(root):
+    return root.id if isinstance(root, Span) else root
+
+
+def critical_path(spans, root=None):
+    '''
+    Finds the chain of spans that determined the duration of a run.
+    Starting from the child that ended last, each step goes back to the span
+    it waited for: the latest of its after spans when it has them (dag
+    nodes), otherwise the sibling that ended last before it started. Each
+    span on the path is expanded the same way into its own children.
+    :param spans: Finished spans.
+    :param root: Span or span id whose children are traced; the top-level
+        spans if None.
+    :return: List of PathStep in start order, children right after their
+        parent.
+    '''
+    children = _children(spans)
+    spans_by_id = {span.id: span for span in spans}
+    path = []
+
+    def walk(parent_id, origin, depth):
+        siblings = children.get(parent_id)
+        if not siblings:
+            return
+        by_name = {span.name: span for span in siblings}
+        by_end = sorted(siblings, key=lambda span: span.end)
+        ends = [span.end for span in by_end]
+        chain = []
+        span = by_end[-1]
+        while span is not None:
+            if span.after:
+                candidates = [by_name[name] for name in span.after if name in by_name]
+                previous = max(candidates, key=lambda other: other.end, default=None)
+            else:
+                position = bisect.bisect_right(ends, span.start)
+                while position and by_end[position - 1] is span:
+                    position -= 1
+                previous = by_end[position - 1] if position else None
+            start = previous.end if previous is not None else origin
+            chain.append(PathStep(depth, span, max(0, span.start - start)))
+            span = previous
+        for step in reversed(chain):
+            path.append(step)
+            walk(step.span.id, step.span.start, depth + 1)
+
+    root_id = _root_id(root)
+    if root_id is None:
+        origin = min((span.start for span in children.get(None, ())), default=0)
+    else:
+        origin = spans_by_id[root_id].start
+    walk(root_id, origin, 0)
+    return path
+
+
+def _subtree(spans, root):
+    root_id = _root_id(root)
+    if root_id is None:
+        return spans
+    children = _children(spans)
+    found = []
+    stack = list(children.get(root_id, ()))
+    while stack:
+        span = stack.pop()
+        found.append(span)
+        stack.extend(children.get(span.id, ()))
+    return found
+
+
+def parallelism(spans, root=None):
+    '''
+    Measures how much work overlapped, from the leaf spans (those without
+    children, usually API calls).
+    :param spans: Finished spans.
+    :param root: Span or span id whose descendants are measured; all spans
+        if None.
+    :return: Dictionary with 'wall', 'busy' (nanoseconds), 'average' (busy
+        over wall), 'peak' (most leaf spans in flight at once) and 'leaves'.
+    '''
+    spans = _subtree(spans, root)
+    if not spans:
+        return {'wall': 0, 'busy': 0, 'average': 0.0, 'peak': 0, 'leaves': 0}
+    parents = {span.parent for span in spans}
+    leaves = [span for span in spans if span.id not in parents]
+    wall = max(span.end for span in spans) - min(span.start for span in spans)
+    busy = sum(span.duration for span in leaves)
+    events = sorted([(span.start, 1) for span in leaves] + [(span.end, -1) for span in leaves])
+    peak = running = 0
+    for _, change in events:
+        running += change
+        peak = max(peak, running)
+    return {'wall': wall, 'busy': busy, 'average': busy / wall if wall else 0.0,
+            'peak': peak, 'leaves': len(leaves)}
+
+
+def report(spans, root=None, top=5):
+    '''
+    Formats the critical path, its longest waits and the parallelism.
+    :param spans: Finished spans.
+    :param root: Span or span id to report on; the whole run if None.
+    :param top: Number of longest waits listed.
+    :return: (str)
+    '''
+    path = critical_path(spans, root)
+    stats = parallelism(spans, root)
+    top_level = [step for step in path if step.depth == 0]
+    length = sum(step.span.duration for step in top_level)
+    waits = sum(step.wait for step in path)
+    lines = ['Critical path: {:.1f} ms in {} steps, {:.1f} ms waiting, {:.1f} ms wall'.format(
+                 length / 1e6, len(top_level), waits / 1e6, stats['wall'] / 1e6),
+             '{:>10} {:>10}  {}'.format('wait ms', 'span ms', 'span')]
+    for step in path:
+        lines.append('{:>10.1f} {:>10.1f}  {}{}{}'.format(
+            step.wait / 1e6, step.span.duration / 1e6, '  ' * step.depth, step.span.name,
+            ' (error)' if step.span.error else ''))
+    longest = sorted((step for step in path if step.wait), key=lambda step: -step.wait)[:top]
+    if longest:
+        lines.append('Longest waits:')
+        lines += ['  {:>8.1f} ms before {}'.format(step.wait / 1e6, step.span.name)
+                  for step in longest]
+    lines.append('Parallelism: {:.1f} average, {} peak, {} calls, {:.1f} ms busy'.format(
+        stats['average'], stats['peak'], stats['leaves'], stats['busy'] / 1e6))
+    return '\n'.join(lines)
+
+
+# Tracer used by cirrus._call, span(), traced() and propagate(); None records
+# nothing.
+active = None
+
+
+def enable():
+    '''
+    Starts tracing into a new Tracer.
+    :return: (Tracer)
+    '''
+    global active
+    active = Tracer()
+    return active
+
+
+def disable():
+    '''
+    Stops tracing.
+    :return: (Tracer) The tracer used, or None.
+    '''
+    global active
+    tracer, active = active, None
+    return tracer
+
+
+@contextmanager
+def tracing():
+    '''
+    Traces the code run inside a with block.
+    :return: (Tracer)
+    '''
+    tracer = enable()
+    try:
+        yield tracer
+    finally:
+        disable()
+
+
+@contextmanager
+def span(name, category='stratus', after=(), **attributes):
+    '''
+    Records the with block as a span while tracing is enabled.
+    :param name: Span name.
+    :param category: Span category, e.g. 'dag' or 'ec2'.
+    :param after: Names of sibling spans this one waited for.
+    :param attributes: Extra values shown with the span.
+    :return: (Span) or None when tracing is disabled.
+    '''
+    tracer = active
+    if tracer is None:
+        yield None
+        return
+    current_span, token = tracer.start(name, category, after, **attributes)
+    error = None
+    try:
+        yield current_span
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        tracer.finish(current_span, token, error)
+
+
+def traced(name=None, category='stratus'):
+    '''
+    Decorator recording each call of a function as a span while tracing is
+    enabled.
+    :param name: Span name; default is the function's qualified name.
+    :param category: Span category.
+    :return: Decorator.
+    '''
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = active
+            if tracer is None:
+                return func(*args, **kwargs)
+            return tracer.timed(span_name, category, lambda: func(*args, **kwargs))()
+        return wrapper
+    return decorator
+
+
+def propagate(func):
+    '''
+    Returns func bound to the caller's context, so a span current when a
+    task is submitted to a worker pool is the parent of the spans the task
+    records. Each call runs in its own copy of that context.
+    :param func: Callable run on another thread.
+    :return: Callable; func itself while tracing is disabled.
+    '''
+    if active is None:
+        return func
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return call
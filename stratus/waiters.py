@@ -0,0 +1,218 @@
+__author__ = 'rafael'
+
+import threading
+import time
+from concurrent.futures import Future
+
+from stratus import cache
+from stratus import cirrus
+
+# Waits for many pending NAT gateways, VPN gateways and VPN connections at once.
+
+# create_nat_gateway, create_vpn_gateway and create_vpn_connection return
+# while the resource is still pending. A MultiWaiter tracks any number of them
+# from a single background thread: on each tick it makes one filtered describe
+# per resource type for all the ids still pending, so waiting for 50 NAT
+# gateways costs one describe per tick instead of 50. The interval between
+# ticks grows exponentially and starts over when new resources are added.
+#
+# Usage:
+#     from stratus import waiters
+#
+#     with waiters.MultiWaiter() as waiter:
+#         futures = [waiter.watch_nat_gateway(nat_id) for nat_id in nat_ids]
+#         nat_gateways = [future.result() for future in futures]
+
+# Per resource type: describe function, filter name, response key, id key,
+# and the states in which waiting succeeds or fails.
+KINDS = {
+    'nat_gateway': {
+        'describe': cirrus.describe_nat_gateways,
+        'filter': 'nat-gateway-id',
+        'result_key': 'NatGateways',
+        'id_key': 'NatGatewayId',
+        'success': {'available'},
+        'failure': {'failed', 'deleting', 'deleted'},
+    },
+    'vpn_gateway': {
+        'describe': cirrus.describe_vpn_gateways,
+        'filter': 'vpn-gateway-id',
+        'result_key': 'VpnGateways',
+        'id_key': 'VpnGatewayId',
+        'success': {'available'},
+        'failure': {'deleting', 'deleted'},
+    },
+    'vpn_connection': {
+        'describe': cirrus.describe_vpn_connections,
+        'filter': 'vpn-connection-id',
+        'result_key': 'VpnConnections',
+        'id_key': 'VpnConnectionId',
+        'success': {'available'},
+        'failure': {'deleting', 'deleted'},
+    },
+}
+
+# Ids per describe call; EC2 caps the values of a filter.
+_BATCH_SIZE = 200
+
+
+class ResourceFailed(Exception):
+    '''
+    Raised by a future when its resource reached a failure state. The
+    resource dictionary is in the resource attribute.
+    '''
+
+    def __init__(self, resource_id, state, resource):
+        super().__init__('{} is {}'.format(resource_id, state))
+        self.resource = resource
+
+
+class _Pending:
+    def __init__(self, resource_id, deadline):
+        self.resource_id = resource_id
+        self.deadline = deadline
+        self.future = Future()
+
+
+class MultiWaiter:
+    '''
+    Resolves one future per pending resource, polling each resource type with
+    batched describes.
+
+    Args:
+        client: EC2 client; default client if None.
+        min_delay (float): First interval between describes, in seconds.
+        max_delay (float): Longest interval between describes.
+        backoff (float): Factor the interval grows by after every tick.
+        timeout (float): Seconds after which a still pending resource fails
+            its future with TimeoutError.
+    '''
+
+    def __init__(self, client=None, min_delay=2, max_delay=30, backoff=1.5, timeout=900):
+        self.client = client
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self.describes = 0
+        self._pending = {kind: {} for kind in KINDS}
+        self._delay = {kind: min_delay for kind in KINDS}
+        self._next_poll = {kind: float('inf') for kind in KINDS}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def watch(self, kind, resource_id):
+        '''
+        Starts waiting for a resource.
+        :param kind: 'nat_gateway', 'vpn_gateway' or 'vpn_connection'.
+        :param resource_id: Id of the resource.
+        :return: (Future) resolving to the resource dictionary once available.
+        '''
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError('MultiWaiter is closed')
+            pending = self._pending[kind].get(resource_id)
+            if pending is None:
+                pending = _Pending(resource_id, time.monotonic() + self.timeout)
+                self._pending[kind][resource_id] = pending
+                self._delay[kind] = self.min_delay
+                self._next_poll[kind] = min(self._next_poll[kind],
+                                            time.monotonic() + self.min_delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='MultiWaiter',
+                                                daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return pending.future
+
+    def watch_nat_gateway(self, nat_gateway_id):
+        return self.watch('nat_gateway', nat_gateway_id)
+
+    def watch_vpn_gateway(self, vpn_gateway_id):
+        return self.watch('vpn_gateway', vpn_gateway_id)
+
+    def watch_vpn_connection(self, vpn_connection_id):
+        return self.watch('vpn_connection', vpn_connection_id)
+
+    def close(self):
+        '''
+        Stops polling; futures still pending are cancelled.
+        :return:
+        '''
+        with self._lock:
+            self._stopped = True
+            for pending in self._pending.values():
+                for item in pending.values():
+                    item.future.cancel()
+                pending.clear()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                due = [kind for kind in KINDS
+                       if self._pending[kind] and self._next_poll[kind] <= now]
+            for kind in due:
+                self._poll(kind)
+            self._wake.clear()
+            with self._lock:
+                waiting = [self._next_poll[kind] for kind in KINDS if self._pending[kind]]
+            if waiting:
+                self._wake.wait(max(0, min(waiting) - time.monotonic()))
+            else:
+                self._wake.wait()
+
+    def _poll(self, kind):
+        spec = KINDS[kind]
+        with self._lock:
+            ids = list(self._pending[kind])
+            self._next_poll[kind] = time.monotonic() + self._delay[kind]
+            self._delay[kind] = min(self.max_delay, self._delay[kind] * self.backoff)
+        found = {}
+        for start in range(0, len(ids), _BATCH_SIZE):
+            values = ids[start:start + _BATCH_SIZE]
+            kwargs = {'Filters': [{'Name': spec['filter'], 'Values': values}]}
+            if kind != 'nat_gateway':
+                kwargs['DryRun'] = False
+            try:
+                with cache.bypass():
+                    response = spec['describe'](client=self.client, **kwargs)
+            except Exception as e:
+                print(e)
+                response = None
+            self.describes += 1
+            # A failed describe is retried on the next tick.
+            for resource in (response or {}).get(spec['result_key'], []):
+                found[resource[spec['id_key']]] = resource
+
+        now = time.monotonic()
+        with self._lock:
+            for resource_id in ids:
+                pending = self._pending[kind].get(resource_id)
+                if pending is None:
+                    continue
+                resource = found.get(resource_id)
+                state = resource and resource.get('State')
+                if state in spec['success']:
+                    pending.future.set_result(resource)
+                elif state in spec['failure']:
+                    pending.future.set_exception(ResourceFailed(resource_id, state, resource))
+                elif now >= pending.deadline:
+                    pending.future.set_exception(TimeoutError(
+                        '{} still pending after {}s'.format(resource_id, self.timeout)))
+                else:
+                    continue
+                del self._pending[kind][resource_id]
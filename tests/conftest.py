@@ -0,0 +1,45 @@
+import pytest
+
+from stratus import cache
+from stratus import cirrus
+from stratus import memory
+from stratus import metrics
+from stratus import plan
+from stratus import throttle
+from stratus import tracing
+
+
+@pytest.fixture
+def ec2():
+    '''
+    A fresh in-memory EC2 backend behind every cirrus call, with a limiter
+    that backs off in milliseconds and the optional layers turned off.
+    '''
+    previous = throttle.active
+    throttle.enable(describe_rate=1000, describe_capacity=1000, mutate_rate=1000,
+                    mutate_capacity=1000, base_delay=0.001, max_delay=0.01)
+    cache.disable()
+    plan.disable()
+    metrics.disable()
+    tracing.disable()
+    backend = memory.install()
+    try:
+        yield backend
+    finally:
+        memory.uninstall()
+        cache.disable()
+        plan.disable()
+        metrics.disable()
+        tracing.disable()
+        throttle.active = previous
+        cirrus.IDEMPOTENT = False
+
+
+@pytest.fixture
+def vpc(ec2):
+    '''
+    Id of a new 10.0.0.0/16 VPC.
+    '''
+    response = cirrus.create_vpc('test', DryRun=False, CidrBlock='10.0.0.0/16',
+                                 InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=False)
+    return response['Vpc']['VpcId']
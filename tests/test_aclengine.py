@@ -0,0 +1,60 @@
+from stratus import aclengine
+
+
+def _acl(entries):
+    return {'NetworkAclId': 'acl-1', 'Entries': entries,
+            'Associations': [{'SubnetId': 'subnet-1'}]}
+
+
+def _entry(rule_number, action, egress=False, protocol='6', ports=None, **cidr):
+    entry = dict(cidr, RuleNumber=rule_number, RuleAction=action, Egress=egress,
+                 Protocol=protocol)
+    if ports:
+        entry['PortRange'] = {'From': ports[0], 'To': ports[1]}
+    return entry
+
+
+DEFAULTS = [
+    _entry(32767, 'deny', protocol='-1', CidrBlock='0.0.0.0/0'),
+    _entry(32768, 'deny', protocol='-1', Ipv6CidrBlock='::/0'),
+    _entry(32767, 'deny', egress=True, protocol='-1', CidrBlock='0.0.0.0/0'),
+]
+
+
+def test_ipv6_rule_does_not_match_ipv4_flows():
+    engine = aclengine.compile_acls([_acl([
+        _entry(50, 'allow', ports=(22, 22), Ipv6CidrBlock='::/0'),
+        _entry(100, 'deny', CidrBlock='0.0.0.0/0'),
+    ] + DEFAULTS)])
+    allowed, rules = engine.evaluate('acl-1', [
+        ('203.0.113.7', '10.0.0.1', 'tcp', 22, 'ingress'),
+        ('2001:db8::7', '10.0.0.1', 'tcp', 22, 'ingress'),
+    ])
+    assert allowed.tolist() == [False, True]
+    assert rules.tolist() == [100, 50]
+
+
+def test_ipv4_rule_does_not_match_mapped_ipv6_flows():
+    engine = aclengine.compile_acls([_acl([_entry(100, 'allow', CidrBlock='0.0.0.0/0')] + DEFAULTS)])
+    allowed, rules = engine.evaluate('acl-1', [('::ffff:203.0.113.7', '10.0.0.1', 'tcp', 80,
+                                                'ingress')])
+    assert allowed.tolist() == [False]
+    assert rules.tolist() == [32768]
+
+
+def test_first_matching_rule_decides_by_direction_and_port():
+    engine = aclengine.compile_acls([_acl([
+        _entry(100, 'allow', ports=(443, 443), CidrBlock='0.0.0.0/0'),
+        _entry(110, 'deny', CidrBlock='203.0.113.0/24'),
+        _entry(120, 'allow', CidrBlock='0.0.0.0/0'),
+        _entry(100, 'allow', egress=True, protocol='17', ports=(53, 53), CidrBlock='10.0.0.0/8'),
+    ] + DEFAULTS)])
+    allowed, rules = engine.evaluate_subnet('subnet-1', [
+        ('203.0.113.7', '10.0.0.1', 'tcp', 443, 'ingress'),
+        ('203.0.113.7', '10.0.0.1', 'tcp', 80, 'ingress'),
+        ('198.51.100.1', '10.0.0.1', 'tcp', 80, 'ingress'),
+        ('10.0.0.1', '10.0.0.2', 'udp', 53, 'egress'),
+        ('10.0.0.1', '8.8.8.8', 'udp', 53, 'egress'),
+    ])
+    assert allowed.tolist() == [True, False, True, True, False]
+    assert rules.tolist() == [100, 110, 120, 100, 32767]
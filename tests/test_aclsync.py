@@ -0,0 +1,68 @@
+from stratus import aclsync
+from stratus import cirrus
+
+ENTRIES = [
+    {'RuleNumber': 100, 'Egress': False, 'Protocol': '6', 'RuleAction': 'allow',
+     'CidrBlock': '0.0.0.0/0', 'PortRange': {'From': 443, 'To': 443}},
+    {'RuleNumber': 110, 'Egress': False, 'Protocol': '6', 'RuleAction': 'allow',
+     'Ipv6CidrBlock': '::/0', 'PortRange': {'From': 443, 'To': 443}},
+    {'RuleNumber': 100, 'Egress': True, 'Protocol': '-1', 'RuleAction': 'allow',
+     'CidrBlock': '0.0.0.0/0'},
+]
+
+
+def _ipv6_acl():
+    response = cirrus.create_vpc('ipv6', DryRun=False, CidrBlock='10.1.0.0/16',
+                                 InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=True)
+    response = cirrus.create_network_acl('acl', DryRun=False, VpcId=response['Vpc']['VpcId'])
+    return response['NetworkAcl']['NetworkAclId']
+
+
+def test_sync_creates_entries_then_is_a_no_op(ec2):
+    network_acl_id = _ipv6_acl()
+    result = aclsync.sync_acls({network_acl_id: ENTRIES})
+    assert result['applied'] == {'create': 3}
+    assert not result['failed']
+    assert aclsync.sync_acls({network_acl_id: ENTRIES})['plan'] == {}
+
+
+def test_prune_leaves_the_ipv4_and_ipv6_default_entries_alone(ec2):
+    network_acl_id = _ipv6_acl()
+    aclsync.sync_acls({network_acl_id: ENTRIES})
+    result = aclsync.sync_acls({network_acl_id: ENTRIES[:1]}, prune=True)
+    assert result['applied'] == {'delete': 2}
+    assert not result['failed']
+    entries = ec2.describe_network_acls(NetworkAclIds=[network_acl_id])['NetworkAcls'][0]['Entries']
+    assert sorted(entry['RuleNumber'] for entry in entries) == [100, 32767, 32767, 32768, 32768]
+
+
+def test_changed_entry_is_replaced_in_place():
+    network_acls = [{'NetworkAclId': 'acl-1', 'Entries': [
+        dict(ENTRIES[0], PortRange={'From': 80, 'To': 80}),
+        {'RuleNumber': 32767, 'Egress': False, 'Protocol': '-1', 'RuleAction': 'deny',
+         'CidrBlock': '0.0.0.0/0'},
+        {'RuleNumber': 32768, 'Egress': False, 'Protocol': '-1', 'RuleAction': 'deny',
+         'Ipv6CidrBlock': '::/0'},
+    ]}]
+    plan = aclsync.plan_entries({'acl-1': ENTRIES[:1]}, network_acls)
+    assert [action for action, _ in plan['acl-1']] == ['replace']
+
+
+def _rules(first, count, egress=False):
+    return [{'RuleNumber': first + index, 'Egress': egress, 'Protocol': '6', 'RuleAction': 'allow',
+             'CidrBlock': '10.{}.0.0/16'.format(index), 'PortRange': {'From': 443, 'To': 443}}
+            for index in range(count)]
+
+
+def test_deletes_come_first_when_creates_would_exceed_the_quota(ec2):
+    network_acl_id = _ipv6_acl()
+    aclsync.sync_acls({network_acl_id: _rules(100, 20) + _rules(100, 2, egress=True)})
+    # New ingress rule numbers need the old ones gone first; egress still fits.
+    result = aclsync.sync_acls({network_acl_id: _rules(200, 20) + _rules(200, 2, egress=True)})
+    assert not result['failed']
+    actions = [(action, kwargs['Egress']) for action, kwargs in result['plan'][network_acl_id]]
+    assert actions == [('delete', False)] * 20 + [('create', False)] * 20 + \
+        [('create', True)] * 2 + [('delete', True)] * 2
+    entries = ec2.describe_network_acls(NetworkAclIds=[network_acl_id])['NetworkAcls'][0]['Entries']
+    assert sorted(entry['RuleNumber'] for entry in entries if entry['RuleNumber'] < 32767) == \
+        sorted(list(range(200, 220)) + [200, 201])
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+from stratus import aio
+
+
+def test_coroutines_and_async_generators(ec2):
+    async def build():
+        vpc = await aio.create_vpc('main', DryRun=False, CidrBlock='10.0.0.0/16',
+                                   InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=False)
+        vpc_id = vpc['Vpc']['VpcId']
+        await asyncio.gather(*(aio.create_subnet('s{}'.format(index), DryRun=False, VpcId=vpc_id,
+                                                 CidrBlock='10.0.{}.0/24'.format(index))
+                               for index in range(5)))
+        return [subnet async for subnet in aio.iter_subnets(PageSize=2)]
+
+    assert len(asyncio.run(build())) == 5
+    assert not hasattr(aio, 'capture_errors')
+
+
+def test_runner_bounds_concurrency():
+    runner = aio.Runner(max_concurrency=2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def work():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+        return True
+
+    async def main():
+        return await asyncio.gather(*(runner.run(work) for _ in range(8)))
+
+    try:
+        assert all(asyncio.run(main()))
+    finally:
+        runner.shutdown()
+    assert max(peak) == 2
+
+
+def _blocking(started, release, ran):
+    def work(name):
+        ran.append(name)
+        started.set()
+        release.wait(5)
+        return name
+    return aio._coroutine(work)
+
+
+def test_configure_lets_waiting_calls_finish_on_the_old_runner():
+    started, release, ran = threading.Event(), threading.Event(), []
+    work = _blocking(started, release, ran)
+
+    async def main():
+        first = asyncio.ensure_future(work('first'))
+        second = asyncio.ensure_future(work('second'))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        aio.configure(max_concurrency=4)
+        release.set()
+        return await asyncio.gather(first, second)
+
+    aio.configure(max_concurrency=1)
+    try:
+        assert asyncio.run(main()) == ['first', 'second']
+    finally:
+        aio.configure()
+
+
+def test_cancelled_waiting_call_never_runs():
+    runner = aio.Runner(max_concurrency=1)
+    started, release, ran = threading.Event(), threading.Event(), []
+
+    def work(name):
+        ran.append(name)
+        if name == 'first':
+            started.set()
+            release.wait(5)
+        return name
+
+    async def main():
+        first = asyncio.ensure_future(runner.run(work, 'first'))
+        waiting = asyncio.ensure_future(runner.run(work, 'waiting'))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        release.set()
+        await first
+        return await asyncio.wait_for(runner.run(work, 'after'), 5)
+
+    try:
+        assert asyncio.run(main()) == 'after'
+    finally:
+        runner.shutdown()
+    assert ran == ['first', 'after']
+
+
+def test_closing_an_async_generator_closes_the_iterator():
+    closed = []
+
+    class Numbers:
+        def __init__(self):
+            self.numbers = iter(range(aio.ITER_BATCH * 3))
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            return next(self.numbers)
+
+        def close(self):
+            closed.append(True)
+
+    async def main():
+        iterator = aio._async_generator(Numbers)()
+        first = await iterator.__anext__()
+        await iterator.aclose()
+        return first
+
+    assert asyncio.run(main()) == 0
+    assert closed == [True]
@@ -0,0 +1,38 @@
+import json
+import sys
+
+import pytest
+
+from stratus import benchmark
+
+
+def test_run_covers_every_scenario():
+    measurements = benchmark.run(subnets=8, vpcs=2, seed=1)
+    assert [m['scenario'] for m in measurements] == list(benchmark.SCENARIOS)
+    assert all(m['calls'] > 0 for m in measurements)
+    assert not benchmark.compare(measurements, measurements)
+
+
+def test_compare_flags_regressions_beyond_the_tolerances():
+    baseline = [{'scenario': 'build', 'calls': 100, 'seconds': 1.0, 'peak_bytes': 2 ** 22}]
+    within = [dict(baseline[0], calls=102, seconds=1.4)]
+    assert benchmark.compare(within, baseline) == []
+    worse = [dict(baseline[0], calls=120, seconds=2.0)]
+    assert benchmark.compare(worse, baseline) == [
+        'build calls: 120 > baseline 100', 'build seconds: 2 > baseline 1']
+
+
+def test_main_fails_on_regression(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'baseline.json'
+    arguments = ['benchmark', '--subnets', '4', '--vpcs', '2']
+    monkeypatch.setattr(sys, 'argv', arguments + ['--save-baseline', str(path)])
+    benchmark.main()
+    baseline = json.loads(path.read_text())
+    for measurement in baseline:
+        measurement['calls'] //= 2
+    path.write_text(json.dumps(baseline))
+    monkeypatch.setattr(sys, 'argv', arguments + ['--baseline', str(path)])
+    with pytest.raises(SystemExit) as exit_info:
+        benchmark.main()
+    assert exit_info.value.code == 1
+    assert 'Regression: build calls' in capsys.readouterr().err
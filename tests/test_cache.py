@@ -0,0 +1,58 @@
+import threading
+
+from stratus import cache
+from stratus import cirrus
+
+
+def test_describe_is_served_from_cache_until_a_mutation(ec2, vpc):
+    cache.enable(ttl=60)
+    for _ in range(3):
+        cirrus.describe_vpcs(DryRun=False, VpcIds=[vpc])
+    assert ec2.calls['describe_vpcs'] == 1
+    cirrus.modify_vpc_attribute(VpcId=vpc, EnableDnsSupport={'Value': True},
+                                EnableDnsHostnames={'Value': True})
+    cirrus.describe_vpcs(DryRun=False, VpcIds=[vpc])
+    assert ec2.calls['describe_vpcs'] == 1
+    cirrus.associate_dhcp_options(DryRun=False, DhcpOptionsId='default', VpcId=vpc)
+    cirrus.describe_vpcs(DryRun=False, VpcIds=[vpc])
+    assert ec2.calls['describe_vpcs'] == 2
+
+
+def test_create_vpc_invalidates_route_tables_and_network_acls(ec2, vpc):
+    cache.enable(ttl=60)
+    before = cirrus.describe_route_tables(DryRun=False, Filters=[])['RouteTables']
+    acls = cirrus.describe_network_acls(DryRun=False, Filters=[])['NetworkAcls']
+    cirrus.create_vpc('other', DryRun=False, CidrBlock='10.1.0.0/16',
+                      InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=False)
+    assert len(cirrus.describe_route_tables(DryRun=False, Filters=[])['RouteTables']) == len(before) + 1
+    assert len(cirrus.describe_network_acls(DryRun=False, Filters=[])['NetworkAcls']) == len(acls) + 1
+
+
+def test_describe_in_flight_during_invalidation_is_not_stored():
+    describe_cache = cache.DescribeCache(ttl=60)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_describe():
+        started.set()
+        release.wait()
+        return {'RouteTables': ['old']}
+
+    thread = threading.Thread(target=describe_cache.get_or_call,
+                              args=('client', 'describe_route_tables', {}, slow_describe))
+    thread.start()
+    started.wait()
+    describe_cache.invalidate('create_route')
+    release.set()
+    thread.join()
+    response = describe_cache.get_or_call('client', 'describe_route_tables', {},
+                                          lambda: {'RouteTables': ['new']})
+    assert response == {'RouteTables': ['new']}
+
+
+def test_bypass_reads_through():
+    describe_cache = cache.DescribeCache(ttl=60)
+    describe_cache.get_or_call('client', 'describe_vpcs', {}, lambda: {'Vpcs': [1]})
+    with cache.bypass():
+        response = describe_cache.get_or_call('client', 'describe_vpcs', {}, lambda: {'Vpcs': [2]})
+    assert response == {'Vpcs': [2]}
+    assert describe_cache.get_or_call('client', 'describe_vpcs', {}, None) == {'Vpcs': [1]}
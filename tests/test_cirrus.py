@@ -0,0 +1,37 @@
+from stratus import cirrus
+
+
+def _public_subnet(vpc):
+    igw_id = cirrus.create_internet_gateway('igw', DryRun=False)['InternetGateway']['InternetGatewayId']
+    cirrus.attach_internet_gateway(DryRun=False, InternetGatewayId=igw_id, VpcId=vpc)
+    return cirrus.create_subnet('public', DryRun=False, VpcId=vpc,
+                                CidrBlock='10.0.0.0/24')['Subnet']['SubnetId']
+
+
+def _nat(subnet_id):
+    return cirrus.create_nat_gateway('nat', SubnetId=subnet_id,
+                                     AllocationId='eipalloc-1')['NatGateway']
+
+
+def test_idempotent_create_returns_the_first_resource(ec2, vpc):
+    cirrus.IDEMPOTENT = True
+    first = cirrus.create_subnet('web', DryRun=False, VpcId=vpc, CidrBlock='10.0.1.0/24')
+    again = cirrus.create_subnet('web', DryRun=False, VpcId=vpc, CidrBlock='10.0.1.0/24')
+    assert again['Subnet']['SubnetId'] == first['Subnet']['SubnetId']
+    assert ec2.calls['create_subnet'] == 1
+
+
+def test_nat_gateway_rebuilt_after_teardown_is_new(ec2, vpc):
+    cirrus.IDEMPOTENT = True
+    subnet_id = _public_subnet(vpc)
+    first = _nat(subnet_id)
+    assert _nat(subnet_id)['NatGatewayId'] == first['NatGatewayId']
+
+    cirrus.delete_nat_gateway(NatGatewayId=first['NatGatewayId'])
+    rebuilt = _nat(subnet_id)
+    assert rebuilt['NatGatewayId'] != first['NatGatewayId']
+    assert rebuilt['State'] not in ('deleting', 'deleted', 'failed')
+    # A retry of the rebuild finds the rebuilt gateway again.
+    assert _nat(subnet_id)['NatGatewayId'] == rebuilt['NatGatewayId']
+    live = [nat for nat in ec2.describe_nat_gateways()['NatGateways'] if nat['State'] != 'deleted']
+    assert len(live) == 1
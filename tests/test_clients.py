@@ -0,0 +1,82 @@
+import threading
+
+from stratus import cirrus
+from stratus import clients
+
+
+def _factory(built):
+    def factory(service, region=None, profile=None, role_arn=None):
+        built.append((service, region, profile, role_arn))
+        return object()
+    return factory
+
+
+def test_one_client_per_region_and_credentials():
+    built = []
+    registry = clients.ClientRegistry(factory=_factory(built))
+    east = registry.get(region='us-east-1')
+    assert registry.get(region='us-east-1') is east
+    assert registry.get(region='us-west-2') is not east
+    assert registry.get(region='us-east-1', role_arn='arn:aws:iam::1:role/r') is not east
+    assert built == [('ec2', 'us-east-1', None, None), ('ec2', 'us-west-2', None, None),
+                     ('ec2', 'us-east-1', None, 'arn:aws:iam::1:role/r')]
+
+
+def test_concurrent_first_use_builds_one_client():
+    built = []
+    registry = clients.ClientRegistry(factory=_factory(built))
+    barrier = threading.Barrier(8)
+    found = []
+
+    def get():
+        barrier.wait()
+        found.append(registry.get(region='eu-west-1'))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1 and len(set(map(id, found))) == 1
+
+
+def test_set_factory_drops_cached_clients():
+    registry = clients.ClientRegistry(factory=_factory([]))
+    first = registry.get()
+    registry.set_factory(_factory([]))
+    assert registry.get() is not first
+
+
+def test_default_client_is_built_on_first_use(ec2):
+    assert cirrus.client is ec2
+    assert clients.get_client() is ec2
+
+
+def test_role_client_assumes_role_on_demand(monkeypatch):
+    import datetime
+    import boto3
+
+    assumed = []
+
+    class STS:
+        def assume_role(self, **kwargs):
+            assumed.append(kwargs)
+            expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+            return {'Credentials': {'AccessKeyId': 'AKIA', 'SecretAccessKey': 'secret',
+                                    'SessionToken': 'token', 'Expiration': expiration}}
+
+    built = []
+    client = boto3.session.Session.client
+
+    def fake_client(self, service, *args, **kwargs):
+        if service == 'sts':
+            return STS()
+        built.append(self)
+        return client(self, service, *args, **kwargs)
+
+    monkeypatch.setattr(boto3.session.Session, 'client', fake_client)
+    clients._boto3_factory('ec2', region='us-east-1', role_arn='arn:aws:iam::1:role/r')
+    assert assumed == []
+    credentials = built[0].get_credentials().get_frozen_credentials()
+    assert credentials.access_key == 'AKIA' and credentials.token == 'token'
+    assert assumed == [{'RoleArn': 'arn:aws:iam::1:role/r', 'RoleSessionName': 'stratus'}]
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from stratus import dag
+
+
+def test_refs_are_resolved_and_become_dependencies():
+    graph = dag.Graph()
+    graph.add('vpc', lambda: {'Vpc': {'VpcId': 'vpc-1'}})
+    graph.add('subnet', lambda VpcId: {'Subnet': {'VpcId': VpcId}},
+              kwargs={'VpcId': dag.Ref('vpc', 'Vpc', 'VpcId')})
+    assert graph.nodes['subnet'].deps == {'vpc'}
+    assert graph.levels() == [['vpc'], ['subnet']]
+    results = dag.execute(graph)
+    assert results['subnet'] == {'Subnet': {'VpcId': 'vpc-1'}}
+
+
+def test_independent_nodes_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    graph = dag.Graph()
+    for index in range(3):
+        graph.add('n{}'.format(index), lambda: barrier.wait() is not None)
+    results = dag.execute(graph, max_workers=3)
+    assert all(results.values())
+
+
+def test_failure_skips_dependents_only():
+    graph = dag.Graph()
+    graph.add('bad', lambda: None)
+    graph.add('child', lambda: 'x', after=['bad'])
+    graph.add('grandchild', lambda: 'x', after=['child'])
+    graph.add('other', lambda: 'ok')
+    results = dag.execute(graph)
+    assert results == {'bad': None, 'child': None, 'grandchild': None, 'other': 'ok'}
+
+
+def test_raising_node_counts_as_failed():
+    graph = dag.Graph()
+    graph.add('boom', lambda: 1 / 0)
+    graph.add('after', lambda: 'x', after=['boom'])
+    assert dag.execute(graph) == {'boom': None, 'after': None}
+
+
+def test_graph_errors():
+    graph = dag.Graph()
+    graph.add('a', lambda: 1, after=['b'])
+    with pytest.raises(ValueError):
+        graph.add('a', lambda: 1)
+    with pytest.raises(ValueError):
+        graph.levels()
+    graph.add('b', lambda: 1, after=['a'])
+    with pytest.raises(ValueError):
+        dag.execute(graph)
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from stratus import cirrus
+from stratus import clients
+from stratus import fanout
+from stratus import memory
+
+
+class _DeniedEC2(memory.MemoryEC2):
+    def __getattribute__(self, name):
+        if name.startswith('describe_'):
+            def denied(**kwargs):
+                raise memory._error(name, 'AccessDenied', 'not authorized')
+            return denied
+        return super().__getattribute__(name)
+
+
+@pytest.fixture
+def regions(ec2):
+    backends = {'us-east-1': memory.MemoryEC2(region='us-east-1'),
+                'eu-west-1': memory.MemoryEC2(region='eu-west-1'),
+                'ap-south-1': _DeniedEC2(region='ap-south-1')}
+    for backend in backends.values():
+        if not isinstance(backend, _DeniedEC2):
+            for index in range(3):
+                backend.create_vpc(CidrBlock='10.{}.0.0/16'.format(index))
+    clients.registry.set_factory(lambda service, region=None, profile=None, role_arn=None:
+                                 backends[region])
+    return [('1', region) for region in backends]
+
+
+def _by_region(results):
+    found = {}
+    for result in results:
+        found.setdefault(result.region, []).append(result)
+    return found
+
+
+def test_iter_results_and_errors_per_target(regions):
+    found = _by_region(fanout.fan_out(cirrus.iter_vpcs, regions))
+    assert len(found['us-east-1']) == 3 and len(found['eu-west-1']) == 3
+    [denied] = found['ap-south-1']
+    assert isinstance(denied.error, ClientError)
+    assert denied.error.response['Error']['Code'] == 'AccessDenied'
+
+
+def test_describe_errors_reach_the_result(regions):
+    found = _by_region(fanout.fan_out(cirrus.describe_vpcs, regions, DryRun=False, VpcIds=['all']))
+    assert len(found['us-east-1'][0].resource['Vpcs']) == 3
+    [denied] = found['ap-south-1']
+    assert denied.resource is None
+    assert denied.error.response['Error']['Code'] == 'AccessDenied'
+
+
+class _FailsOnSecondPage(memory.MemoryEC2):
+    def describe_vpcs(self, **kwargs):
+        if kwargs.get('NextToken'):
+            raise memory._error('describe_vpcs', 'InternalError', 'try again')
+        return super().describe_vpcs(**kwargs)
+
+
+def test_listing_cut_short_ends_with_an_error(ec2):
+    backend = _FailsOnSecondPage()
+    for index in range(8):
+        backend.create_vpc(CidrBlock='10.{}.0.0/16'.format(index))
+    clients.registry.set_factory(lambda service, region=None, profile=None, role_arn=None: backend)
+    results = list(fanout.fan_out(cirrus.iter_vpcs, [('1', 'us-east-1')], PageSize=5))
+    assert [result.error is None for result in results] == [True] * 5 + [False]
+
+
+def test_slow_target_times_out(regions):
+    def describer(client=None, **kwargs):
+        if client.meta.region_name == 'eu-west-1':
+            time.sleep(2)
+        return {'Vpcs': []}
+
+    started = time.monotonic()
+    found = _by_region(fanout.fan_out(describer, regions, timeout=0.3))
+    assert time.monotonic() - started < 1.5
+    [slow] = found['eu-west-1']
+    assert slow.resource is None and isinstance(slow.error, TimeoutError)
+    assert found['us-east-1'][0].error is None
+
+
+def test_targets_run_concurrently(regions):
+    barrier = threading.Barrier(len(regions), timeout=5)
+
+    def describer(client=None, **kwargs):
+        barrier.wait()
+        return {'Vpcs': []}
+
+    results = list(fanout.fan_out(describer, regions, max_workers=len(regions)))
+    assert [result.error for result in results] == [None] * len(regions)
+
+
+def test_time_blocked_on_a_slow_consumer_is_not_timed(ec2):
+    def describer(client=None, **kwargs):
+        return ({'VpcId': str(index)} for index in range(100))
+
+    results = []
+    for result in fanout.fan_out(describer, [('1', 'us-east-1')], max_workers=1, timeout=0.3):
+        results.append(result)
+        time.sleep(0.01)
+    assert len(results) == 100 and all(result.error is None for result in results)
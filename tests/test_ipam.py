@@ -0,0 +1,72 @@
+import pytest
+
+from stratus import cirrus
+from stratus import ipam
+
+
+def test_buddy_allocation_and_merge():
+    pool = ipam.Pool('10.0.0.0/16')
+    first = pool.allocate(24)
+    second = pool.allocate(24)
+    assert (first, second) == ('10.0.0.0/24', '10.0.1.0/24')
+    assert pool.allocate(17) == '10.0.128.0/17'
+    pool.release(first)
+    pool.release(second)
+    pool.release('10.0.128.0/17')
+    assert pool.free_blocks() == ['10.0.0.0/16']
+
+
+def test_reserve_and_exhaustion():
+    pool = ipam.Pool('10.0.0.0/23')
+    assert pool.reserve('10.0.1.0/24')
+    assert not pool.reserve('10.0.1.0/25')
+    assert pool.allocate(24) == '10.0.0.0/24'
+    with pytest.raises(ipam.PoolExhausted):
+        pool.allocate(24)
+    with pytest.raises(ValueError):
+        pool.release('10.0.2.0/24')
+
+
+def test_subnet_pool_includes_secondary_blocks():
+    vpc = {'VpcId': 'vpc-1', 'CidrBlock': '10.0.0.0/24', 'CidrBlockAssociationSet': [
+        {'CidrBlock': '10.0.0.0/24', 'CidrBlockState': {'State': 'associated'}},
+        {'CidrBlock': '100.64.0.0/24', 'CidrBlockState': {'State': 'associated'}},
+        {'CidrBlock': '172.16.0.0/24', 'CidrBlockState': {'State': 'disassociated'}},
+    ]}
+    subnets = [{'VpcId': 'vpc-1', 'CidrBlock': '10.0.0.0/25'},
+               {'VpcId': 'vpc-1', 'CidrBlock': '100.64.0.0/25'}]
+    pool = ipam.subnet_pool(vpc, subnets=subnets)
+    assert pool.allocate(25) == '10.0.0.128/25'
+    assert pool.allocate(25) == '100.64.0.128/25'
+    with pytest.raises(ipam.PoolExhausted):
+        pool.allocate(25)
+    assert not pool.contains('172.16.0.0/25')
+    pool.release('100.64.0.128/25')
+    assert pool.allocate(26) == '100.64.0.128/26'
+
+
+def test_idempotent_retry_keeps_the_existing_block(ec2):
+    cirrus.IDEMPOTENT = True
+    kwargs = dict(DryRun=False, InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=False,
+                  PrefixLength=16)
+    pool = ipam.Pool('10.0.0.0/8')
+    pool.reserve('10.0.0.0/16')
+    first = cirrus.create_vpc('app', Pool=pool, **kwargs)
+    assert first['Vpc']['CidrBlock'] == '10.1.0.0/16'
+
+    # A rerun with a fresh pool allocates 10.0.0.0/16 but finds the VPC.
+    retried = ipam.Pool('10.0.0.0/8')
+    again = cirrus.create_vpc('app', Pool=retried, **kwargs)
+    assert again['Vpc']['VpcId'] == first['Vpc']['VpcId']
+    assert retried.allocated() == ['10.1.0.0/16']
+    assert retried.allocate(16) == '10.0.0.0/16'
+
+
+def test_allocation_errors_are_printed_and_return_none(ec2, vpc, capsys):
+    pool = ipam.Pool('10.0.0.0/24')
+    pool.allocate(24)
+    assert cirrus.create_subnet('a', DryRun=False, VpcId=vpc, Pool=pool, PrefixLength=24) is None
+    assert cirrus.create_vpc('b', DryRun=False, InstanceTenancy='default',
+                             AmazonProvidedIpv6CidrBlock=False, Pool='missing', PrefixLength=16) is None
+    assert 'no free /24' in capsys.readouterr().out
+    assert ec2.calls['create_subnet'] == 0 and ec2.calls['create_vpc'] == 1
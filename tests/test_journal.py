@@ -0,0 +1,100 @@
+import json
+from collections import Counter
+
+import pytest
+
+from stratus import benchmark
+from stratus import clients
+from stratus import dag
+from stratus import journal
+from stratus import memory
+from stratus import plan
+from stratus import topology
+
+
+def test_completed_steps_are_skipped_on_resume(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    calls = []
+
+    def create(name):
+        calls.append(name)
+        return {'Id': name}
+
+    with journal.Journal(path) as run:
+        assert run.step('a', create, 'one') == {'Id': 'one'}
+    with journal.Journal(path) as run:
+        assert run.step('a', create, 'one') == {'Id': 'one'}
+        assert run.step('a', create, 'two') == {'Id': 'two'}
+        assert run.skipped == 1
+    assert calls == ['one', 'two']
+
+
+def test_failed_and_unfinished_steps_run_again(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    with journal.Journal(path) as run:
+        assert run.step('a', lambda: None) is None
+    with open(path, 'a') as journal_file:
+        journal_file.write(json.dumps({'key': 'b', 'state': 'started', 'fingerprint': 'x'}) + '\n')
+    with journal.Journal(path) as run:
+        assert 'a' not in run
+        assert run.in_doubt() == ['b']
+
+
+def test_truncated_record_is_dropped_on_reopen(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    with journal.Journal(path) as run:
+        run.step('a', lambda: {'Id': 'a'})
+    with open(path, 'a') as journal_file:
+        journal_file.write('{"key": "b", "state": "do')
+    with journal.Journal(path) as run:
+        run.step('c', lambda: {'Id': 'c'})
+    with journal.Journal(path) as run:
+        assert 'a' in run and 'c' in run
+    with open(path) as journal_file:
+        assert all(json.loads(line) for line in journal_file)
+
+
+def test_plan_mode_is_not_journaled(tmp_path):
+    graph = dag.Graph()
+    graph.add('a', lambda: {'Id': 'a'})
+    with journal.Journal(str(tmp_path / 'run.journal')) as run:
+        with plan.recording():
+            with pytest.raises(RuntimeError):
+                dag.execute(graph, journal=run)
+            with pytest.raises(RuntimeError):
+                run.step('a', lambda: {'Id': 'a'})
+        assert not run.completed
+
+
+class _KilledOnSubnets(memory.MemoryEC2):
+    kill = True
+
+    def create_subnet(self, **kwargs):
+        if self.kill:
+            raise KeyboardInterrupt
+        return super().create_subnet(**kwargs)
+
+
+def test_killed_build_resumes_at_the_first_unfinished_step(ec2, tmp_path):
+    backend = _KilledOnSubnets()
+    clients.registry.set_factory(lambda service, region=None, profile=None, role_arn=None: backend)
+    spec = benchmark.topology_spec(2)
+    path = str(tmp_path / 'build.journal')
+    with journal.Journal(path) as run:
+        with pytest.raises(KeyboardInterrupt):
+            topology.apply(spec, journal=run, max_workers=1)
+
+    backend.kill = False
+    before = Counter(backend.calls)
+    with journal.Journal(path) as run:
+        done = dict(run.completed)
+        # Killed steps stay in doubt instead of being recorded as failed.
+        assert sorted(run.in_doubt()) == ['subnet:subnet-0', 'subnet:subnet-1']
+        assert 'vpc' in done and 'igw-attach:igw' in done
+        results = topology.apply(spec, journal=run, max_workers=1)
+        assert run.skipped == len(done)
+    assert all(response is not None for response in results.values())
+    assert all(results[key] == response for key, (_, response) in done.items())
+    calls = backend.calls - before
+    assert calls['create_vpc'] == 0 and calls['create_subnet'] == 2
+    assert len(backend.describe_vpcs()['Vpcs']) == 1
@@ -0,0 +1,61 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from stratus import memory
+
+
+@pytest.fixture
+def backend():
+    return memory.MemoryEC2()
+
+
+def _vpc(backend, **kwargs):
+    return backend.create_vpc(CidrBlock='10.0.0.0/16', **kwargs)['Vpc']['VpcId']
+
+
+def test_public_nat_gateway_needs_an_attached_internet_gateway(backend):
+    vpc_id = _vpc(backend)
+    subnet_id = backend.create_subnet(VpcId=vpc_id, CidrBlock='10.0.0.0/24')['Subnet']['SubnetId']
+    with pytest.raises(ClientError) as error:
+        backend.create_nat_gateway(SubnetId=subnet_id, AllocationId='eipalloc-1')
+    assert error.value.response['Error']['Code'] == 'Gateway.NotAttached'
+    backend.create_nat_gateway(SubnetId=subnet_id, ConnectivityType='private')
+    igw_id = backend.create_internet_gateway()['InternetGateway']['InternetGatewayId']
+    backend.attach_internet_gateway(InternetGatewayId=igw_id, VpcId=vpc_id)
+    backend.create_nat_gateway(SubnetId=subnet_id, AllocationId='eipalloc-1')
+
+
+def test_describe_pages_with_next_token(backend):
+    for index in range(7):
+        _vpc(backend)
+    assert backend.can_paginate('describe_vpcs')
+    assert not backend.can_paginate('describe_vpn_gateways')
+    first = backend.describe_vpcs(MaxResults=5)
+    second = backend.describe_vpcs(MaxResults=5, NextToken=first['NextToken'])
+    assert len(first['Vpcs']) == 5
+    assert len(second['Vpcs']) == 2
+    assert 'NextToken' not in second
+    with pytest.raises(ClientError):
+        backend.describe_vpcs(MaxResults=5, VpcIds=[first['Vpcs'][0]['VpcId']])
+
+
+def test_ipv6_vpc_acls_have_both_default_denies(backend):
+    vpc_id = _vpc(backend, AmazonProvidedIpv6CidrBlock=True)
+    network_acl = backend.create_network_acl(VpcId=vpc_id)['NetworkAcl']
+    assert sorted(entry['RuleNumber'] for entry in network_acl['Entries']) == [32767, 32767,
+                                                                               32768, 32768]
+    with pytest.raises(ClientError):
+        backend.delete_network_acl_entry(NetworkAclId=network_acl['NetworkAclId'],
+                                         RuleNumber=32768, Egress=True)
+
+
+def test_throttling_and_dry_run(backend):
+    backend.throttle_rate = 1.0
+    with pytest.raises(ClientError) as error:
+        backend.describe_vpcs()
+    assert error.value.response['Error']['Code'] == 'RequestLimitExceeded'
+    backend.throttle_rate = 0.0
+    with pytest.raises(ClientError) as error:
+        backend.create_vpc(CidrBlock='10.0.0.0/16', DryRun=True)
+    assert error.value.response['Error']['Code'] == 'DryRunOperation'
+    assert backend.throttled == 1
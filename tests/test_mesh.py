@@ -0,0 +1,70 @@
+from stratus import cirrus
+from stratus import clients
+from stratus import memory
+from stratus import mesh
+
+
+def _vpcs(count):
+    vpc_ids = []
+    for index in range(count):
+        response = cirrus.create_vpc('mesh-{}'.format(index), DryRun=False,
+                                     CidrBlock='10.{}.0.0/16'.format(index),
+                                     InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=False)
+        vpc_ids.append(response['Vpc']['VpcId'])
+    return vpc_ids
+
+
+def _routes(ec2, vpc_id):
+    route_tables = ec2.describe_route_tables(
+        Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])['RouteTables']
+    return {route['DestinationCidrBlock']: route
+            for route_table in route_tables for route in route_table['Routes']}
+
+
+def test_mesh_peers_and_routes_every_pair(ec2):
+    vpc_ids = _vpcs(3)
+    result = mesh.build_mesh(vpc_ids)
+    assert not result['failed']
+    assert result['requested'] == result['accepted'] == 3
+    assert result['routes'] == 6
+    routes = _routes(ec2, vpc_ids[0])
+    assert routes['10.1.0.0/16']['VpcPeeringConnectionId']
+    assert routes['10.2.0.0/16']['VpcPeeringConnectionId']
+
+    again = mesh.build_mesh(vpc_ids)
+    assert (again['requested'], again['accepted'], again['routes']) == (0, 0, 0)
+
+
+def test_routes_to_other_targets_are_reported_not_replaced(ec2):
+    vpc_ids = _vpcs(2)
+    igw_id = cirrus.create_internet_gateway('igw', DryRun=False)['InternetGateway']['InternetGatewayId']
+    cirrus.attach_internet_gateway(DryRun=False, InternetGatewayId=igw_id, VpcId=vpc_ids[0])
+    route_table_id = ec2.describe_route_tables(
+        Filters=[{'Name': 'vpc-id', 'Values': [vpc_ids[0]]}])['RouteTables'][0]['RouteTableId']
+    cirrus.create_route(DryRun=False, RouteTableId=route_table_id,
+                        DestinationCidrBlock='10.1.0.0/16', GatewayId=igw_id)
+
+    result = mesh.build_mesh(vpc_ids)
+    assert result['conflicts'] == [(route_table_id, '10.1.0.0/16', igw_id)]
+    assert _routes(ec2, vpc_ids[0])['10.1.0.0/16']['GatewayId'] == igw_id
+    assert _routes(ec2, vpc_ids[1])['10.0.0.0/16']['VpcPeeringConnectionId']
+
+
+class _RefusingEC2(memory.MemoryEC2):
+    def accept_vpc_peering_connection(self, VpcPeeringConnectionId, **kwargs):
+        raise memory._error('accept_vpc_peering_connection', 'OperationNotPermitted',
+                            'not the accepter')
+
+
+def test_unaccepted_peering_is_deleted(ec2, monkeypatch):
+    monkeypatch.setattr(mesh, '_ACCEPT_ATTEMPTS', 2)
+    monkeypatch.setattr(mesh, '_ACCEPT_DELAY', 0)
+    backend = _RefusingEC2()
+    clients.registry.set_factory(lambda service, region=None, profile=None, role_arn=None: backend)
+    vpc_ids = _vpcs(2)
+    result = mesh.build_mesh(vpc_ids)
+    assert result['failed'] == [tuple(sorted(vpc_ids))]
+    assert not result['connections'] and not result['orphaned']
+    statuses = [pcx['Status']['Code'] for pcx in
+                backend.describe_vpc_peering_connections()['VpcPeeringConnections']]
+    assert statuses == ['deleted']
@@ -0,0 +1,63 @@
+import time
+
+from stratus import cirrus
+from stratus import clients
+from stratus import memory
+from stratus import metrics
+from stratus import throttle
+
+
+def test_histogram_percentiles_stay_within_bucket_precision():
+    histogram = metrics.Histogram()
+    for value in range(1, 10001):
+        histogram.record(value * 1000)
+    assert histogram.count == 10000
+    assert histogram.min == 1000 and histogram.max == 10000000
+    for percent in (50, 90, 99):
+        exact = percent * 100 * 1000
+        assert abs(histogram.percentile(percent) - exact) <= exact * 0.04
+
+
+def test_instrument_counts_returned_failures():
+    collector = metrics.enable()
+    try:
+        @metrics.instrument(operation='deploy', target=lambda name: name,
+                            failed=lambda result: result is None)
+        def deploy(name):
+            return None if name == 'bad' else name
+
+        deploy('good')
+        deploy('bad')
+        series = {entry['target']: entry for entry in collector.snapshot()}
+        assert (series['good']['calls'], series['good']['errors']) == (1, 0)
+        assert (series['bad']['calls'], series['bad']['errors']) == (1, 1)
+    finally:
+        metrics.disable()
+
+
+class _ThrottledOnceEC2(memory.MemoryEC2):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.attempts = 0
+
+    def describe_vpcs(self, **kwargs):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise memory._error('describe_vpcs', 'RequestLimitExceeded', 'slow down')
+        return super().describe_vpcs(**kwargs)
+
+
+def test_each_attempt_is_timed_without_backoff(ec2, monkeypatch):
+    backend = _ThrottledOnceEC2()
+    clients.registry.set_factory(
+        lambda service, region=None, profile=None, role_arn=None: backend)
+    throttle.enable(describe_rate=1000, describe_capacity=1000, base_delay=0.2, max_delay=0.2)
+    monkeypatch.setattr(throttle.random, 'uniform', lambda low, high: high)
+    collector = metrics.enable()
+    start = time.perf_counter()
+    assert list(cirrus.iter_vpcs()) == []
+    elapsed = time.perf_counter() - start
+    series = next(entry for entry in collector.snapshot() if entry['operation'] == 'describe_vpcs')
+    assert (series['calls'], series['errors']) == (2, 1)
+    assert elapsed >= 0.2
+    assert series['seconds'] < 0.1
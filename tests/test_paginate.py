@@ -0,0 +1,70 @@
+import botocore.session
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from stratus import cirrus
+from stratus import metrics
+from stratus import throttle
+
+
+def _subnets(vpc, count):
+    for index in range(count):
+        cirrus.create_subnet('subnet-{}'.format(index), DryRun=False, VpcId=vpc,
+                             CidrBlock='10.0.{}.0/24'.format(index))
+
+
+def test_every_page_is_one_call(ec2, vpc):
+    _subnets(vpc, 12)
+    assert len(list(cirrus.iter_subnets(PageSize=5))) == 12
+    assert ec2.calls['describe_subnets'] == 3
+
+
+def test_ids_are_fetched_without_max_results(ec2, vpc):
+    _subnets(vpc, 2)
+    subnet_ids = [subnet['SubnetId'] for subnet in cirrus.iter_subnets()]
+    assert len(list(cirrus.iter_subnets(PageSize=5, SubnetIds=subnet_ids))) == 2
+
+
+def test_throttled_pages_are_retried(ec2, vpc):
+    _subnets(vpc, 30)
+    ec2._random.seed(1)
+    ec2.throttle_rate = 0.5
+    subnets = list(cirrus.iter_subnets(PageSize=5))
+    assert len(subnets) == 30
+    assert ec2.throttled
+
+
+def test_page_failing_after_retries_raises(ec2, vpc):
+    _subnets(vpc, 3)
+    throttle.enable(describe_rate=1000, describe_capacity=1000, max_retries=1,
+                    base_delay=0.001, max_delay=0.001)
+    ec2.throttle_rate = 1.0
+    with pytest.raises(ClientError):
+        list(cirrus.iter_subnets(PageSize=5))
+
+
+def test_pages_are_timed(ec2, vpc):
+    _subnets(vpc, 3)
+    collector = metrics.enable()
+    list(cirrus.iter_subnets(PageSize=5))
+    operations = {series['operation'] for series in collector.snapshot()}
+    assert 'describe_subnets' in operations
+
+
+def _client():
+    return botocore.session.get_session().create_client(
+        'ec2', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+
+
+def test_iter_walks_every_page():
+    client = _client()
+    with Stubber(client) as stubber:
+        stubber.add_response('describe_subnets', {
+            'Subnets': [{'SubnetId': 'subnet-1'}, {'SubnetId': 'subnet-2'}], 'NextToken': 'page-2'},
+            {'MaxResults': 5})
+        stubber.add_response('describe_subnets', {'Subnets': [{'SubnetId': 'subnet-3'}]},
+                             {'MaxResults': 5, 'NextToken': 'page-2'})
+        subnets = [subnet['SubnetId'] for subnet in cirrus.iter_subnets(PageSize=5, client=client)]
+        stubber.assert_no_pending_responses()
+    assert subnets == ['subnet-1', 'subnet-2', 'subnet-3']
@@ -0,0 +1,52 @@
+from stratus import cirrus
+from stratus import dag
+from stratus import ipam
+from stratus import plan
+
+
+def _vpc(name, **kwargs):
+    return cirrus.create_vpc(name, DryRun=False, InstanceTenancy='default',
+                             AmazonProvidedIpv6CidrBlock=False, **kwargs)
+
+
+def test_calls_are_recorded_not_made(ec2):
+    with plan.recording() as recorded:
+        vpc_id = _vpc('planned', CidrBlock='10.0.0.0/16')['Vpc']['VpcId']
+        cirrus.create_subnet('web', DryRun=False, VpcId=vpc_id, CidrBlock='10.0.0.0/24')
+    assert vpc_id.startswith('vpc-plan')
+    assert not ec2.describe_vpcs()['Vpcs']
+    assert recorded.counts()['create_subnet'] == 1
+    assert recorded.steps[-1].depends_on == [0]
+    assert recorded.depth() == 2
+
+
+def test_planning_leaves_pools_alone(ec2):
+    pool = ipam.Pool('10.0.0.0/8')
+    with plan.recording():
+        first = _vpc('a', Pool=pool, PrefixLength=16)['Vpc']['CidrBlock']
+        second = _vpc('b', Pool=pool, PrefixLength=16)['Vpc']['CidrBlock']
+    assert (first, second) == ('10.0.0.0/16', '10.1.0.0/16')
+    assert pool.allocated() == []
+    assert _vpc('real', Pool=pool, PrefixLength=16)['Vpc']['CidrBlock'] == '10.0.0.0/16'
+
+
+def test_depth_follows_after_ordering(ec2):
+    graph = dag.Graph()
+    graph.add('vpc', _vpc, args=('main',), kwargs={'CidrBlock': '10.0.0.0/16'})
+    graph.add('igw', cirrus.create_internet_gateway, args=('igw',), kwargs={'DryRun': False})
+    graph.add('igw-attach', cirrus.attach_internet_gateway, kwargs={
+        'DryRun': False, 'VpcId': dag.Ref('vpc', 'Vpc', 'VpcId'),
+        'InternetGatewayId': dag.Ref('igw', 'InternetGateway', 'InternetGatewayId')})
+    # The route only references the gateway, but has to wait for the attach.
+    graph.add('route', cirrus.create_route, kwargs={
+        'DryRun': False, 'RouteTableId': 'rtb-existing', 'DestinationCidrBlock': '0.0.0.0/0',
+        'GatewayId': dag.Ref('igw', 'InternetGateway', 'InternetGatewayId')},
+        after=['igw-attach'])
+    with plan.recording() as recorded:
+        results = dag.execute(graph)
+    assert all(response is not None for response in results.values())
+    route = next(step for step in recorded.steps if step.operation == 'create_route')
+    attach = next(step for step in recorded.steps if step.operation == 'attach_internet_gateway')
+    assert attach.index in route.depends_on
+    assert route.level == attach.level + 1
+    assert recorded.depth() == len(graph.levels())
@@ -0,0 +1,56 @@
+import botocore.session
+from botocore.stub import Stubber
+
+from stratus import routeindex
+
+
+def _table(route_table_id, routes, subnets=(), main=False):
+    associations = [{'SubnetId': subnet_id} for subnet_id in subnets]
+    if main:
+        associations.append({'Main': True})
+    return {'RouteTableId': route_table_id, 'VpcId': 'vpc-1', 'Routes': routes,
+            'Associations': associations}
+
+
+def test_longest_prefix_wins_per_family():
+    index = routeindex.RouteIndex(prefix_lists={'pl-1': ['192.0.2.0/24']})
+    index.add_route_table(_table('rtb-1', [
+        {'DestinationCidrBlock': '10.0.0.0/16', 'GatewayId': 'local'},
+        {'DestinationCidrBlock': '0.0.0.0/0', 'NatGatewayId': 'nat-1'},
+        {'DestinationCidrBlock': '10.0.5.0/24', 'VpcPeeringConnectionId': 'pcx-1'},
+        {'DestinationPrefixListId': 'pl-1', 'VpcEndpointId': 'vpce-1'},
+        {'DestinationIpv6CidrBlock': '::/0', 'EgressOnlyInternetGatewayId': 'eigw-1'},
+    ], subnets=['subnet-a']))
+    routes = index.lookup_many([('subnet-a', '10.0.5.9'), ('subnet-a', '10.0.6.9'),
+                                ('subnet-a', '8.8.8.8'), ('subnet-a', '192.0.2.1'),
+                                ('subnet-a', '2001:db8::1')])
+    assert [_target(route) for route in routes] == ['pcx-1', 'local', 'nat-1', 'vpce-1', 'eigw-1']
+
+
+def _target(route):
+    return next(value for key, value in route.items() if key.endswith('Id')
+                and not key.startswith('Destination'))
+
+
+def test_unassociated_subnets_use_the_main_table():
+    index = routeindex.RouteIndex()
+    index.add_route_table(_table('rtb-main', [
+        {'DestinationCidrBlock': '10.0.0.0/16', 'GatewayId': 'local'}], main=True))
+    index.add_subnet({'SubnetId': 'subnet-b', 'VpcId': 'vpc-1'})
+    assert index.route_table_for('subnet-b') == 'rtb-main'
+    assert index.lookup('subnet-b', '10.0.1.1')['GatewayId'] == 'local'
+    assert index.lookup('subnet-b', '8.8.8.8') is None
+    assert index.lookup('subnet-unknown', '10.0.1.1') is None
+
+
+def test_load_reads_route_tables_and_subnets():
+    client = botocore.session.get_session().create_client(
+        'ec2', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    request = {'Filters': [{'Name': 'vpc-id', 'Values': ['vpc-1']}], 'MaxResults': 100}
+    with Stubber(client) as stubber:
+        stubber.add_response('describe_route_tables', {'RouteTables': [_table('rtb-main', [
+            {'DestinationCidrBlock': '10.0.0.0/16', 'GatewayId': 'local'}], main=True)]}, request)
+        stubber.add_response('describe_subnets', {'Subnets': [
+            {'SubnetId': 'subnet-web', 'VpcId': 'vpc-1', 'CidrBlock': '10.0.1.0/24'}]}, request)
+        index = routeindex.load(client=client, vpc_ids=['vpc-1'])
+    assert index.lookup('subnet-web', '10.0.200.1')['GatewayId'] == 'local'
@@ -0,0 +1,92 @@
+import botocore.session
+from botocore.stub import Stubber
+
+from stratus import routesync
+
+
+def _table(routes):
+    return {'RouteTableId': 'rtb-1', 'Routes': [
+        {'DestinationCidrBlock': '10.0.0.0/16', 'GatewayId': 'local', 'Origin': 'CreateRouteTable'},
+        {'DestinationCidrBlock': '172.16.0.0/16', 'GatewayId': 'vgw-1',
+         'Origin': 'EnableVgwRoutePropagation'},
+    ] + routes}
+
+
+def test_plan_creates_replaces_and_prunes():
+    current = _table([
+        {'DestinationCidrBlock': '0.0.0.0/0', 'NatGatewayId': 'nat-old', 'Origin': 'CreateRoute'},
+        {'DestinationCidrBlock': '10.9.0.0/16', 'TransitGatewayId': 'tgw-1', 'Origin': 'CreateRoute'},
+        {'DestinationCidrBlock': '10.8.0.0/16', 'TransitGatewayId': 'tgw-1', 'Origin': 'CreateRoute'},
+    ])
+    desired = {'rtb-1': [
+        {'DestinationCidrBlock': '0.0.0.0/0', 'NatGatewayId': 'nat-new'},
+        {'DestinationCidrBlock': '10.8.0.0/16', 'TransitGatewayId': 'tgw-1'},
+        {'DestinationIpv6CidrBlock': '::/0', 'EgressOnlyInternetGatewayId': 'eigw-1'},
+        {'DestinationCidrBlock': '10.0.0.0/16', 'GatewayId': 'igw-1'},
+    ]}
+    changes = routesync.plan_routes(desired, [current])
+    assert changes == [
+        ('replace', {'RouteTableId': 'rtb-1', 'DestinationCidrBlock': '0.0.0.0/0',
+                     'NatGatewayId': 'nat-new'}),
+        ('create', {'RouteTableId': 'rtb-1', 'DestinationIpv6CidrBlock': '::/0',
+                    'EgressOnlyInternetGatewayId': 'eigw-1'}),
+        ('delete', {'RouteTableId': 'rtb-1', 'DestinationCidrBlock': '10.9.0.0/16'}),
+    ]
+    assert not any(change[0] == 'delete' for change in
+                   routesync.plan_routes(desired, [current], prune=False))
+
+
+def test_aggregate_prefixes():
+    assert routesync.aggregate_prefixes(
+        ['10.8.1.0/24', '10.8.0.0/24', '10.8.0.128/25', '2001:db8::/33', '2001:db8:8000::/33',
+         '172.16.0.0/16']) == ['10.8.0.0/23', '172.16.0.0/16', '2001:db8::/32']
+
+
+def test_plan_vpn_routes():
+    connection = {'VpnConnectionId': 'vpn-1', 'Routes': [
+        {'DestinationCidrBlock': '10.8.0.0/23', 'State': 'available'},
+        {'DestinationCidrBlock': '192.168.0.0/24', 'State': 'available'},
+        {'DestinationCidrBlock': '192.168.9.0/24', 'State': 'deleted'},
+    ]}
+    changes = routesync.plan_vpn_routes(
+        {'vpn-1': ['10.8.0.0/24', '10.8.1.0/24', '172.16.0.0/16']}, [connection])
+    assert changes == [
+        ('create-vpn-route', {'VpnConnectionId': 'vpn-1', 'DestinationCidrBlock': '172.16.0.0/16'}),
+        ('delete-vpn-route', {'VpnConnectionId': 'vpn-1', 'DestinationCidrBlock': '192.168.0.0/24'}),
+    ]
+
+
+def test_sync_routes_converges():
+    client = botocore.session.get_session().create_client(
+        'ec2', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    route = {'DestinationCidrBlock': '0.0.0.0/0', 'GatewayId': 'igw-1'}
+    desired = {'rtb-1': [route]}
+    with Stubber(client) as stubber:
+        stubber.add_response('describe_route_tables', {'RouteTables': [_table([])]})
+        stubber.add_response('create_route', {'Return': True},
+                             dict(route, RouteTableId='rtb-1', DryRun=False))
+        stubber.add_response('describe_route_tables', {'RouteTables': [
+            _table([dict(route, Origin='CreateRoute')])]})
+        result = routesync.sync_routes(desired, client=client)
+        assert result['applied'] == {'create': 1} and not result['failed']
+        assert routesync.sync_routes(desired, client=client)['changes'] == []
+        stubber.assert_no_pending_responses()
+
+
+def test_sync_vpn_routes_applies_the_aggregated_routes(ec2):
+    cgw = ec2.create_customer_gateway(BgpAsn=65000, Type='ipsec.1', PublicIp='203.0.113.1')
+    vgw = ec2.create_vpn_gateway(Type='ipsec.1')
+    vpn_connection_id = ec2.create_vpn_connection(
+        Type='ipsec.1', CustomerGatewayId=cgw['CustomerGateway']['CustomerGatewayId'],
+        VpnGatewayId=vgw['VpnGateway']['VpnGatewayId'])['VpnConnection']['VpnConnectionId']
+    for prefix in ('10.1.0.0/24', '10.9.0.0/16'):
+        ec2.create_vpn_connection_route(VpnConnectionId=vpn_connection_id, DestinationCidrBlock=prefix)
+
+    desired = {vpn_connection_id: ['10.1.0.0/24', '10.1.1.0/24', '10.2.0.0/16', '10.2.3.0/24']}
+    result = routesync.sync_vpn_routes(desired)
+    assert not result['failed']
+    assert result['applied'] == {'create-vpn-route': 2, 'delete-vpn-route': 2}
+    connection = ec2.describe_vpn_connections(VpnConnectionIds=[vpn_connection_id])['VpnConnections'][0]
+    assert sorted(route['DestinationCidrBlock'] for route in connection['Routes']) == \
+        ['10.1.0.0/23', '10.2.0.0/16']
+    assert routesync.sync_vpn_routes(desired)['changes'] == []
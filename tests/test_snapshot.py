@@ -0,0 +1,41 @@
+from stratus import cirrus
+from stratus import clients
+from stratus import memory
+from stratus import snapshot
+
+
+class _FailsOnSubnets(memory.MemoryEC2):
+    def describe_subnets(self, **kwargs):
+        raise memory._error('describe_subnets', 'UnauthorizedOperation', 'denied')
+
+
+def test_export_and_read_back(ec2, vpc, tmp_path):
+    cirrus.create_subnet('a', DryRun=False, VpcId=vpc, CidrBlock='10.0.0.0/24')
+    path = str(tmp_path / 'estate.jsonl.gz')
+    counts = snapshot.export_snapshot(path, types=['vpc', 'subnet'])
+    assert counts == {'vpc': 1, 'subnet': 1}
+    records = list(snapshot.read_snapshot(path, types=['subnet']))
+    assert [record['resource']['CidrBlock'] for record in records] == ['10.0.0.0/24']
+
+
+def test_failed_listing_is_counted_as_an_error(ec2, tmp_path):
+    backend = _FailsOnSubnets()
+    backend.create_vpc(CidrBlock='10.0.0.0/16')
+    clients.registry.set_factory(lambda service, region=None, profile=None, role_arn=None: backend)
+    path = str(tmp_path / 'estate.jsonl.gz')
+    assert snapshot.export_snapshot(path, types=['vpc', 'subnet']) == {'vpc': 1, 'errors': 1}
+    counts = snapshot.export_snapshot(path, targets=[('1', 'us-east-1')], types=['vpc', 'subnet'])
+    assert counts == {'vpc': 1, 'errors': 1}
+
+
+def test_failed_type_does_not_drop_the_later_types(ec2, tmp_path):
+    backend = _FailsOnSubnets()
+    backend.create_vpc(CidrBlock='10.0.0.0/16')
+    backend.create_internet_gateway()
+    clients.registry.set_factory(lambda service, region=None, profile=None, role_arn=None: backend)
+    path = str(tmp_path / 'estate.jsonl.gz')
+    types = ['subnet', 'vpc', 'internet-gateway']
+    expected = {'vpc': 1, 'internet-gateway': 1, 'errors': 1}
+    assert snapshot.export_snapshot(path, types=types) == expected
+    assert snapshot.export_snapshot(path, targets=[('1', 'us-east-1')], types=types) == expected
+    assert {record['type'] for record in snapshot.read_snapshot(path)} == set(expected) - {'errors'}
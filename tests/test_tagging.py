@@ -0,0 +1,45 @@
+from stratus import cirrus
+from stratus import tagging
+
+
+def _subnets(vpc, count):
+    return [cirrus.create_subnet('s{}'.format(index), DryRun=False, VpcId=vpc,
+                                 CidrBlock='10.0.{}.0/24'.format(index))['Subnet']['SubnetId']
+            for index in range(count)]
+
+
+def _tags(ec2, subnet_id):
+    subnet = ec2.describe_subnets(SubnetIds=[subnet_id])['Subnets'][0]
+    return {tag['Key']: tag['Value'] for tag in subnet['Tags']}
+
+
+def test_equal_tags_are_coalesced_into_full_batches(ec2, vpc):
+    subnet_ids = _subnets(vpc, 7)
+    calls = ec2.calls['create_tags']
+    with tagging.TagBatcher(max_resources=3, flush_interval=None) as batcher:
+        for subnet_id in subnet_ids:
+            batcher.add(subnet_id, [{'Key': 'Team', 'Value': 'net'}])
+        batcher.add(subnet_ids[0], [{'Key': 'Tier', 'Value': 'web'}])
+        # The first two full groups of three went out as they filled up.
+        assert batcher.calls == 2
+    assert batcher.calls == 4 and not batcher.failed
+    assert ec2.calls['create_tags'] - calls == 4
+    assert _tags(ec2, subnet_ids[0])['Tier'] == 'web'
+    assert all(_tags(ec2, subnet_id)['Team'] == 'net' for subnet_id in subnet_ids)
+
+
+def test_failed_calls_are_reported(ec2):
+    batcher = tagging.TagBatcher(flush_interval=None)
+    batcher.add('subnet-missing', [{'Key': 'Team', 'Value': 'net'}])
+    batcher.close()
+    assert batcher.failed == [(['subnet-missing'], [{'Key': 'Team', 'Value': 'net'}])]
+
+
+def test_invalid_id_does_not_fail_the_rest_of_the_batch(ec2, vpc):
+    subnet_ids = _subnets(vpc, 5)
+    batcher = tagging.TagBatcher(flush_interval=None)
+    for subnet_id in subnet_ids[:2] + ['subnet-missing'] + subnet_ids[2:]:
+        batcher.add(subnet_id, [{'Key': 'Team', 'Value': 'net'}])
+    batcher.close()
+    assert batcher.failed == [(['subnet-missing'], [{'Key': 'Team', 'Value': 'net'}])]
+    assert all(_tags(ec2, subnet_id)['Team'] == 'net' for subnet_id in subnet_ids)
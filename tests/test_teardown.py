@@ -0,0 +1,48 @@
+from stratus import benchmark
+from stratus import cirrus
+from stratus import mesh
+from stratus import teardown
+from stratus import topology
+
+
+def _build(ec2, subnets=12):
+    results = topology.apply(benchmark.topology_spec(subnets))
+    assert all(response is not None for response in results.values())
+    return results['vpc']['Vpc']['VpcId']
+
+
+def test_route_tables_wait_for_their_subnets_instead_of_disassociating(ec2):
+    vpc_id = _build(ec2)
+    graph = teardown.build_graph(vpc_id, teardown.inventory(vpc_id))
+    assert not [key for key in graph.nodes if key.startswith('rtb-disassoc:')]
+    for key, node in graph.nodes.items():
+        if key.startswith('rtb-delete:'):
+            assert node.deps and all(dep.startswith('subnet-delete:') for dep in node.deps)
+
+
+def test_teardown_removes_everything(ec2):
+    vpc_id = _build(ec2)
+    results = teardown.teardown(vpc_id)
+    assert results['vpc-delete'] is not None
+    assert not ec2.describe_vpcs()['Vpcs']
+    assert not ec2.describe_subnets()['Subnets']
+    assert not ec2.describe_internet_gateways()['InternetGateways']
+
+
+def test_teardown_under_throttling(ec2):
+    ec2.throttle_rate = 0.2
+    ec2.latency = 0.001
+    vpc_id = _build(ec2, subnets=30)
+    other = _build_peer(ec2)
+    assert not mesh.build_mesh([vpc_id, other])['failed']
+    for vpc in (vpc_id, other):
+        assert teardown.teardown(vpc)['vpc-delete'] is not None
+    assert ec2.throttled
+    ec2.throttle_rate = 0
+    assert not ec2.describe_vpcs()['Vpcs']
+
+
+def _build_peer(ec2):
+    response = cirrus.create_vpc('peer', DryRun=False, CidrBlock='10.200.0.0/16',
+                                 InstanceTenancy='default', AmazonProvidedIpv6CidrBlock=False)
+    return response['Vpc']['VpcId']
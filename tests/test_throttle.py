@@ -0,0 +1,76 @@
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from stratus import throttle
+
+
+def _error(operation, code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+def _throttled(times, response='ok'):
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) <= times:
+            raise _error('CreateRoute', 'RequestLimitExceeded')
+        return response
+    return call, calls
+
+
+def test_action_classes():
+    assert throttle.action_class('describe_subnets') == 'describe'
+    assert throttle.action_class('create_route') == 'mutate'
+
+
+def test_bucket_limits_the_rate_after_the_burst():
+    bucket = throttle.TokenBucket(rate=100, capacity=5)
+    start = time.monotonic()
+    for _ in range(15):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_bucket_backs_off_and_recovers():
+    bucket = throttle.TokenBucket(rate=10, capacity=10, min_rate=1)
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 2.5
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+
+def test_throttled_calls_are_retried():
+    limiter = throttle.AdaptiveLimiter(mutate_rate=1000, base_delay=0.001, max_delay=0.001)
+    call, calls = _throttled(2)
+    assert limiter.call('client', 'create_route', call) == 'ok'
+    assert len(calls) == 3 and limiter.throttled == 2
+    assert limiter.bucket('client', 'create_route').rate < 1000
+
+
+def test_retries_give_up_and_other_errors_are_not_retried():
+    limiter = throttle.AdaptiveLimiter(mutate_rate=1000, max_retries=2, base_delay=0.001,
+                                       max_delay=0.001)
+    call, calls = _throttled(10)
+    with pytest.raises(ClientError):
+        limiter.call('client', 'create_route', call)
+    assert len(calls) == 3
+
+    def missing():
+        calls.append(1)
+        raise _error('DeleteRoute', 'InvalidRoute.NotFound')
+    calls.clear()
+    with pytest.raises(ClientError):
+        limiter.call('client', 'delete_route', missing)
+    assert len(calls) == 1
+
+
+def test_buckets_are_per_client_and_action_class():
+    limiter = throttle.AdaptiveLimiter()
+    assert limiter.bucket('a', 'describe_vpcs') is limiter.bucket('a', 'describe_subnets')
+    assert limiter.bucket('a', 'describe_vpcs') is not limiter.bucket('a', 'create_vpc')
+    assert limiter.bucket('a', 'create_vpc') is not limiter.bucket('b', 'create_vpc')
@@ -0,0 +1,42 @@
+from stratus import benchmark
+from stratus import topology
+
+
+def test_public_nat_gateway_waits_for_internet_gateway_attach():
+    graph = topology.build_graph(benchmark.topology_spec(4))
+    assert 'igw-attach:igw' in graph.nodes['nat:nat'].deps
+
+
+def test_private_nat_gateway_does_not_wait_for_internet_gateway():
+    spec = benchmark.topology_spec(4)
+    spec['nat_gateways'][0]['ConnectivityType'] = 'private'
+    graph = topology.build_graph(spec)
+    assert 'igw-attach:igw' not in graph.nodes['nat:nat'].deps
+
+
+def test_prefix_list_routes_get_distinct_keys():
+    spec = benchmark.topology_spec(2)
+    spec['route_tables'][0]['routes'] += [
+        {'DestinationPrefixListId': 'pl-1', 'internet_gateway': 'igw'},
+        {'DestinationPrefixListId': 'pl-2', 'internet_gateway': 'igw'},
+    ]
+    graph = topology.build_graph(spec)
+    assert 'route:public:pl-1' in graph.nodes
+    assert 'route:public:pl-2' in graph.nodes
+
+
+def test_apply_builds_the_spec(ec2):
+    results = topology.apply(benchmark.topology_spec(8))
+    assert all(response is not None for response in results.values())
+    assert len(ec2.describe_subnets()['Subnets']) == 8
+
+
+def test_apply_builds_a_private_nat_gateway_without_internet_gateway(ec2):
+    spec = benchmark.topology_spec(2)
+    del spec['internet_gateways']
+    spec['route_tables'][0]['routes'] = []
+    spec['nat_gateways'] = [{'name': 'nat', 'subnet': 'subnet-0', 'ConnectivityType': 'private'}]
+    results = topology.apply(spec)
+    assert all(response is not None for response in results.values())
+    [nat] = ec2.describe_nat_gateways()['NatGateways']
+    assert nat['ConnectivityType'] == 'private' and nat['NatGatewayAddresses'] == []
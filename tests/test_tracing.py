@@ -0,0 +1,68 @@
+import json
+import time
+
+import botocore.session
+from botocore.stub import Stubber
+
+from stratus import cirrus
+from stratus import dag
+from stratus import tracing
+
+
+def _sleep(seconds):
+    def call():
+        time.sleep(seconds)
+        return seconds
+    return call
+
+
+def test_dag_nodes_and_api_calls_are_nested():
+    client = botocore.session.get_session().create_client(
+        'ec2', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    graph = dag.Graph()
+    graph.add('vpc', cirrus.create_vpc, args=('traced',), kwargs={
+        'client': client, 'DryRun': False, 'CidrBlock': '10.0.0.0/16',
+        'InstanceTenancy': 'default', 'AmazonProvidedIpv6CidrBlock': False})
+    with Stubber(client) as stubber:
+        stubber.add_response('create_vpc', {'Vpc': {'VpcId': 'vpc-1', 'CidrBlock': '10.0.0.0/16'}})
+        with tracing.tracing() as tracer:
+            dag.execute(graph)
+    spans = {span.name: span for span in tracer.spans}
+    assert spans['create_vpc'].parent == spans['vpc'].id
+    assert spans['vpc'].parent == spans['dag.execute'].id
+    assert spans['create_vpc'].category == 'ec2'
+
+
+def test_critical_path_follows_after():
+    graph = dag.Graph()
+    graph.add('slow', _sleep(0.05))
+    graph.add('fast', _sleep(0.001))
+    graph.add('last', _sleep(0.001), after=['slow', 'fast'])
+    with tracing.tracing() as tracer:
+        dag.execute(graph)
+    root = next(span for span in tracer.spans if span.name == 'dag.execute')
+    path = [step.span.name for step in tracer.critical_path(root)]
+    assert path == ['slow', 'last']
+    stats = tracer.parallelism(root)
+    assert stats['leaves'] == 3 and stats['peak'] == 2
+    assert 'Critical path' in tracer.report()
+
+
+def test_errors_are_recorded_and_exported(tmp_path):
+    with tracing.tracing() as tracer:
+        try:
+            with tracing.span('outer'):
+                tracing.traced('inner')(lambda: 1 / 0)()
+        except ZeroDivisionError:
+            pass
+    assert all('ZeroDivisionError' in span.error for span in tracer.spans)
+    path = tmp_path / 'trace.json'
+    assert tracer.export_chrome(str(path)) == 2
+    events = json.loads(path.read_text())['traceEvents']
+    assert {event['name'] for event in events if event.get('ph') == 'X'} == {'outer', 'inner'}
+
+
+def test_disabled_tracing_records_nothing():
+    with tracing.span('ignored') as span:
+        assert span is None
+    assert tracing.propagate(_sleep) is _sleep
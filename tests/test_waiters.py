@@ -0,0 +1,73 @@
+import pytest
+
+from stratus import cirrus
+from stratus import clients
+from stratus import memory
+from stratus import waiters
+
+
+class _PendingEC2(memory.MemoryEC2):
+    '''
+    Reports NAT gateways as pending for the first describes.
+    '''
+
+    def __init__(self, pending_polls, **kwargs):
+        super().__init__(**kwargs)
+        self.pending_polls = pending_polls
+
+    def describe_nat_gateways(self, **kwargs):
+        response = super().describe_nat_gateways(**kwargs)
+        if self.calls['describe_nat_gateways'] <= self.pending_polls:
+            for nat in response['NatGateways']:
+                nat['State'] = 'pending'
+        return response
+
+
+def _nat_gateways(count):
+    vpc_id = cirrus.create_vpc('w', DryRun=False, CidrBlock='10.0.0.0/16', InstanceTenancy='default',
+                               AmazonProvidedIpv6CidrBlock=False)['Vpc']['VpcId']
+    igw_id = cirrus.create_internet_gateway('igw', DryRun=False)['InternetGateway']['InternetGatewayId']
+    cirrus.attach_internet_gateway(DryRun=False, InternetGatewayId=igw_id, VpcId=vpc_id)
+    subnet_id = cirrus.create_subnet('s', DryRun=False, VpcId=vpc_id,
+                                     CidrBlock='10.0.0.0/24')['Subnet']['SubnetId']
+    return [cirrus.create_nat_gateway('nat-{}'.format(index), SubnetId=subnet_id,
+                                      AllocationId='eipalloc-{}'.format(index))
+            ['NatGateway']['NatGatewayId'] for index in range(count)]
+
+
+@pytest.fixture
+def pending_ec2(ec2):
+    backend = _PendingEC2(pending_polls=2)
+    clients.registry.set_factory(lambda service, region=None, profile=None, role_arn=None: backend)
+    return backend
+
+
+def test_many_resources_share_each_describe(pending_ec2):
+    nat_ids = _nat_gateways(5)
+    with waiters.MultiWaiter(min_delay=0.05, max_delay=0.05) as waiter:
+        futures = [waiter.watch_nat_gateway(nat_id) for nat_id in nat_ids]
+        results = [future.result(timeout=5) for future in futures]
+    assert [nat['NatGatewayId'] for nat in results] == nat_ids
+    assert waiter.describes == 3
+
+
+def test_failure_state_and_timeout(pending_ec2):
+    nat_ids = _nat_gateways(1)
+    cirrus.delete_nat_gateway(NatGatewayId=nat_ids[0])
+    pending_ec2.pending_polls = 0
+    with waiters.MultiWaiter(min_delay=0.01) as waiter:
+        with pytest.raises(waiters.ResourceFailed):
+            waiter.watch_nat_gateway(nat_ids[0]).result(timeout=5)
+
+    pending_ec2.pending_polls = 1000
+    with waiters.MultiWaiter(min_delay=0.01, max_delay=0.01, timeout=0.05) as waiter:
+        with pytest.raises(TimeoutError):
+            waiter.watch_nat_gateway(nat_ids[0]).result(timeout=5)
+
+
+def test_watch_after_close_raises(pending_ec2):
+    nat_ids = _nat_gateways(1)
+    with waiters.MultiWaiter(min_delay=0.01) as waiter:
+        waiter.watch_nat_gateway(nat_ids[0])
+    with pytest.raises(RuntimeError):
+        waiter.watch_nat_gateway(nat_ids[0])